@@ -43,5 +43,11 @@ MUSIC_FOLDER = "music"
 # Intervalo de sincronização (em segundos)
 SYNC_INTERVAL = 60
 
+# Próximas entradas da playlist do servidor mantidas em memória
+PLAYLIST_WINDOW_SIZE = 20
+
 # Volume padrão (0.0 a 1.0)
 DEFAULT_VOLUME = 0.5
+
+# Intervalo (em segundos) entre os passos das rampas de volume
+VOLUME_RAMP_INTERVAL = 0.05
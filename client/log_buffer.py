@@ -0,0 +1,183 @@
+"""
+Buffer de logs de atividade (e histórico de execuções) com envio em lote
+"""
+
+import json
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+
+class LogBuffer:
+    """
+    Acumula logs localmente e envia em lotes por uma única thread.
+    Cada registro é anotado num journal em disco ao ser adicionado (uma linha
+    JSON, sem reescrever o buffer), então nada se perde se o player cair
+    antes do envio. O buffer completo é regravado e o journal zerado depois
+    de cada envio; os pendentes são reenviados quando a conexão voltar.
+    """
+
+    def __init__(self, server_url: str, buffer_path: Path, endpoint: str = "/api/logs/batch",
+                 payload_key: str = "logs", flush_interval: float = 5.0, max_batch: int = 100,
+                 max_entries: int = 5000):
+        self.server_url = server_url.rstrip('/')
+        self.buffer_path = Path(buffer_path)
+        self.journal_path = self.buffer_path.with_suffix('.journal')
+        self.endpoint = endpoint
+        self.payload_key = payload_key  # Nome da lista no JSON enviado
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_entries = max_entries  # Limite para não crescer sem fim se ficar offline por dias
+
+        self._pending: list[dict] = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dirty = False
+
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        self._load()
+
+    def _load(self):
+        """Carrega logs pendentes salvos em disco (buffer + journal)"""
+        try:
+            if self.buffer_path.exists():
+                with open(self.buffer_path, 'r', encoding='utf-8') as f:
+                    self._pending = json.load(f)
+        except Exception as e:
+            print(f"Erro ao carregar {self.buffer_path.name}: {e}")
+            self._pending = []
+
+        try:
+            if self.journal_path.exists():
+                with open(self.journal_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            self._pending.append(json.loads(line))
+                        except ValueError:
+                            pass  # Linha cortada por uma queda no meio da escrita
+                self._dirty = True
+        except Exception as e:
+            print(f"Erro ao carregar {self.journal_path.name}: {e}")
+
+        del self._pending[:-self.max_entries]
+        if self._pending:
+            print(f"Pendentes carregados de {self.buffer_path.name}: {len(self._pending)}")
+
+    def _persist(self):
+        """Regrava o buffer com os pendentes e zera o journal"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+
+            # Sob o lock: um add() não pode anotar no journal entre a gravação e a limpeza
+            try:
+                if self._pending:
+                    tmp_path = self.buffer_path.with_suffix('.tmp')
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        json.dump(self._pending, f, ensure_ascii=False)
+                    tmp_path.replace(self.buffer_path)
+                elif self.buffer_path.exists():
+                    self.buffer_path.unlink()
+                if self.journal_path.exists():
+                    self.journal_path.unlink()
+            except Exception as e:
+                print(f"Erro ao salvar {self.buffer_path.name}: {e}")
+                self._dirty = True
+
+    def _journal(self, entry: dict):
+        """Anota o registro no journal (chamar com _lock)"""
+        try:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"Erro ao anotar em {self.journal_path.name}: {e}")
+
+    def add(self, entry: dict):
+        """Adiciona um registro ao buffer (não bloqueia)"""
+        entry.setdefault("timestamp", datetime.now(timezone.utc).isoformat())
+
+        with self._lock:
+            self._pending.append(entry)
+            self._journal(entry)
+            if len(self._pending) > self.max_entries:
+                # Descartar os mais antigos
+                del self._pending[:len(self._pending) - self.max_entries]
+            self._dirty = True
+            full = len(self._pending) >= self.max_batch
+
+        if full:
+            self._wake.set()
+
+    def add_log(self, log_type: str, description: str, details: str = None):
+        """Adiciona um log de atividade ao buffer"""
+        self.add({
+            "type": log_type,
+            "description": description,
+            "details": details
+        })
+
+    def flush(self) -> bool:
+        """Envia todos os logs pendentes. Retorna False se algum lote falhou."""
+        with self._send_lock:
+            while True:
+                with self._lock:
+                    batch = self._pending[:self.max_batch]
+                if not batch:
+                    break
+
+                try:
+                    response = requests.post(
+                        f"{self.server_url}{self.endpoint}",
+                        json={self.payload_key: batch},
+                        timeout=10
+                    )
+                    if 400 <= response.status_code < 500 and response.status_code != 429:
+                        # Lote rejeitado pelo servidor - reenviar não adianta
+                        print(f"Lote rejeitado em {self.endpoint} ({response.status_code}), descartando {len(batch)}")
+                    else:
+                        response.raise_for_status()
+                except Exception as e:
+                    print(f"Registros mantidos no buffer {self.endpoint} ({len(self._pending)}): {type(e).__name__}")
+                    self._persist()
+                    return False
+
+                with self._lock:
+                    # Remover apenas o que foi enviado (novos logs podem ter chegado)
+                    sent = {id(entry) for entry in batch}
+                    self._pending = [entry for entry in self._pending if id(entry) not in sent]
+                    self._dirty = True
+                print(f"Enviados para {self.endpoint}: {len(batch)}")
+
+        self._persist()
+        return True
+
+    def _sender_loop(self):
+        """Loop da thread de envio"""
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        """Inicia a thread de envio"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._sender_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Para a thread de envio, tentando enviar o que restou"""
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        self.flush()
@@ -6,6 +6,7 @@ Entry point principal
 import os
 import sys
 import threading
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 # Adicionar diretório atual ao path
@@ -18,12 +19,14 @@ if not check_single_instance():
     show_already_running()
     sys.exit(0)
 
-from config import SERVER_URL, WEBSOCKET_URL, MUSIC_FOLDER, SYNC_INTERVAL, DEFAULT_VOLUME
+from config import SERVER_URL, WEBSOCKET_URL, MUSIC_FOLDER, SYNC_INTERVAL, DEFAULT_VOLUME, PLAYLIST_WINDOW_SIZE, VOLUME_RAMP_INTERVAL
 from player import MusicPlayer
 from sync import MusicSync
+from playlist_window import PlaylistWindow
 from scheduler import Scheduler
 from websocket_client import NativeWebSocketClient
 from gui import PlayerGUI
+import playlist_engine
 
 
 class FalaVIPPlayer:
@@ -33,8 +36,9 @@ class FalaVIPPlayer:
         self.music_dir = self.base_dir / MUSIC_FOLDER
 
         # Componentes (GUI é criada separadamente se create_gui=False)
-        self.player = MusicPlayer(str(self.music_dir))
+        self.player = MusicPlayer(str(self.music_dir), VOLUME_RAMP_INTERVAL)
         self.sync = MusicSync(SERVER_URL, str(self.music_dir), SYNC_INTERVAL)
+        self.playlist_window = PlaylistWindow(self.sync, PLAYLIST_WINDOW_SIZE)
         self.scheduler = Scheduler()
         self.ws_client = NativeWebSocketClient(WEBSOCKET_URL)
         self.gui = None
@@ -42,7 +46,15 @@ class FalaVIPPlayer:
         # Estado
         self.is_running = True
         self.use_server_playlist = True  # Usar playlist do servidor quando disponível
-        self.current_playlist_position = None  # Posição atual na playlist do servidor
+        self.current_playlist_position = None  # Posição (na playlist do servidor) da música tocando
+        self._next_server_item = None  # Item do servidor definido como próxima música
+        self._current_play = None  # Execução em andamento (histórico proof-of-play)
+
+        # Playlist gerada localmente a partir do plano do servidor (modo offline)
+        self._offline_items: list[dict] = []
+        self._offline_source = None  # (plano, catálogo) que geraram _offline_items
+        self._offline_tail = None  # Último segmento gerado (base para estender o plano)
+        self.following_offline_plan = False
 
         if create_gui:
             self.gui = PlayerGUI()
@@ -54,47 +66,129 @@ class FalaVIPPlayer:
             self.gui = PlayerGUI()
             self._setup_callbacks()
 
-    def _get_next_from_server(self) -> bool:
-        """Tenta obter próxima música do servidor e definir no player"""
+    def _get_next_from_window(self) -> bool:
+        """Define a próxima música a partir da janela local da playlist do servidor (sem rede)"""
         if not self.use_server_playlist:
             return False
 
-        try:
-            next_item = self.sync.get_next_from_server()
-            if next_item and next_item.get('music_id'):
-                music_id = next_item['music_id']
-                event_type = next_item.get('event_type', 'music')
-                position = next_item.get('position')
-
-                # Obter caminho do arquivo
-                filepath = self.sync.get_file_by_id(music_id)
-                if filepath:
-                    is_ad = event_type == 'ad'
-                    self.player.set_next_song(filepath, is_ad=is_ad)
-                    self.current_playlist_position = position
-                    print(f"Próxima do servidor: {next_item.get('music_name')} (pos: {position}, tipo: {event_type})")
-                    return True
+        next_item = self.playlist_window.next_after(self.current_playlist_position)
+        if not next_item:
+            return False
+
+        music_id = next_item['music_id']
+        event_type = next_item.get('event_type', 'music')
+        filepath = self.sync.get_file_by_id(music_id)
+        if not filepath:
+            print(f"Arquivo não encontrado para ID: {music_id}")
+            return False
+
+        self.player.set_next_song(filepath, is_ad=event_type == 'ad')
+        self._next_server_item = {**next_item, "filepath": filepath}
+        self.following_offline_plan = False
+        print(f"Próxima do servidor: {next_item.get('music_name')} (pos: {next_item.get('position')}, tipo: {event_type})")
+        return True
+
+    def _get_offline_items(self) -> list[dict]:
+        """Playlist do plano em cache, gerada com o mesmo algoritmo e semente do servidor"""
+        plan = self.sync.playlist_plan
+        catalogue = self.sync.server_music
+        if self._offline_source != (id(plan), id(catalogue)):
+            self._offline_items = playlist_engine.generate_plan(plan, catalogue)
+            segments = plan.get('segments', [])
+            self._offline_tail = segments[-1] if segments else None
+            self._offline_source = (id(plan), id(catalogue))
+        return self._offline_items
+
+    def _get_next_offline(self) -> bool:
+        """Sem servidor: segue a playlist planejada, gerada localmente a partir do plano em cache"""
+        items = self._get_offline_items()
+        if not items:
+            return False
+
+        after = self.current_playlist_position
+        now = datetime.now()
+        for _ in range(2):
+            for item in items:
+                if item['event_type'] not in playlist_engine.PLAYABLE_EVENTS:
+                    continue
+                if after is not None:
+                    if item['position'] <= after:
+                        continue
                 else:
-                    print(f"Arquivo não encontrado para ID: {music_id}")
-        except Exception as e:
-            print(f"Erro ao obter próxima do servidor: {e}")
+                    # Sem posição conhecida: o item que estaria tocando agora pelo plano
+                    end = datetime.fromisoformat(item['scheduled_time']) + timedelta(seconds=item['duration'] or 0)
+                    if end <= now:
+                        continue
+
+                filepath = self.sync.get_file_by_id(item['music_id'])
+                if not filepath or not Path(filepath).exists():
+                    continue
+
+                self.player.set_next_song(filepath, is_ad=item['event_type'] == 'ad')
+                self._next_server_item = {**item, "filepath": filepath}
+                self.following_offline_plan = True
+                print(f"Próxima do plano offline: {item['music_name']} (pos: {item['position']}, tipo: {item['event_type']})")
+                return True
+
+            # Fim do plano: estender com um segmento seguinte (mesmos agendamentos)
+            after = items[-1]['position']
+            self._offline_tail = playlist_engine.continue_segment(self._offline_tail, items)
+            items.extend(playlist_engine.generate_playlist(self._offline_tail, self.sync.server_music))
 
         return False
 
     def _mark_current_played(self):
-        """Marca a música atual como tocada no servidor"""
+        """Marca a música atual como tocada (confirmada ao servidor em lote, em background)"""
         if self.current_playlist_position is not None:
-            threading.Thread(
-                target=self.sync.mark_song_played,
-                args=(self.current_playlist_position,),
-                daemon=True
-            ).start()
+            self.playlist_window.mark_played(self.current_playlist_position)
+
+    def _start_play_record(self, song_path: str):
+        """Abre o registro de execução da música que começou a tocar"""
+        server_item = self._next_server_item
+        self._next_server_item = None
+
+        if server_item and server_item.get("filepath") == song_path:
+            music_id = server_item.get("music_id")
+            event_type = server_item.get("event_type", "music")
+            position = server_item.get("position")
+            self.current_playlist_position = position
+        else:
+            # Playlist local (offline) ou música definida pelo scheduler local
+            music_id = self.sync.get_id_by_file(song_path)
+            event_type = "ad" if self.player.is_playing_ad else "music"
+            position = None
+
+        self._current_play = {
+            "music_id": music_id,
+            "music_name": Path(song_path).name,
+            "event_type": event_type,
+            "playlist_position": position,
+            "started_at": datetime.now(timezone.utc).isoformat()
+        }
+
+    def _finish_play_record(self, completed: bool = False, skipped: bool = False):
+        """Fecha a execução atual e envia para o histórico"""
+        record = self._current_play
+        if record is None:
+            return
+
+        self._current_play = None
+        record.update({
+            "ended_at": datetime.now(timezone.utc).isoformat(),
+            "completed": completed,
+            "skipped": skipped
+        })
+        self.sync.send_play(record)
 
     def _setup_callbacks(self):
         """Configura todos os callbacks"""
 
         # Callbacks do Player
         def on_song_change(song_name):
+            # Troca sem fim natural da anterior = música pulada
+            self._finish_play_record(skipped=True)
+            self._start_play_record(self.player.current_song)
+
             next_song = self.player.peek_next_song()
             next_song_name = Path(next_song).name if next_song else None
 
@@ -104,30 +198,26 @@ class FalaVIPPlayer:
 
             # Enviar log de música ou propaganda tocada
             if self.player.is_playing_ad:
-                threading.Thread(
-                    target=self.sync.send_log,
-                    args=("ad", f"Propaganda tocada: {song_name}"),
-                    daemon=True
-                ).start()
+                self.sync.send_log("ad", f"Propaganda tocada: {song_name}")
             else:
-                threading.Thread(
-                    target=self.sync.send_log,
-                    args=("music", f"Música tocada: {song_name}"),
-                    daemon=True
-                ).start()
+                self.sync.send_log("music", f"Música tocada: {song_name}")
 
         def on_song_end():
-            # Marcar música atual como tocada no servidor
+            # Registrar execução completa e marcar como tocada no servidor
+            self._finish_play_record(completed=True)
             self._mark_current_played()
 
             # Só conta como música se NÃO era propaganda (para scheduler local)
             if not self.player.is_playing_ad:
                 self.scheduler.on_song_finished()
 
-            # Tentar obter próxima música do servidor
+            # Próxima música da janela da playlist (já em memória)
             # Se conseguir, a próxima música já estará definida no player
-            if not self._get_next_from_server():
-                print("Usando playlist local (servidor não disponível)")
+            if not self._get_next_from_window():
+                if self._get_next_offline():
+                    print("Servidor não disponível - seguindo plano da playlist")
+                else:
+                    print("Usando playlist local (servidor não disponível)")
 
         self.player.on_song_change = on_song_change
         self.player.on_song_end = on_song_end
@@ -153,7 +243,8 @@ class FalaVIPPlayer:
                 schedules.get('volume_schedules', []),
                 schedules.get('ad_schedules', []),
                 schedules.get('scheduled_songs', []),
-                schedules.get('hourly_volumes', {})
+                schedules.get('hourly_volumes', {}),
+                schedules.get('volume_timeline')
             )
 
         self.sync.on_sync_complete = on_sync_complete
@@ -165,21 +256,15 @@ class FalaVIPPlayer:
             self.gui.root.after(0, lambda: self.gui.update_status(True, "Conectado ao servidor"))
             self._send_status()
             # Log de conexão estabelecida
-            threading.Thread(
-                target=self.sync.send_log,
-                args=("connection", "Conexão estabelecida com o servidor"),
-                daemon=True
-            ).start()
+            self.sync.send_log("connection", "Conexão estabelecida com o servidor")
+            # Deltas enviados enquanto estava desconectado se perderam: recarregar a janela
+            self.playlist_window.refresh()
 
         def on_ws_disconnect():
             self.gui.root.after(0, lambda: self.gui.update_status(False, "Desconectado - Modo Offline"))
             self.gui.root.after(0, lambda: self.gui.update_sync_info(f"⚠️ OFFLINE | {len(self.player.playlist)} músicas em cache"))
-            # Log de conexão perdida (pode falhar se offline)
-            threading.Thread(
-                target=self.sync.send_log,
-                args=("connection", "Conexão perdida com o servidor"),
-                daemon=True
-            ).start()
+            # Log de conexão perdida (fica no buffer até o servidor voltar)
+            self.sync.send_log("connection", "Conexão perdida com o servidor")
 
         def on_init(settings):
             # Atualizar configurações
@@ -192,7 +277,8 @@ class FalaVIPPlayer:
                 settings.get('volume_schedules', []),
                 settings.get('ad_schedules', []),
                 settings.get('scheduled_songs', []),
-                settings.get('hourly_volumes', {})
+                settings.get('hourly_volumes', {}),
+                settings.get('volume_timeline')
             )
 
             # Salvar no cache para operação offline
@@ -224,10 +310,12 @@ class FalaVIPPlayer:
             self._send_status()
 
         def on_skip():
-            # Skip vindo do servidor (dashboard) - playlist já foi regenerada
-            # Buscar próxima música antes de pular
-            self._get_next_from_server()
+            # Skip vindo do servidor (dashboard) - o servidor já marcou a atual como tocada
+            if not self._get_next_from_window():
+                self._get_next_offline()
             self.player.skip()
+            if self.playlist_window.version is None:
+                self.playlist_window.refresh()
 
         def on_schedule_updated(data):
             # Atualizar scheduler com os novos dados de schedule (enviados via WebSocket)
@@ -235,7 +323,8 @@ class FalaVIPPlayer:
                 data.get('volume_schedules', []),
                 data.get('ad_schedules', []),
                 data.get('scheduled_songs', []),
-                data.get('hourly_volumes', {})
+                data.get('hourly_volumes', {}),
+                data.get('volume_timeline')
             )
 
             # Salvar no cache para operação offline
@@ -249,7 +338,37 @@ class FalaVIPPlayer:
             # Playlist foi atualizada/regenerada no servidor
             # Buscar próxima música do servidor para manter sincronizado
             print("Playlist atualizada no servidor, sincronizando...")
-            self._get_next_from_server()
+            if data.get('plan'):
+                self.sync.save_playlist_plan(data['plan'])
+            if self.playlist_window.version is not None:
+                # A janela já foi atualizada pelo playlist_delta correspondente
+                return
+            if data.get('type') == 'playlist_generated':
+                # Playlist nova: posições recomeçam, a música atual não pertence a ela
+                self.playlist_window.reset()
+                self.current_playlist_position = None
+            # Atualizar a janela em background e redefinir a próxima música
+            self.playlist_window.refresh(on_done=self._get_next_from_window)
+
+        def on_playlist_delta(data):
+            ops = self.playlist_window.apply_delta(data)
+            if ops is None:
+                # Versão perdida: buscar o estado completo e redefinir a próxima música
+                print("Delta da playlist fora de sequência, ressincronizando...")
+                self.playlist_window.refresh(on_done=self._get_next_from_window)
+                return
+
+            for op in ops:
+                if op['op'] == 'reset':
+                    # Playlist nova: posições recomeçam, a música atual não pertence a ela
+                    self.current_playlist_position = None
+                elif op['op'] == 'insert' and self.current_playlist_position is not None \
+                        and self.current_playlist_position >= op['item']['position']:
+                    self.current_playlist_position += 1
+
+            # "played" só remove entradas; as demais podem mudar a próxima música
+            if any(op['op'] != 'played' for op in ops):
+                self._get_next_from_window()
 
         self.ws_client.on_connect = on_ws_connect
         self.ws_client.on_disconnect = on_ws_disconnect
@@ -262,6 +381,7 @@ class FalaVIPPlayer:
         self.ws_client.on_schedule_updated = on_schedule_updated
         self.ws_client.on_music_updated = on_music_updated
         self.ws_client.on_playlist_updated = on_playlist_updated
+        self.ws_client.on_playlist_delta = on_playlist_delta
 
         # Callbacks do Scheduler
         def on_scheduled_volume(volume):
@@ -269,13 +389,24 @@ class FalaVIPPlayer:
             self.gui.root.after(0, lambda: self.gui.update_volume(volume))
 
             # Enviar log de volume agendado
-            threading.Thread(
-                target=self.sync.send_log,
-                args=("volume_scheduled", f"Volume ajustado para {int(volume * 100)}%", "Ajuste automático por hora"),
-                daemon=True
-            ).start()
+            self.sync.send_log("volume_scheduled", f"Volume ajustado para {int(volume * 100)}%", "Ajuste automático por hora")
+
+        def on_scheduled_ramp(volume, seconds):
+            # Um log e uma atualização da GUI por rampa, não por passo
+            self.player.ramp_volume(
+                volume, seconds,
+                on_done=lambda: self.gui.root.after(0, lambda: self.gui.update_volume(volume)),
+                on_cancel=self.scheduler.on_ramp_cancelled
+            )
+            self.sync.send_log(
+                "volume_scheduled", f"Volume ajustado para {int(volume * 100)}%",
+                f"Transição de {int(seconds)}s"
+            )
 
         def on_play_ad(music_id):
+            # Seguindo o plano offline, as propagandas já estão na playlist
+            if self.following_offline_plan:
+                return
             # Apenas define a propaganda como próxima música
             # O player tocará automaticamente quando a música atual terminar
             filepath = self.sync.get_file_by_id(music_id)
@@ -284,12 +415,15 @@ class FalaVIPPlayer:
                 print(f"Propaganda agendada: {Path(filepath).name}")
 
         def on_scheduled_song(music_id):
+            if self.following_offline_plan:
+                return
             filepath = self.sync.get_file_by_id(music_id)
             if filepath:
                 self.player.set_next_song(filepath)
                 self.player.skip()
 
         self.scheduler.on_volume_change = on_scheduled_volume
+        self.scheduler.on_volume_ramp = on_scheduled_ramp
         self.scheduler.on_play_ad = on_play_ad
         self.scheduler.on_play_song = on_scheduled_song
 
@@ -306,29 +440,29 @@ class FalaVIPPlayer:
             self._send_status()
 
         def gui_skip():
-            def do_skip():
-                # Notificar servidor sobre o skip (aguarda regeneração)
-                if self.sync.notify_skip():
-                    # Servidor regenerou, buscar próxima música correta
-                    self._get_next_from_server()
+            # Próxima música da janela local: o skip é imediato
+            if not self._get_next_from_window():
+                if self._get_next_offline():
+                    print("Skip offline - seguindo plano da playlist")
                 else:
-                    # Offline - usar playlist local
                     print("Skip offline - usando playlist local")
-                # Pular para próxima
-                self.player.skip()
+            self.player.skip()
+
+            def notify_skip():
+                # Servidor marca a pulada e estende a playlist se preciso; depois atualizar a janela.
+                # As anteriores são confirmadas antes, para o servidor não marcar a errada
+                self.playlist_window.flush_played()
+                if self.sync.notify_skip():
+                    self.playlist_window.refresh()
 
             # Executar em thread para não bloquear GUI
-            threading.Thread(target=do_skip, daemon=True).start()
+            threading.Thread(target=notify_skip, daemon=True).start()
 
         def gui_volume(volume):
             self.player.set_volume(volume)
             self._send_status()
             # Log de alteração manual de volume
-            threading.Thread(
-                target=self.sync.send_log,
-                args=("volume_manual", f"Volume ajustado para {int(volume * 100)}%", "Ajuste pelo cliente"),
-                daemon=True
-            ).start()
+            self.sync.send_log("volume_manual", f"Volume ajustado para {int(volume * 100)}%", "Ajuste pelo cliente")
 
         self.gui.on_play = gui_play
         self.gui.on_pause = gui_pause
@@ -367,11 +501,7 @@ class FalaVIPPlayer:
         print("Iniciando FalaVIP Music Player...")
 
         # Log de início do aplicativo
-        threading.Thread(
-            target=self.sync.send_log,
-            args=("app", "Aplicativo iniciado"),
-            daemon=True
-        ).start()
+        self.sync.send_log("app", "Aplicativo iniciado")
 
         # Sincronizar músicas inicialmente
         self.gui.update_sync_info("Sincronizando músicas...")
@@ -384,13 +514,17 @@ class FalaVIPPlayer:
                 schedules.get('volume_schedules', []),
                 schedules.get('ad_schedules', []),
                 schedules.get('scheduled_songs', []),
-                schedules.get('hourly_volumes', {})
+                schedules.get('hourly_volumes', {}),
+                schedules.get('volume_timeline')
             )
             if self.sync.is_offline:
                 print("Schedules carregados do CACHE (modo offline)")
             else:
                 print("Schedules carregados do servidor")
 
+        # Plano da playlist (semente + agendamentos) para geração offline
+        self.sync.sync_playlist_plan()
+
         # Carregar playlist (apenas músicas, sem propagandas)
         music_files = self.sync.get_music_files()
         self.player.load_playlist(shuffle=True, music_files=music_files)
@@ -402,11 +536,7 @@ class FalaVIPPlayer:
         print("Iniciando FalaVIP Music Player...")
 
         # Log de início do aplicativo
-        threading.Thread(
-            target=self.sync.send_log,
-            args=("app", "Aplicativo iniciado"),
-            daemon=True
-        ).start()
+        self.sync.send_log("app", "Aplicativo iniciado")
 
         self._start_components()
 
@@ -425,6 +555,7 @@ class FalaVIPPlayer:
         # Iniciar componentes
         self.player.start_monitoring()
         self.sync.start_sync()
+        self.playlist_window.start()
         self.scheduler.start()
         self.ws_client.connect()
 
@@ -441,8 +572,10 @@ class FalaVIPPlayer:
         # Iniciar reprodução - tentar usar playlist do servidor
         if self.player.playlist:
             # Tentar obter primeira música do servidor
-            if not self.sync.is_offline and self._get_next_from_server():
+            if not self.sync.is_offline and self.playlist_window.load() and self._get_next_from_window():
                 print("Usando playlist do servidor")
+            elif self._get_next_offline():
+                print("Servidor indisponível - usando plano da playlist em cache")
             else:
                 print("Usando playlist local")
             self.player.play()
@@ -461,13 +594,17 @@ class FalaVIPPlayer:
         print("Encerrando FalaVIP Music Player...")
         self.is_running = False
 
-        # Log de encerramento do aplicativo (síncrono para garantir envio)
+        # Log de encerramento do aplicativo (enviado no flush final do stop_sync)
         try:
             self.sync.send_log("app", "Aplicativo encerrado")
         except:
             pass
 
+        # Execução interrompida pelo encerramento (nem completa nem pulada)
+        self._finish_play_record()
+
         self.player.cleanup()
+        self.playlist_window.stop()
         self.sync.stop_sync()
         self.scheduler.stop()
         self.ws_client.disconnect()
@@ -522,8 +659,10 @@ def main():
                     schedules.get('volume_schedules', []),
                     schedules.get('ad_schedules', []),
                     schedules.get('scheduled_songs', []),
-                    schedules.get('hourly_volumes', {})
+                    schedules.get('hourly_volumes', {}),
+                    schedules.get('volume_timeline')
                 )
+            app.sync.sync_playlist_plan()
 
             # Sync prioritário (baixa as próximas 3 músicas se não tiver)
             log_error("Iniciando sync_priority...")
@@ -5,6 +5,7 @@ Player de música usando pygame
 import os
 import random
 import threading
+import time
 from pathlib import Path
 from typing import Callable, Optional
 
@@ -26,7 +27,7 @@ except ImportError as e:
 
 
 class MusicPlayer:
-    def __init__(self, music_folder: str):
+    def __init__(self, music_folder: str, ramp_interval: float = 0.05):
         self.music_folder = Path(music_folder)
         self.music_folder.mkdir(exist_ok=True)
 
@@ -55,6 +56,14 @@ class MusicPlayer:
         self._monitor_thread: Optional[threading.Thread] = None
         self._running: bool = False
 
+        # Rampa de volume em andamento: (volume inicial, alvo, início monotônico, duração, on_done, on_cancel)
+        self.ramp_interval = ramp_interval
+        self._ramp: Optional[tuple] = None
+        self._ramp_lock = threading.Lock()
+        self._ramp_wake = threading.Event()
+        self._ramp_thread: Optional[threading.Thread] = None
+        self._ramp_running: bool = False
+
         # Definir volume inicial
         pygame.mixer.music.set_volume(self.volume)
 
@@ -263,10 +272,75 @@ class MusicPlayer:
         self.play()
 
     def set_volume(self, volume: float):
-        """Define o volume (0.0 a 1.0)"""
+        """Define o volume (0.0 a 1.0); cancela a rampa em andamento (avisando o on_cancel dela)"""
+        with self._ramp_lock:
+            ramp, self._ramp = self._ramp, None
         self.volume = max(0.0, min(1.0, volume))
         pygame.mixer.music.set_volume(self.volume)
 
+        on_cancel = ramp[5] if ramp else None
+        if on_cancel:
+            try:
+                on_cancel()
+            except Exception as e:
+                print(f"Erro ao cancelar a rampa de volume: {e}")
+
+    def ramp_volume(self, volume: float, duration: float, on_done: Optional[Callable[[], None]] = None,
+                    on_cancel: Optional[Callable[[], None]] = None):
+        """
+        Leva o volume até o alvo em uma rampa linear de duration segundos,
+        atualizada a cada ramp_interval pela thread de rampa. on_done é chamado
+        uma vez, no fim; se a rampa for cancelada por set_volume, é chamado
+        on_cancel no lugar. Uma rampa nova substitui a anterior sem cancelá-la.
+        """
+        volume = max(0.0, min(1.0, volume))
+        if duration <= 0:
+            with self._ramp_lock:
+                self._ramp = None
+                self.volume = volume
+                pygame.mixer.music.set_volume(self.volume)
+            if on_done:
+                on_done()
+            return
+
+        with self._ramp_lock:
+            self._ramp = (self.volume, volume, time.monotonic(), duration, on_done, on_cancel)
+        self._start_ramp_thread()
+        self._ramp_wake.set()
+
+    def _ramp_loop(self):
+        """Aplica as rampas de volume em passos de ramp_interval"""
+        while self._ramp_running:
+            with self._ramp_lock:
+                ramp = self._ramp
+                if ramp:
+                    start_volume, target, started, duration, on_done, _ = ramp
+                    progress = min((time.monotonic() - started) / duration, 1.0)
+                    self.volume = start_volume + (target - start_volume) * progress
+                    pygame.mixer.music.set_volume(self.volume)
+                    if progress >= 1.0:
+                        self._ramp = None
+
+            if ramp and progress >= 1.0:
+                if on_done:
+                    try:
+                        on_done()
+                    except Exception as e:
+                        print(f"Erro no fim da rampa de volume: {e}")
+                continue
+
+            # Sem rampa: dormir até a próxima
+            self._ramp_wake.wait(self.ramp_interval if ramp else None)
+            self._ramp_wake.clear()
+
+    def _start_ramp_thread(self):
+        if self._ramp_thread and self._ramp_thread.is_alive():
+            return
+
+        self._ramp_running = True
+        self._ramp_thread = threading.Thread(target=self._ramp_loop, daemon=True)
+        self._ramp_thread.start()
+
     def set_next_song(self, song_path: str, is_ad: bool = False):
         """Define a próxima música a ser tocada"""
         self.next_song_override = song_path
@@ -324,5 +398,7 @@ class MusicPlayer:
     def cleanup(self):
         """Limpa recursos"""
         self.stop_monitoring()
+        self._ramp_running = False
+        self._ramp_wake.set()
         self.stop()
         pygame.mixer.quit()
@@ -0,0 +1,197 @@
+"""
+Janela local das próximas entradas da playlist do servidor
+
+Mantém em memória as próximas N entradas (buscadas em background) para que
+a próxima música seja escolhida na hora, sem chamada HTTP no fim da faixa.
+As posições tocadas são confirmadas ao servidor em lote pela mesma thread:
+como /api/playlist/mark-played/{position} marca tudo até a posição, basta
+enviar a maior posição pendente.
+
+Depois da primeira carga, a janela segue os playlist_delta do WebSocket
+(sem HTTP); só volta a buscar /api/playlist/window se perder uma versão.
+"""
+
+import threading
+from typing import Callable, Optional
+
+from playlist_engine import PLAYABLE_EVENTS
+
+
+class PlaylistWindow:
+    def __init__(self, sync, size: int = 20, refresh_interval: int = 60):
+        self.sync = sync
+        self.size = size
+        self.refresh_interval = refresh_interval
+
+        self._items: list[dict] = []
+        self._lock = threading.Lock()
+
+        # Maior posição tocada ainda não confirmada ao servidor
+        self._pending_played: Optional[int] = None
+
+        # Chamados (na thread da janela) após a próxima atualização
+        self._after_refresh: list[Callable[[], None]] = []
+
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._running: bool = False
+
+        # Última atualização bem-sucedida (False enquanto o servidor não respondeu)
+        self.loaded: bool = False
+
+        # Versão da playlist no servidor (None: servidor sem deltas ou ainda não carregado)
+        self.epoch: Optional[str] = None
+        self.version: Optional[int] = None
+
+    def next_after(self, position: Optional[int]) -> Optional[dict]:
+        """Primeira entrada tocável depois da posição (None = a primeira da janela)"""
+        with self._lock:
+            candidates = [
+                item for item in self._items
+                if item.get('music_id') and item.get('event_type', 'music') in PLAYABLE_EVENTS
+                and (position is None or item['position'] > position)
+            ]
+            remaining = len(candidates)
+
+        # Janela acabando: buscar mais sem esperar o intervalo
+        if remaining <= self.size // 2:
+            self.refresh()
+        return candidates[0] if candidates else None
+
+    def mark_played(self, position: int):
+        """Registra a posição como tocada (enviada ao servidor em background)"""
+        with self._lock:
+            if self._pending_played is None or position > self._pending_played:
+                self._pending_played = position
+            self._items = [item for item in self._items if item['position'] > position]
+        self._wake.set()
+
+    def reset(self):
+        """Playlist regenerada no servidor: posições antigas não valem mais"""
+        with self._lock:
+            self._items = []
+            self._pending_played = None
+
+    def apply_delta(self, message: dict) -> Optional[list]:
+        """
+        Aplica um playlist_delta e retorna as operações aplicadas ([] se a
+        mensagem já estava no estado carregado). None se a versão não segue a
+        atual (mensagem perdida ou servidor reiniciado): buscar o estado completo.
+        """
+        with self._lock:
+            if self.version is None or message.get('epoch') != self.epoch:
+                return None
+            if message.get('version', 0) <= self.version:
+                return []
+            if message.get('base_version') != self.version:
+                return None
+
+            ops = message.get('ops', [])
+            for op in ops:
+                self._apply(op)
+            self.version = message['version']
+            return ops
+
+    def _apply(self, op: dict):
+        kind = op.get('op')
+        if kind == 'reset':
+            self._items = list(op.get('items', []))
+            self._pending_played = None
+        elif kind == 'append':
+            known = {item['position'] for item in self._items}
+            self._items.extend(item for item in op.get('items', []) if item['position'] not in known)
+        elif kind == 'insert':
+            inserted = op['item']
+            position = inserted['position']
+            for item in self._items:
+                if item['position'] >= position:
+                    item['position'] += 1
+            # A confirmação pendente se refere às posições de antes do deslocamento
+            if self._pending_played is not None and self._pending_played >= position:
+                self._pending_played += 1
+            self._items.append(dict(inserted))
+        elif kind == 'played':
+            self._items = [item for item in self._items if item['position'] > op['position']]
+        self._items.sort(key=lambda item: item['position'])
+
+    def refresh(self, on_done: Optional[Callable[[], None]] = None):
+        """Pede uma atualização da janela (assíncrona)"""
+        if on_done:
+            with self._lock:
+                self._after_refresh.append(on_done)
+        self._wake.set()
+
+    def flush_played(self):
+        """Envia ao servidor a maior posição tocada pendente"""
+        with self._lock:
+            position = self._pending_played
+        if position is None:
+            return
+
+        if self.sync.mark_song_played(position):
+            with self._lock:
+                # Outra posição pode ter chegado durante o envio
+                if self._pending_played == position:
+                    self._pending_played = None
+
+    def load(self) -> bool:
+        """Busca a janela no servidor (bloqueante; o loop chama em background)"""
+        state = self.sync.get_playlist_window(limit=self.size)
+        if state is not None:
+            items = state['items']
+        else:
+            # Servidor sem /api/playlist/window: lista simples, sem deltas
+            items = self.sync.get_playlist(limit=self.size)
+            if items is None:
+                return False
+
+        with self._lock:
+            # Entradas já tocadas aqui mas ainda não confirmadas continuam fora
+            played = self._pending_played
+            self._items = [item for item in items if played is None or item['position'] > played]
+            self.epoch = state['epoch'] if state else None
+            self.version = state['version'] if state else None
+        self.loaded = True
+        return True
+
+    def _loop(self):
+        while self._running:
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+            if not self._running:
+                break
+
+            try:
+                # Confirmar primeiro, para a busca já vir sem as tocadas
+                self.flush_played()
+                self.load()
+            except Exception as e:
+                print(f"Erro ao atualizar janela da playlist: {e}")
+
+            with self._lock:
+                callbacks, self._after_refresh = self._after_refresh, []
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Erro no callback da janela da playlist: {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        self._wake.set()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        # Última tentativa de confirmar o que foi tocado
+        try:
+            self.flush_played()
+        except Exception:
+            pass
@@ -1,12 +1,39 @@
 """
 Agendador de volumes e propagandas
+
+Os agendamentos são compilados em tabelas por minuto do dia quando chegam
+(update_schedules); o volume vem da linha do tempo compilada pelo servidor
+(volume_timeline.py). A thread dorme até o próximo evento (mudança na linha
+do tempo, propaganda vencida, música agendada) em vez de acordar
+periodicamente. Gradientes e mudanças de volume são entregues ao player
+como uma rampa (on_volume_ramp: alvo e duração); sem esse callback, o
+gradiente é reavaliado em passos curtos. Se o player cancelar a rampa
+(set_volume: reconexão, volume do servidor ou ajuste manual), ele avisa
+on_ramp_cancelled e a próxima verificação refaz a rampa a partir do ponto
+atual.
 """
 
 import threading
-import time
+from bisect import bisect_right
 from datetime import datetime, timedelta
 from typing import Callable, Optional
 
+from volume_timeline import VolumeTimeline
+
+# Sem on_volume_ramp, o gradiente é aplicado em passos de ~1% de volume, entre 1 s e 60 s
+GRADIENT_VOLUME_STEP = 0.01
+GRADIENT_MIN_INTERVAL = 1.0
+GRADIENT_MAX_INTERVAL = 60.0
+
+# Duração da transição nas mudanças de volume fixo (com on_volume_ramp)
+STEP_RAMP_SECONDS = 5.0
+
+# Propagandas por tempo vencidas juntas tocam uma por vez, com este espaço
+AD_SPACING = 10
+
+# Limite de sono: acompanha ajustes do relógio do sistema (NTP, suspensão)
+MAX_SLEEP = 60.0
+
 
 class Scheduler:
     def __init__(self):
@@ -35,25 +62,59 @@ class Scheduler:
         self.on_volume_change: Optional[Callable[[float], None]] = None
         self.on_play_ad: Optional[Callable[[str], None]] = None
         self.on_play_song: Optional[Callable[[str], None]] = None
+        self.on_volume_ramp: Optional[Callable[[float, float], None]] = None  # (volume alvo, segundos)
 
         # Thread de monitoramento
         self._scheduler_thread: Optional[threading.Thread] = None
         self._running: bool = False
+        self._wake = threading.Event()
+        # Reentrante: os callbacks rodam com o lock e podem atualizar os agendamentos
+        self._lock = threading.RLock()
 
         # Volume atual (para comparação)
         self._current_scheduled_volume: Optional[float] = None
-        self._last_hour_checked: int = -1
+
+        # Segmento de gradiente cuja rampa está com o player (o mesmo segmento não gera
+        # outra rampa enquanto ela não for cancelada)
+        self._ramping_segment: Optional[tuple] = None
+
+        # Tabelas compiladas (ver _compile)
+        self.volume_timeline: list = []
+        self._timeline = VolumeTimeline([])
+        self._volume_changes: list[int] = []
+        self._time_ads: list[dict] = []
+        self._song_ads: list[dict] = []
+        self._song_ads_interval: int = 0
+        self._songs_by_minute: dict[int, list[dict]] = {}
+        self._song_minutes: list[int] = []
 
     def update_schedules(self, volume_schedules: list, ad_schedules: list,
-                        scheduled_songs: list, hourly_volumes: dict = None):
-        """Atualiza todos os agendamentos"""
-        self.volume_schedules = volume_schedules
-        self.ad_schedules = ad_schedules
-        self.scheduled_songs = scheduled_songs
-        if hourly_volumes:
-            self.hourly_volumes = hourly_volumes
+                        scheduled_songs: list, hourly_volumes: dict = None,
+                        volume_timeline: list = None):
+        """Atualiza todos os agendamentos (volume_timeline: segmentos compilados pelo servidor)"""
+        with self._lock:
+            self.volume_schedules = volume_schedules
+            self.ad_schedules = ad_schedules
+            self.scheduled_songs = scheduled_songs
+            if hourly_volumes:
+                self.hourly_volumes = hourly_volumes
+            self.volume_timeline = volume_timeline or []
+            self._compile()
+            # Reaplicar o volume agendado (e refazer a rampa) com as tabelas novas
+            self._ramping_segment = None
+            self._current_scheduled_volume = None
         print(f"Schedules atualizados: {len(ad_schedules)} ads, {len(scheduled_songs)} músicas, {len(hourly_volumes or {})} volumes/hora")
 
+        # Recalcular o próximo evento com as tabelas novas
+        self._wake.set()
+
+    def on_ramp_cancelled(self):
+        """Chamado pelo player quando uma rampa entregue por on_volume_ramp é cancelada"""
+        with self._lock:
+            self._ramping_segment = None
+            self._current_scheduled_volume = None
+        self._wake.set()
+
     def on_song_finished(self):
         """Chamado quando uma música termina de tocar"""
         self.songs_played_count += 1
@@ -65,146 +126,110 @@ class Scheduler:
         parts = time_str.split(':')
         return int(parts[0]) * 60 + int(parts[1])
 
-    def _get_current_minutes(self) -> int:
-        """Retorna minutos desde meia-noite"""
-        now = datetime.now()
-        return now.hour * 60 + now.minute
-
-    def _check_hourly_volume(self):
-        """Verifica e aplica volume por hora"""
-        current_hour = datetime.now().hour
+    # ============ COMPILAÇÃO ============
+
+    def _compile(self):
+        """Converte os agendamentos em tabelas por minuto do dia (chamar com o lock)"""
+        if self.volume_timeline:
+            self._timeline = VolumeTimeline(self.volume_timeline)
+        else:
+            # Servidor antigo (ou cache sem linha do tempo): compilar aqui, com as mesmas regras
+            self._timeline = VolumeTimeline.from_schedules(self.hourly_volumes, self.volume_schedules)
+        self._volume_changes = [segment[0] for segment in self._timeline.segments]
+
+        # Propagandas ativas, na ordem de rotação
+        enabled = sorted(
+            (ad for ad in self.ad_schedules if ad.get('enabled', True)),
+            key=lambda x: x.get('rotation_order', 0)
+        )
+        self._time_ads = [ad for ad in enabled if ad.get('interval_type') in ('minutes', None)]
+        self._song_ads = [ad for ad in enabled if ad.get('interval_type') == 'songs']
+        # Menor intervalo configurado
+        self._song_ads_interval = min((ad.get('interval_value', 5) for ad in self._song_ads), default=0)
 
-        # Só verifica se mudou de hora
-        if current_hour == self._last_hour_checked:
+        self._songs_by_minute = {}
+        for schedule in self.scheduled_songs:
+            minute = self._time_str_to_minutes(schedule['scheduled_time'])
+            self._songs_by_minute.setdefault(minute, []).append(schedule)
+        self._song_minutes = sorted(self._songs_by_minute)
+
+    # ============ EVENTOS ============
+
+    def _check_volume_schedule(self, now: datetime) -> Optional[float]:
+        """
+        Aplica o volume da linha do tempo (volume por hora, faixas e gradientes).
+        Retorna em quantos segundos reavaliar o gradiente, ou None fora de gradiente.
+        """
+        index = self._timeline.segment_at(now)
+        segment = self._timeline.segments[index]
+        if segment != self._ramping_segment:
+            self._ramping_segment = None
+
+        _, volume_start, volume_end = segment
+        volume = round(self._timeline.volume_at(now), 3)
+        is_gradient = volume_start != volume_end
+        next_step = None
+
+        if is_gradient:
+            midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            segment_end = midnight + timedelta(minutes=self._timeline.segment_end(index))
+            remaining = (segment_end - now).total_seconds()
+
+            if self.on_volume_ramp:
+                self._start_gradient_ramp(segment, volume, volume_end, remaining)
+                return None
+
+            slope = abs(volume_end - volume_start) / ((self._timeline.segment_end(index) - segment[0]) * 60)
+            next_step = min(max(GRADIENT_VOLUME_STEP / slope, GRADIENT_MIN_INTERVAL), GRADIENT_MAX_INTERVAL, remaining)
+
+        if self._current_scheduled_volume != volume:
+            self._current_scheduled_volume = volume
+            print(f"Volume agendado: {int(volume * 100)}% {'(gradiente)' if is_gradient else ''}")
+            if self.on_volume_ramp:
+                self.on_volume_ramp(volume, STEP_RAMP_SECONDS)
+            elif self.on_volume_change:
+                self.on_volume_change(volume)
+        return next_step
+
+    def _start_gradient_ramp(self, segment: tuple, volume: float, volume_end: float, seconds: float):
+        """Entrega o restante do gradiente ao player como uma única rampa"""
+        if self._ramping_segment == segment:
             return
+        self._ramping_segment = segment
 
-        self._last_hour_checked = current_hour
-
-        # Busca volume para a hora atual
-        volume = self.hourly_volumes.get(current_hour) or self.hourly_volumes.get(str(current_hour))
+        # A rampa parte do volume atual do player
+        self._current_scheduled_volume = round(volume_end, 3)
+        print(f"Volume agendado: {int(volume * 100)}% -> {int(volume_end * 100)}% em {int(seconds)}s (gradiente)")
+        self.on_volume_ramp(volume_end, seconds)
 
-        if volume is not None:
-            if self._current_scheduled_volume != volume:
-                self._current_scheduled_volume = volume
-                print(f"Aplicando volume da hora {current_hour}: {int(volume * 100)}%")
-                if self.on_volume_change:
-                    self.on_volume_change(volume)
-
-    def _check_volume_schedule(self):
-        """Verifica agendamentos de volume (range-based) com suporte a gradiente"""
-        if not self.volume_schedules:
-            return
-
-        current_minutes = self._get_current_minutes()
-
-        for schedule in self.volume_schedules:
-            start = self._time_str_to_minutes(schedule['time_start'])
-            end = self._time_str_to_minutes(schedule['time_end'])
-
-            # Verificar se estamos no intervalo
-            in_range = False
-            if start <= end:
-                in_range = start <= current_minutes <= end
-            else:
-                # Intervalo que cruza meia-noite
-                in_range = current_minutes >= start or current_minutes <= end
-
-            if in_range:
-                # Verificar se é gradiente
-                is_gradient = schedule.get('is_gradient', False)
-
-                if is_gradient:
-                    # Calcular volume interpolado
-                    volume_start = schedule.get('volume_start', schedule['volume'])
-                    volume_end = schedule.get('volume_end', schedule['volume'])
-
-                    # Calcular posição relativa no intervalo (0.0 a 1.0)
-                    if start <= end:
-                        total_minutes = end - start
-                        elapsed = current_minutes - start
-                    else:
-                        # Intervalo que cruza meia-noite
-                        total_minutes = (1440 - start) + end  # 1440 = 24*60
-                        if current_minutes >= start:
-                            elapsed = current_minutes - start
-                        else:
-                            elapsed = (1440 - start) + current_minutes
-
-                    if total_minutes > 0:
-                        progress = elapsed / total_minutes
-                        volume = volume_start + (volume_end - volume_start) * progress
-                    else:
-                        volume = volume_start
-                else:
-                    # Volume fixo
-                    volume = schedule['volume']
-
-                # Arredondar para evitar atualizações desnecessárias
-                volume = round(volume, 3)
-
-                if self._current_scheduled_volume != volume:
-                    self._current_scheduled_volume = volume
-                    print(f"Volume agendado: {int(volume * 100)}% {'(gradiente)' if is_gradient else ''}")
-                    if self.on_volume_change:
-                        self.on_volume_change(volume)
-                return
-
-    def _get_time_based_ads(self) -> list[dict]:
-        """Retorna propagandas baseadas em tempo"""
-        return [
-            ad for ad in self.ad_schedules
-            if ad.get('enabled', True) and
-               (ad.get('interval_type', 'minutes') == 'minutes' or ad.get('interval_type') is None)
-        ]
-
-    def _get_song_based_ads(self) -> list[dict]:
-        """Retorna propagandas baseadas em contagem de músicas"""
-        return [
-            ad for ad in self.ad_schedules
-            if ad.get('enabled', True) and ad.get('interval_type') == 'songs'
-        ]
-
-    def _check_ad_schedule(self):
+    def _check_ad_schedule(self, now: datetime):
         """Verifica propagandas baseadas em tempo"""
-        now = datetime.now()
-        time_ads = self._get_time_based_ads()
-
-        if not time_ads:
-            return
-
-        # Ordena por rotation_order para rotação sequencial
-        time_ads.sort(key=lambda x: x.get('rotation_order', 0))
-
-        for schedule in time_ads:
-            schedule_id = schedule['id']
-            interval = schedule.get('interval_value') or schedule.get('interval_minutes', 30)
-            music_id = schedule['music_id']
-
-            last_played = self.last_ad_played.get(f"time_{schedule_id}")
-
-            if last_played is None or (now - last_played).total_seconds() >= interval * 60:
-                self.last_ad_played[f"time_{schedule_id}"] = now
-                print(f"Tocando propaganda (tempo): {music_id}")
+        for schedule in self._time_ads:
+            due = self._ad_due(schedule, now)
+            if due <= now:
+                self.last_ad_played[f"time_{schedule['id']}"] = now
+                print(f"Tocando propaganda (tempo): {schedule['music_id']}")
                 if self.on_play_ad:
-                    self.on_play_ad(music_id)
+                    self.on_play_ad(schedule['music_id'])
                 return  # Uma propaganda por vez
 
+    def _ad_due(self, schedule: dict, now: datetime) -> datetime:
+        """Quando a propaganda por tempo deve tocar de novo"""
+        last_played = self.last_ad_played.get(f"time_{schedule['id']}")
+        if last_played is None:
+            return now
+        interval = schedule.get('interval_value') or schedule.get('interval_minutes', 30)
+        return last_played + timedelta(minutes=interval)
+
     def _check_song_based_ads(self):
         """Verifica propagandas baseadas em contagem de músicas"""
-        song_ads = self._get_song_based_ads()
+        with self._lock:
+            song_ads = self._song_ads
+            min_interval = self._song_ads_interval
 
         if not song_ads:
             return
 
-        # Ordena por rotation_order para rotação sequencial
-        song_ads.sort(key=lambda x: x.get('rotation_order', 0))
-
-        # Encontra o menor intervalo configurado
-        min_interval = min(
-            ad.get('interval_value', 5)
-            for ad in song_ads
-        )
-
         if self.songs_played_count >= min_interval:
             # Pega a próxima propaganda na rotação
             ad_index = self.current_ad_rotation_index % len(song_ads)
@@ -218,37 +243,65 @@ class Scheduler:
             if self.on_play_ad:
                 self.on_play_ad(ad_to_play['music_id'])
 
-    def _check_scheduled_songs(self):
+    def _check_scheduled_songs(self, now: datetime):
         """Verifica se deve tocar música agendada"""
-        now = datetime.now()
-        current_time = now.strftime('%H:%M')
-
-        for schedule in self.scheduled_songs:
-            scheduled_time = schedule['scheduled_time']
-
-            if scheduled_time == current_time:
-                schedule_key = f"song_{schedule['id']}"
-                last_played = self.last_ad_played.get(schedule_key)
+        for schedule in self._songs_by_minute.get(now.hour * 60 + now.minute, []):
+            schedule_key = f"song_{schedule['id']}"
+            last_played = self.last_ad_played.get(schedule_key)
+
+            if last_played is None or (now - last_played).total_seconds() >= 60:
+                self.last_ad_played[schedule_key] = now
+                print(f"Tocando música agendada: {schedule['music_id']}")
+                if self.on_play_song:
+                    self.on_play_song(schedule['music_id'])
+                return
 
-                if last_played is None or (now - last_played).total_seconds() >= 60:
-                    self.last_ad_played[schedule_key] = now
-                    print(f"Tocando música agendada: {schedule['music_id']}")
-                    if self.on_play_song:
-                        self.on_play_song(schedule['music_id'])
-                    return
+    def _next_event(self, now: datetime, gradient_step: Optional[float]) -> datetime:
+        """Próximo instante em que algo agendado muda"""
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        minute = now.hour * 60 + now.minute
+
+        def next_minute(minutes: list[int]) -> datetime:
+            # Primeiro minuto da lista depois do atual (ou o primeiro de amanhã)
+            i = bisect_right(minutes, minute)
+            if i < len(minutes):
+                return midnight + timedelta(minutes=minutes[i])
+            return midnight + timedelta(days=1, minutes=minutes[0])
+
+        candidates = [now + timedelta(seconds=MAX_SLEEP)]
+        if self._volume_changes:
+            candidates.append(next_minute(self._volume_changes))
+        if gradient_step is not None:
+            candidates.append(now + timedelta(seconds=gradient_step))
+        if self._song_minutes:
+            candidates.append(next_minute(self._song_minutes))
+        for schedule in self._time_ads:
+            due = self._ad_due(schedule, now)
+            candidates.append(max(due, now + timedelta(seconds=AD_SPACING)) if due <= now else due)
+
+        return min(candidates)
+
+    def _run_due(self) -> datetime:
+        """Executa o que está vencido e retorna quando acordar de novo"""
+        now = datetime.now()
+        with self._lock:
+            gradient_step = self._check_volume_schedule(now)
+            self._check_ad_schedule(now)
+            self._check_scheduled_songs(now)
+            return self._next_event(now, gradient_step)
 
     def _scheduler_loop(self):
         """Loop principal do agendador"""
         while self._running:
+            wake_at = None
             try:
-                self._check_hourly_volume()
-                self._check_volume_schedule()
-                self._check_ad_schedule()
-                self._check_scheduled_songs()
+                wake_at = self._run_due()
             except Exception as e:
                 print(f"Erro no scheduler: {e}")
 
-            time.sleep(10)
+            timeout = (wake_at - datetime.now()).total_seconds() if wake_at else MAX_SLEEP
+            self._wake.wait(max(timeout, 0))
+            self._wake.clear()
 
     def start(self):
         """Inicia o agendador"""
@@ -263,6 +316,7 @@ class Scheduler:
     def stop(self):
         """Para o agendador"""
         self._running = False
+        self._wake.set()
         if self._scheduler_thread:
             self._scheduler_thread.join(timeout=1)
         print("Scheduler parado")
@@ -12,9 +12,14 @@ from typing import Callable, Optional
 
 import requests
 
+from log_buffer import LogBuffer
+
 # Arquivos de cache para operação offline
 CACHE_FILE = "schedule_cache.json"
 MUSIC_CACHE_FILE = "music_cache.json"
+LOG_BUFFER_FILE = "log_buffer.json"
+PLAY_BUFFER_FILE = "play_buffer.json"
+PLAYLIST_PLAN_FILE = "playlist_plan.json"
 
 
 class MusicSync:
@@ -30,6 +35,10 @@ class MusicSync:
         # Conjunto de arquivos que são propagandas (não devem entrar na playlist)
         self.ad_files: set[str] = set()
 
+        # Última lista do servidor e seu ETag (servidor responde 304 se não mudou)
+        self.server_music: list[dict] = []
+        self.server_music_etag: Optional[str] = None
+
         # Cache de schedules para offline
         self.cache_path = self.music_folder.parent / CACHE_FILE
         self.music_cache_path = self.music_folder.parent / MUSIC_CACHE_FILE
@@ -38,6 +47,20 @@ class MusicSync:
         self._load_cache()
         self._load_music_cache()
 
+        # Plano da playlist do servidor (segmentos com semente), para gerar a mesma playlist offline
+        self.plan_path = self.music_folder.parent / PLAYLIST_PLAN_FILE
+        self.playlist_plan: dict = {}
+        self._load_playlist_plan()
+
+        # Logs de atividade enviados em lote por uma única thread
+        self.log_buffer = LogBuffer(self.server_url, self.music_folder.parent / LOG_BUFFER_FILE)
+
+        # Histórico de execuções (proof-of-play), mesmo mecanismo de envio em lote
+        self.play_buffer = LogBuffer(
+            self.server_url, self.music_folder.parent / PLAY_BUFFER_FILE,
+            endpoint="/api/plays/batch", payload_key="plays"
+        )
+
         # Callbacks
         self.on_sync_complete: Optional[Callable[[int, int], None]] = None
         self.on_sync_error: Optional[Callable[[str], None]] = None
@@ -77,6 +100,8 @@ class MusicSync:
                     data = json.load(f)
                     self.id_to_file = data.get('id_to_file', {})
                     self.ad_files = set(data.get('ad_files', []))
+                    self.server_music = data.get('server_music', [])
+                    self.server_music_etag = data.get('server_music_etag') if self.server_music else None
                 print(f"Cache de músicas carregado: {len(self.id_to_file)} arquivos, {len(self.ad_files)} propagandas")
         except Exception as e:
             print(f"Erro ao carregar cache de músicas: {e}")
@@ -86,7 +111,9 @@ class MusicSync:
         try:
             data = {
                 'id_to_file': self.id_to_file,
-                'ad_files': list(self.ad_files)
+                'ad_files': list(self.ad_files),
+                'server_music': self.server_music,
+                'server_music_etag': self.server_music_etag
             }
             with open(self.music_cache_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, indent=2, ensure_ascii=False)
@@ -94,6 +121,38 @@ class MusicSync:
         except Exception as e:
             print(f"Erro ao salvar cache de músicas: {e}")
 
+    def _load_playlist_plan(self):
+        """Carrega o último plano de playlist recebido do servidor"""
+        try:
+            if self.plan_path.exists():
+                with open(self.plan_path, 'r', encoding='utf-8') as f:
+                    self.playlist_plan = json.load(f)
+        except Exception as e:
+            print(f"Erro ao carregar plano da playlist: {e}")
+            self.playlist_plan = {}
+
+    def save_playlist_plan(self, plan: dict):
+        """Salva o plano da playlist (recebido via WebSocket ou API)"""
+        if not plan or not plan.get('segments'):
+            return
+        try:
+            with open(self.plan_path, 'w', encoding='utf-8') as f:
+                json.dump(plan, f, ensure_ascii=False)
+            self.playlist_plan = plan
+            print(f"Plano da playlist atualizado: {len(plan['segments'])} segmento(s)")
+        except Exception as e:
+            print(f"Erro ao salvar plano da playlist: {e}")
+
+    def sync_playlist_plan(self) -> dict:
+        """Busca o plano da playlist no servidor (mantém o do cache se offline)"""
+        try:
+            response = requests.get(f"{self.server_url}/api/playlist/plan", timeout=10)
+            response.raise_for_status()
+            self.save_playlist_plan(response.json())
+        except Exception as e:
+            print(f"Erro ao obter plano da playlist: {e}")
+        return self.playlist_plan
+
     def get_schedules(self) -> dict:
         """Obtém schedules do servidor ou do cache se offline"""
         try:
@@ -116,11 +175,26 @@ class MusicSync:
         return schedules
 
     def get_server_music_list(self) -> list[dict]:
-        """Obtém lista de músicas do servidor"""
+        """
+        Obtém lista de músicas do servidor (só os campos usados; 304 reaproveita a última).
+        A duração entra no catálogo para a geração offline da playlist.
+        """
         try:
-            response = requests.get(f"{self.server_url}/api/music/list", timeout=30)
+            headers = {}
+            if self.server_music_etag:
+                headers["If-None-Match"] = self.server_music_etag
+            response = requests.get(
+                f"{self.server_url}/api/music/list",
+                params={"fields": "id,original_name,is_ad,duration"},
+                headers=headers,
+                timeout=30
+            )
+            if response.status_code == 304:
+                return self.server_music
             response.raise_for_status()
-            return response.json()
+            self.server_music = response.json()
+            self.server_music_etag = response.headers.get("ETag")
+            return self.server_music
         except Exception as e:
             if self.on_sync_error:
                 self.on_sync_error(f"Erro ao obter lista: {e}")
@@ -243,6 +317,13 @@ class MusicSync:
         """Obtém caminho do arquivo pelo ID"""
         return self.id_to_file.get(music_id)
 
+    def get_id_by_file(self, filepath: str) -> Optional[str]:
+        """Obtém o ID da música pelo caminho do arquivo"""
+        for music_id, path in self.id_to_file.items():
+            if path == filepath:
+                return music_id
+        return None
+
     def get_music_files(self) -> list[str]:
         """Retorna lista de arquivos de MÚSICA (exclui propagandas)"""
         all_files = []
@@ -272,15 +353,19 @@ class MusicSync:
         self._running = True
         self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
         self._sync_thread.start()
+        self.log_buffer.start()
+        self.play_buffer.start()
 
     def stop_sync(self):
         """Para sincronização"""
         self._running = False
         if self._sync_thread:
             self._sync_thread.join(timeout=1)
+        self.log_buffer.stop()
+        self.play_buffer.stop()
 
-    def get_playlist(self, limit: int = 10) -> list[dict]:
-        """Obtém a playlist atual do servidor"""
+    def get_playlist(self, limit: int = 10) -> Optional[list[dict]]:
+        """Obtém a playlist atual do servidor (None se o servidor não respondeu)"""
         try:
             response = requests.get(
                 f"{self.server_url}/api/playlist?limit={limit}", 
@@ -288,10 +373,25 @@ class MusicSync:
             )
             if response.status_code == 200:
                 return response.json()
-            return []
+            return None
         except Exception as e:
             print(f"Erro ao obter playlist do servidor: {e}")
-            return []
+            return None
+
+    def get_playlist_window(self, limit: int = 20) -> Optional[dict]:
+        """Próximas entradas da playlist com a versão (epoch, version, items); None se offline"""
+        try:
+            response = requests.get(
+                f"{self.server_url}/api/playlist/window",
+                params={"limit": limit},
+                timeout=10
+            )
+            if response.status_code == 200:
+                return response.json()
+            return None
+        except Exception as e:
+            print(f"Erro ao obter janela da playlist: {e}")
+            return None
 
     def sync_priority(self, min_count: int = 3, callback: Optional[Callable[[str, int, int], None]] = None) -> int:
         """
@@ -397,30 +497,10 @@ class MusicSync:
             return False
 
     def send_log(self, log_type: str, description: str, details: str = None):
-        """Envia um log de atividade para o servidor"""
-        try:
-            data = {
-                "type": log_type,
-                "description": description,
-                "details": details
-            }
-            response = requests.post(
-                f"{self.server_url}/api/logs",
-                json=data,
-                timeout=10
-            )
-            response.raise_for_status()  # Levanta exceção para códigos de erro HTTP
-            result = response.json()
-            if result.get('success'):
-                print(f"Log enviado: [{log_type}] {description}")
-                return True
-            return False
-        except requests.exceptions.ConnectionError:
-            print(f"Erro de conexão ao enviar log - servidor inacessível")
-            return False
-        except requests.exceptions.Timeout:
-            print(f"Timeout ao enviar log")
-            return False
-        except Exception as e:
-            print(f"Erro ao enviar log: {type(e).__name__}: {e}")
-            return False
+        """Adiciona um log de atividade ao buffer (enviado em lote em background)"""
+        self.log_buffer.add_log(log_type, description, details)
+        print(f"Log registrado: [{log_type}] {description}")
+
+    def send_play(self, record: dict):
+        """Adiciona uma execução ao histórico (enviado em lote em background)"""
+        self.play_buffer.add(record)
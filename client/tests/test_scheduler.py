@@ -0,0 +1,72 @@
+"""
+Rampas de volume do agendador em gradientes
+
+O player cancela a rampa em qualquer set_volume (reconexão, volume do
+servidor, ajuste manual); o agendador precisa refazer o restante do
+gradiente a partir do ponto atual.
+"""
+
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from scheduler import STEP_RAMP_SECONDS, Scheduler
+
+# 10:00-11:00 gradiente de 20% a 80%, depois 80% fixo
+TIMELINE = [[0, 0.5, 0.5], [600, 0.2, 0.8], [660, 0.8, 0.8]]
+
+
+def at(hour: int, minute: int) -> datetime:
+    return datetime(2026, 10, 19, hour, minute)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler()
+    scheduler.ramps = []
+    scheduler.volumes = []
+    scheduler.on_volume_ramp = lambda volume, seconds: scheduler.ramps.append((volume, round(seconds)))
+    scheduler.on_volume_change = scheduler.volumes.append
+    scheduler.update_schedules([], [], [], {}, TIMELINE)
+    return scheduler
+
+
+def test_gradient_is_one_ramp(scheduler):
+    scheduler._check_volume_schedule(at(10, 15))
+    scheduler._check_volume_schedule(at(10, 20))
+
+    assert scheduler.ramps == [(0.8, 45 * 60)]
+    # A rampa parte do volume atual do player: sem ajuste (nem log) antes dela
+    assert scheduler.volumes == []
+
+
+def test_reconnect_during_gradient_restarts_ramp(scheduler):
+    scheduler._check_volume_schedule(at(10, 15))
+
+    # Reconexão: init chama player.set_volume (cancela a rampa) e reenvia os agendamentos
+    scheduler.on_ramp_cancelled()
+    scheduler.update_schedules([], [], [], {}, TIMELINE)
+    scheduler._check_volume_schedule(at(10, 30))
+
+    assert scheduler.ramps == [(0.8, 45 * 60), (0.8, 30 * 60)]
+
+
+def test_schedule_update_alone_restarts_ramp(scheduler):
+    scheduler._check_volume_schedule(at(10, 15))
+    scheduler.update_schedules([], [], [], {}, TIMELINE)
+    scheduler._check_volume_schedule(at(10, 40))
+
+    assert scheduler.ramps == [(0.8, 45 * 60), (0.8, 20 * 60)]
+
+
+def test_cancelled_ramp_reapplies_next_segment(scheduler):
+    scheduler._check_volume_schedule(at(10, 15))
+    # Ajuste manual no meio do gradiente; o segmento seguinte começa no volume final
+    scheduler.on_ramp_cancelled()
+    scheduler._check_volume_schedule(at(11, 0))
+
+    assert scheduler.ramps == [(0.8, 45 * 60), (0.8, STEP_RAMP_SECONDS)]
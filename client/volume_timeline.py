@@ -0,0 +1,156 @@
+"""
+Linha do tempo de volume do dia (1440 minutos)
+
+Mantido igual em server/ e client/ (só biblioteca padrão): o servidor
+compila, o player consome, e os dois precisam concordar no resultado.
+
+Volumes por hora e faixas de volume (fixas ou em gradiente) viram uma
+única lista de segmentos [minuto inicial, volume inicial, volume final]:
+dentro de um segmento o volume vai linearmente do inicial ao final (igual
+nos segmentos fixos), e cada segmento vai até o início do seguinte. É esse
+formato que o servidor envia em init/schedule_updated e grava no plano da
+playlist. VolumeTimeline expande os segmentos em arrays de 1440 posições
+para consulta O(1) por minuto.
+
+Regras (as mesmas de antes no scheduler do player):
+- fora de faixas vale o volume da hora (0.5 se a hora não tiver volume)
+- faixas incluem o minuto final; a primeira faixa que contém o minuto vale
+- gradiente chega ao volume final no início do minuto final
+"""
+
+from array import array
+from datetime import datetime, timedelta
+from typing import Optional
+
+MINUTES_PER_DAY = 1440
+DEFAULT_VOLUME = 0.5
+
+
+def _minutes(time_str: str) -> int:
+    """HH:MM -> minutos desde meia-noite"""
+    hour, minute = time_str.split(":")[:2]
+    return int(hour) * 60 + int(minute)
+
+
+def compile_timeline(hourly_volumes: dict, volume_schedules: list) -> list[list]:
+    """Segmentos do dia a partir dos volumes por hora e das faixas de volume"""
+    hourly = [DEFAULT_VOLUME] * 24
+    for hour, volume in (hourly_volumes or {}).items():
+        if volume is not None and 0 <= int(hour) < 24:
+            hourly[int(hour)] = volume
+
+    volumes = [hourly[minute // 60] for minute in range(MINUTES_PER_DAY)]
+    # Faixa dona de cada minuto (-1 = volume da hora) e se o volume desliza até o minuto seguinte
+    owner = [-1] * MINUTES_PER_DAY
+    sliding = bytearray(MINUTES_PER_DAY)
+
+    for index, schedule in enumerate(volume_schedules or []):
+        start = _minutes(schedule["time_start"])
+        end = _minutes(schedule["time_end"])
+        volume = schedule["volume"]
+        volume_start = volume if schedule.get("volume_start") is None else schedule["volume_start"]
+        volume_end = volume if schedule.get("volume_end") is None else schedule["volume_end"]
+        span = (end - start) % MINUTES_PER_DAY
+        gradient = bool(schedule.get("is_gradient")) and span > 0
+
+        for offset in range(span + 1):
+            minute = (start + offset) % MINUTES_PER_DAY
+            if owner[minute] != -1:
+                continue
+            owner[minute] = index
+            if gradient:
+                volumes[minute] = volume_start + (volume_end - volume_start) * offset / span
+                sliding[minute] = offset < span
+            else:
+                volumes[minute] = volume
+
+    # Só desliza se o minuto seguinte for da mesma faixa (faixas sobrepostas)
+    for minute in range(MINUTES_PER_DAY):
+        if sliding[minute] and owner[(minute + 1) % MINUTES_PER_DAY] != owner[minute]:
+            sliding[minute] = 0
+
+    segments = []
+    for minute in range(MINUTES_PER_DAY):
+        if minute and owner[minute] == owner[minute - 1] and sliding[minute] == sliding[minute - 1] \
+                and (sliding[minute] or volumes[minute] == volumes[minute - 1]):
+            continue
+        segments.append([minute, volumes[minute], volumes[minute]])
+
+    # Volume final dos gradientes: o do início do segmento seguinte
+    for i, segment in enumerate(segments):
+        if sliding[segment[0]]:
+            next_start = segments[i + 1][0] if i + 1 < len(segments) else MINUTES_PER_DAY
+            segment[2] = volumes[next_start % MINUTES_PER_DAY]
+
+    return [[minute, round(start, 4), round(end, 4)] for minute, start, end in segments]
+
+
+class VolumeTimeline:
+    def __init__(self, segments: list):
+        self.segments = [tuple(segment) for segment in sorted(segments or [[0, DEFAULT_VOLUME, DEFAULT_VOLUME]])]
+        if self.segments[0][0] != 0:
+            # Antes do primeiro segmento vale o último (vindo do dia anterior)
+            self.segments.insert(0, (0, self.segments[-1][2], self.segments[-1][2]))
+
+        # Segmento de cada minuto e volume no início de cada minuto
+        self.segment_of = array("H", bytes(2 * MINUTES_PER_DAY))
+        self.volumes = array("d", bytes(8 * MINUTES_PER_DAY))
+        for i, (start, volume_start, volume_end) in enumerate(self.segments):
+            end = self.segment_end(i)
+            for minute in range(start, end):
+                self.segment_of[minute] = i
+                self.volumes[minute] = volume_start + (volume_end - volume_start) * (minute - start) / (end - start)
+
+    @classmethod
+    def from_schedules(cls, hourly_volumes: dict, volume_schedules: list) -> "VolumeTimeline":
+        return cls(compile_timeline(hourly_volumes, volume_schedules))
+
+    def segment_end(self, index: int) -> int:
+        """Minuto em que o segmento termina (início do seguinte, ou 1440)"""
+        return self.segments[index + 1][0] if index + 1 < len(self.segments) else MINUTES_PER_DAY
+
+    def segment_at(self, when: datetime) -> int:
+        return self.segment_of[when.hour * 60 + when.minute]
+
+    def volume_at(self, when: datetime) -> float:
+        """Volume no instante (com precisão de segundos dentro de gradientes)"""
+        index = self.segment_at(when)
+        start, volume_start, volume_end = self.segments[index]
+        if volume_start == volume_end:
+            return volume_start
+        elapsed = when.hour * 60 + when.minute - start + (when.second + when.microsecond / 1_000_000) / 60
+        return volume_start + (volume_end - volume_start) * elapsed / (self.segment_end(index) - start)
+
+    def changes(self, start: datetime, end: datetime) -> list[tuple[datetime, float, float]]:
+        """
+        Mudanças de volume entre start e end: (instante, volume, volume final).
+        A primeira é o estado em start; segmentos seguidos com o mesmo volume
+        fixo não contam como mudança.
+        """
+        index = self.segment_at(start)
+        _, volume_start, volume_end = self.segments[index]
+        current = self.volume_at(start)
+        result = [(start, current, volume_end)]
+        last = (current, volume_end)
+
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        while True:
+            index += 1
+            if index == len(self.segments):
+                index = 0
+                day += timedelta(days=1)
+            minute, volume_start, volume_end = self.segments[index]
+            when = day + timedelta(minutes=minute)
+            if when >= end:
+                return result
+            # Fim de gradiente que emenda em volume fixo igual ao final: sem mudança
+            if (volume_start, volume_end) != last and not (volume_start == volume_end == last[1]):
+                result.append((when, volume_start, volume_end))
+            last = (volume_start, volume_end)
+
+
+def describe(volume: float, volume_end: Optional[float] = None) -> str:
+    """Texto do evento de volume na playlist e no preview"""
+    if volume_end is not None and round(volume_end, 2) != round(volume, 2):
+        return f"Volume em gradiente de {int(volume * 100)}% para {int(volume_end * 100)}%"
+    return f"Volume ajustado para {int(volume * 100)}%"
@@ -2,13 +2,14 @@
 Cliente WebSocket para comunicação com o servidor
 """
 
-import json
 import threading
 import time
 from typing import Callable, Optional
 
 import socketio
 
+import ws_protocol
+
 
 class WebSocketClient:
     def __init__(self, server_url: str):
@@ -75,6 +76,8 @@ class NativeWebSocketClient:
         self.ws_url = self.server_url.replace('http://', 'ws://').replace('https://', 'wss://') + '/ws'
         self.connected = False
         self._ws = None
+        self._codec = ws_protocol.MessageCodec()
+        self._send_lock = threading.Lock()
         self._running = False
         self._thread: Optional[threading.Thread] = None
 
@@ -90,6 +93,7 @@ class NativeWebSocketClient:
         self.on_music_updated: Optional[Callable[[], None]] = None
         self.on_init: Optional[Callable[[dict], None]] = None
         self.on_playlist_updated: Optional[Callable[[dict], None]] = None  # Quando playlist é atualizada/regenerada
+        self.on_playlist_delta: Optional[Callable[[dict], None]] = None  # Mudança versionada na playlist
 
         # Configurações recebidas do servidor
         self.settings: dict = {}
@@ -98,54 +102,75 @@ class NativeWebSocketClient:
         """Processa mensagem recebida"""
         msg_type = message.get('type')
 
-        if msg_type == 'init':
+        if msg_type == ws_protocol.INIT:
             self.settings = message.get('settings', {})
             if self.on_init:
                 self.on_init(self.settings)
 
-        elif msg_type == 'volume_change':
+        elif msg_type == ws_protocol.VOLUME_CHANGE:
             volume = message.get('volume', 0.5)
             if self.on_volume_change:
                 self.on_volume_change(volume)
 
-        elif msg_type == 'play_next':
+        elif msg_type == ws_protocol.PLAY_NEXT:
             music_id = message.get('music_id')
             if music_id and self.on_play_next:
                 self.on_play_next(music_id)
 
-        elif msg_type == 'play':
+        elif msg_type == ws_protocol.PLAY:
             if self.on_play:
                 self.on_play()
 
-        elif msg_type == 'pause':
+        elif msg_type == ws_protocol.PAUSE:
             if self.on_pause:
                 self.on_pause()
 
-        elif msg_type == 'skip':
+        elif msg_type == ws_protocol.SKIP:
             if self.on_skip:
                 self.on_skip()
 
-        elif msg_type == 'schedule_updated':
+        elif msg_type == ws_protocol.SCHEDULE_UPDATED:
             # Passa dados completos de schedules (volume_schedules, ad_schedules, scheduled_songs, hourly_volumes)
             if self.on_schedule_updated:
                 self.on_schedule_updated(message)
 
-        elif msg_type == 'music_added' or msg_type == 'music_deleted':
+        elif msg_type == ws_protocol.MUSIC_ADDED or msg_type == ws_protocol.MUSIC_DELETED:
             if self.on_music_updated:
                 self.on_music_updated()
 
-        elif msg_type == 'playlist_updated' or msg_type == 'playlist_generated':
+        elif msg_type == ws_protocol.PLAYLIST_UPDATED or msg_type == ws_protocol.PLAYLIST_GENERATED:
             # Playlist foi atualizada/regenerada no servidor
             if self.on_playlist_updated:
                 self.on_playlist_updated(message)
 
+        elif msg_type == ws_protocol.PLAYLIST_DELTA:
+            if self.on_playlist_delta:
+                self.on_playlist_delta(message)
+
+    def _open(self, websocket):
+        """Conecta oferecendo as codificações compactas (ws_protocol)"""
+        try:
+            return websocket.create_connection(
+                self.ws_url, timeout=30,
+                subprotocols=ws_protocol.supported_subprotocols()
+            )
+        except websocket.WebSocketException as e:
+            # Servidor antigo aceita o upgrade sem escolher subprotocolo e o websocket-client
+            # recusa o handshake ("Invalid WebSocket Header"). Outros erros (502 durante um
+            # restart, timeout) seguem para a reconexão, que volta a oferecer os subprotocolos.
+            if type(e) is not websocket.WebSocketException or "Invalid WebSocket Header" not in str(e):
+                raise
+        print("Servidor sem codificação compacta no WebSocket, usando JSON")
+        return websocket.create_connection(self.ws_url, timeout=30)
+
     def _connection_loop(self):
         """Loop de conexão WebSocket"""
         import websocket
 
         while self._running:
             try:
-                self._ws = websocket.create_connection(self.ws_url, timeout=30)
+                self._ws = self._open(websocket)
+                self._codec = ws_protocol.MessageCodec(self._ws.getsubprotocol())
                 self.connected = True
 
                 if self.on_connect:
@@ -155,7 +180,7 @@ class NativeWebSocketClient:
                     try:
                         data = self._ws.recv()
                         if data:
-                            message = json.loads(data)
+                            message = self._codec.decode(data)
                             self._handle_message(message)
                     except websocket.WebSocketTimeoutException:
                         continue
@@ -179,7 +204,7 @@ class NativeWebSocketClient:
         if self._ws and self.connected:
             try:
                 message = {
-                    "type": "player_status",
+                    "type": ws_protocol.PLAYER_STATUS,
                     "current_song": current_song,
                     "is_playing": is_playing,
                     "volume": volume,
@@ -187,10 +212,20 @@ class NativeWebSocketClient:
                     "duration": duration,
                     "remaining": remaining
                 }
-                self._ws.send(json.dumps(message))
+                self._send(message)
             except Exception as e:
                 print(f"Erro ao enviar status: {e}")
 
+    def _send(self, message: dict):
+        """Envia na codificação negociada no handshake"""
+        # Com deflate cada mensagem depende das anteriores: codificar e enviar em ordem
+        with self._send_lock:
+            data = self._codec.encode(message)
+            if isinstance(data, bytes):
+                self._ws.send_binary(data)
+            else:
+                self._ws.send(data)
+
     def connect(self):
         """Inicia conexão em thread separada"""
         if self._thread and self._thread.is_alive():
@@ -0,0 +1,143 @@
+"""
+Protocolo do WebSocket /ws (formato das mensagens e codificação)
+
+Cópia única para servidor e player: server/ws_protocol.py e
+client/ws_protocol.py precisam continuar iguais.
+
+A codificação é escolhida no handshake pelo subprotocolo WebSocket
+("falavip.<encoding>.<compression>"): o player oferece os que consegue usar,
+em ordem de preferência, e o servidor aceita o primeiro que também suporta.
+Sem subprotocolo (dashboard no navegador, players antigos) tudo continua em
+JSON texto, que o navegador já comprime com permessage-deflate.
+
+- encoding: json ou msgpack (se o pacote msgpack estiver instalado)
+- compression: deflate (zlib com contexto compartilhado entre mensagens da
+  mesma conexão, como o permessage-deflate) ou none
+
+Frames texto são sempre JSON, em qualquer subprotocolo.
+"""
+
+import json
+import zlib
+from typing import Optional, Union
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+SUBPROTOCOL_PREFIX = "falavip."
+
+# ============ MENSAGENS ============
+
+# Servidor -> player
+INIT = "init"
+VOLUME_CHANGE = "volume_change"
+PLAY_NEXT = "play_next"
+PLAY = "play"
+PAUSE = "pause"
+SKIP = "skip"
+SCHEDULE_UPDATED = "schedule_updated"
+MUSIC_ADDED = "music_added"
+MUSIC_DELETED = "music_deleted"
+PLAYLIST_UPDATED = "playlist_updated"
+PLAYLIST_GENERATED = "playlist_generated"
+PLAYLIST_DELTA = "playlist_delta"
+
+# Player -> servidor
+PLAYER_STATUS = "player_status"
+COMMAND_RESPONSE = "command_response"
+
+PLAYER_STATUS_FIELDS = {
+    "current_song": None,
+    "is_playing": False,
+    "volume": 0.5,
+    "position": 0,
+    "duration": 0,
+    "remaining": 0
+}
+
+
+def player_status(data: dict) -> dict:
+    """Campos de player_status com os valores padrão para os que faltarem"""
+    return {field: data.get(field, default) for field, default in PLAYER_STATUS_FIELDS.items()}
+
+
+# ============ CODIFICAÇÃO ============
+
+def subprotocol(encoding: str, compression: str) -> str:
+    return f"{SUBPROTOCOL_PREFIX}{encoding}.{compression}"
+
+
+def parse_subprotocol(name: Optional[str]) -> Optional[tuple[str, str]]:
+    """(encoding, compression) de um subprotocolo suportado por este lado, senão None"""
+    if not name or not name.startswith(SUBPROTOCOL_PREFIX):
+        return None
+    parts = name[len(SUBPROTOCOL_PREFIX):].split(".")
+    if len(parts) != 2:
+        return None
+    encoding, compression = parts
+    if encoding not in supported_encodings() or compression not in ("deflate", "none"):
+        return None
+    return encoding, compression
+
+
+def supported_encodings() -> list[str]:
+    return ["msgpack", "json"] if MSGPACK_AVAILABLE else ["json"]
+
+
+def supported_subprotocols() -> list[str]:
+    """Subprotocolos deste lado, do mais compacto ao mais simples"""
+    return [
+        subprotocol(encoding, compression)
+        for encoding in supported_encodings()
+        for compression in ("deflate", "none")
+    ]
+
+
+def choose_subprotocol(offered: list[str]) -> Optional[str]:
+    """Primeiro subprotocolo oferecido pelo outro lado que este lado suporta"""
+    for name in offered:
+        if parse_subprotocol(name):
+            return name
+    return None
+
+
+class MessageCodec:
+    """Codifica/decodifica as mensagens de uma conexão (estado de compressão por conexão)"""
+
+    def __init__(self, name: Optional[str] = None):
+        self.subprotocol = name if parse_subprotocol(name) else None
+        self.encoding, self.compression = parse_subprotocol(self.subprotocol) or ("json", "none")
+        self.binary = self.subprotocol is not None
+
+        if self.compression == "deflate":
+            # wbits negativo: deflate puro, sem cabeçalho zlib em cada mensagem
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            self._decompressor = zlib.decompressobj(-15)
+
+    def encode(self, message: dict) -> Union[str, bytes]:
+        """str para frame texto, bytes para frame binário"""
+        if not self.binary:
+            return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+        if self.encoding == "msgpack":
+            data = msgpack.packb(message, use_bin_type=True)
+        else:
+            data = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+
+        if self.compression == "deflate":
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        if isinstance(data, str):
+            return json.loads(data)
+
+        if self.compression == "deflate":
+            data = self._decompressor.decompress(data)
+
+        if self.encoding == "msgpack":
+            return msgpack.unpackb(data, raw=False)
+        return json.loads(data)
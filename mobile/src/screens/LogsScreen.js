@@ -27,11 +27,13 @@ export default function LogsScreen() {
   const [selectedType, setSelectedType] = useState(null);
   const [loadingMore, setLoadingMore] = useState(false);
   const [hasMore, setHasMore] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
 
   const fetchLogs = useCallback(async (reset = false) => {
     try {
       const offset = reset ? 0 : logs.length;
-      const data = await api.getLogs(50, offset, selectedType);
+      const cursor = reset ? null : nextCursor;
+      const data = await api.getLogs(50, offset, selectedType, cursor);
       const newLogs = data.logs || data || [];
 
       if (reset) {
@@ -40,14 +42,15 @@ export default function LogsScreen() {
         setLogs(prev => [...prev, ...newLogs]);
       }
 
-      setHasMore(newLogs.length === 50);
+      setNextCursor(data.next_cursor || null);
+      setHasMore(data.has_more !== undefined ? data.has_more : newLogs.length === 50);
     } catch (error) {
       console.error('Error fetching logs:', error);
     } finally {
       setLoading(false);
       setLoadingMore(false);
     }
-  }, [selectedType, logs.length]);
+  }, [selectedType, logs.length, nextCursor]);
 
   useEffect(() => {
     setLoading(true);
@@ -196,8 +196,14 @@ class ApiService {
   }
 
   // Logs
-  async getLogs(limit = 100, offset = 0, type = null) {
-    let endpoint = `/logs?limit=${limit}&offset=${offset}`;
+  async getLogs(limit = 100, offset = 0, type = null, cursor = null) {
+    let endpoint = `/logs?limit=${limit}`;
+    // Cursor (keyset) é preferível ao offset para páginas profundas
+    if (cursor) {
+      endpoint += `&cursor=${encodeURIComponent(cursor)}`;
+    } else {
+      endpoint += `&offset=${offset}`;
+    }
     if (type) {
       endpoint += `&type=${type}`;
     }
@@ -0,0 +1,212 @@
+"""
+Mixagem em processo (NumPy) com cache de músicas de fundo pré-decodificadas
+
+As vinhetas usam quase sempre as mesmas poucas músicas de fundo. Em vez de
+o FFmpeg decodificar, repetir (aloop) e reamostrar a música inteira a cada
+mixagem, ela é decodificada uma vez para PCM float32 44.1kHz estéreo em um
+arquivo .raw (lido via memmap). A curva de volume (ducking, fades), o atraso
+da voz e a soma são calculados com NumPy; o FFmpeg só codifica o MP3 final.
+"""
+
+import asyncio
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_FORMAT = "f32le"  # float32 little-endian, intercalado
+
+# Argumentos do FFmpeg para ler/gravar o PCM neste formato
+PCM_ARGS = ["-f", SAMPLE_FORMAT, "-ar", str(SAMPLE_RATE), "-ac", str(CHANNELS)]
+FRAME_BYTES = 4 * CHANNELS
+
+
+class EmptyBedError(Exception):
+    """A música de fundo decodificou sem nenhuma amostra de áudio"""
+
+
+class BedCache:
+    """Arquivos PCM das músicas de fundo, por id da música e formato"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def path_for(self, music_id: str) -> Path:
+        return self.cache_dir / f"{music_id}_{SAMPLE_RATE}_{CHANNELS}ch.{SAMPLE_FORMAT}.raw"
+
+    async def get(self, music_id: str, source_path: Path,
+                  decode: Callable[[Path, Path], Awaitable[None]]) -> Path:
+        """
+        Caminho do PCM da música, decodificando na primeira vez.
+        decode(source_path, target_path) deve gravar o PCM em target_path.
+        Sem nenhuma amostra decodificada: EmptyBedError (nada fica no cache).
+        """
+        path = self.path_for(music_id)
+        if self._usable(path):
+            self.hits += 1
+            os.utime(path)  # Ordem LRU para a limpeza
+            return path
+
+        lock = self._locks.setdefault(music_id, asyncio.Lock())
+        async with lock:
+            if self._usable(path):
+                self.hits += 1
+                return path
+
+            self.misses += 1
+            tmp_path = path.with_suffix(".tmp")
+            try:
+                await decode(source_path, tmp_path)
+                if not self._usable(tmp_path):
+                    raise EmptyBedError(f"Música de fundo sem áudio decodificável: {source_path.name}")
+                tmp_path.replace(path)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+        self._evict(keep=path)
+        return path
+
+    @staticmethod
+    def _usable(path: Path) -> bool:
+        """Existe e tem ao menos uma amostra (np.memmap não aceita arquivo vazio)"""
+        try:
+            return path.stat().st_size >= FRAME_BYTES
+        except OSError:
+            return False
+
+    @staticmethod
+    def load(path: Path) -> "np.ndarray":
+        """PCM mapeado em memória, formato (amostras, canais)"""
+        frames = path.stat().st_size // FRAME_BYTES
+        if not frames:
+            raise EmptyBedError(f"Música de fundo sem áudio decodificável: {path.name}")
+        return np.memmap(path, dtype="<f4", mode="r", shape=(frames, CHANNELS))
+
+    def invalidate(self, music_id: str):
+        """Remove o PCM de uma música (ex.: música excluída)"""
+        for path in self.cache_dir.glob(f"{music_id}_*.raw"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _files(self) -> list[tuple[float, int, Path]]:
+        files = []
+        for path in self.cache_dir.glob("*.raw"):
+            try:
+                stat = path.stat()
+                files.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                pass
+        return sorted(files)
+
+    def _evict(self, keep: Optional[Path] = None):
+        """Remove os PCMs usados há mais tempo até caber no limite"""
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        files = self._files()
+        return {
+            "beds": len(files),
+            "total_bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+def pcm_from_bytes(data: bytes) -> "np.ndarray":
+    """Converte a saída PCM do FFmpeg em array (amostras, canais)"""
+    usable = len(data) - len(data) % FRAME_BYTES
+    return np.frombuffer(data[:usable], dtype="<f4").reshape(-1, CHANNELS)
+
+
+def join_fragments(fragments: list["np.ndarray"], gap: float) -> "np.ndarray":
+    """Concatena trechos de voz com gap segundos de silêncio entre eles"""
+    silence = np.zeros((int(round(gap * SAMPLE_RATE)), CHANNELS), dtype=np.float32)
+    parts = []
+    for i, fragment in enumerate(fragments):
+        if i:
+            parts.append(silence)
+        parts.append(fragment)
+    return np.concatenate(parts)
+
+
+def music_gain_curve(total_samples: int, intro: float, speech_duration: float, outro: float,
+                     fade_out: float, fade_time: float, music_volume: float,
+                     ducking_volume: float) -> "np.ndarray":
+    """
+    Volume da música amostra a amostra: intro normal, fade down, ducking
+    durante a fala, fade up, outro normal e fade out final até zero.
+    Mesma curva da expressão 'volume' usada no caminho só com FFmpeg.
+    """
+    duck_end = intro + speech_duration
+    fade_out_start = duck_end + outro
+    total = fade_out_start + fade_out
+
+    times = [0.0, intro, intro + fade_time, duck_end, duck_end + fade_time, fade_out_start, total]
+    gains = [music_volume, music_volume, ducking_volume, ducking_volume, music_volume, music_volume, 0.0]
+
+    t = np.arange(total_samples, dtype=np.float64) / SAMPLE_RATE
+    return np.interp(t, times, gains).astype(np.float32)
+
+
+def mix_pcm(bed: "np.ndarray", voice: "np.ndarray", intro: float, outro: float, fade_out: float,
+            fade_time: float, music_volume: float, ducking_volume: float,
+            voice_volume: float) -> "np.ndarray":
+    """
+    Mixa música de fundo (repetida se for curta) e voz atrasada em intro
+    segundos. Retorna PCM float32 (amostras, canais) já limitado a [-1, 1].
+    """
+    if not len(bed):
+        raise EmptyBedError("Música de fundo sem amostras")
+
+    speech_duration = len(voice) / SAMPLE_RATE
+    total_samples = int(round((intro + speech_duration + outro + fade_out) * SAMPLE_RATE))
+
+    # Música em loop até a duração total
+    if len(bed) >= total_samples:
+        music = np.array(bed[:total_samples], dtype=np.float32)
+    else:
+        repeats = -(-total_samples // len(bed))
+        music = np.tile(bed, (repeats, 1))[:total_samples]
+
+    music *= music_gain_curve(
+        total_samples, intro, speech_duration, outro, fade_out,
+        fade_time, music_volume, ducking_volume
+    )[:, None]
+
+    # Como o amix do FFmpeg (normalize): enquanto a voz está ativa (do início,
+    # pois o atraso conta como entrada ativa, até o fim da fala) as duas
+    # entradas são somadas com peso 1/2; depois a música segue com peso 1
+    voice_start = int(round(intro * SAMPLE_RATE))
+    voice_end = min(voice_start + len(voice), total_samples)
+    music[:voice_end] *= 0.5
+    music[voice_start:voice_end] += voice[:voice_end - voice_start] * (voice_volume * 0.5)
+
+    np.clip(music, -1.0, 1.0, out=music)
+    return music
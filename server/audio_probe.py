@@ -0,0 +1,148 @@
+"""
+Duração de arquivos de áudio sem processos externos
+
+Usa os cabeçalhos lidos pelo mutagen quando são confiáveis (MP3 com cabeçalho
+Xing/Info/VBRI, M4A, etc.). Para MP3 sem esse cabeçalho (o mutagen só
+estima pelo bitrate) ou quando o mutagen falha, os frames MPEG são
+percorridos um a um, o que dá a duração exata em frames.
+"""
+
+import io
+from pathlib import Path
+from typing import Union
+
+# Para extrair duração de áudio
+try:
+    from mutagen import File as MutagenFile
+    from mutagen.mp3 import MP3, BitrateMode
+    from mutagen.mp4 import MP4
+    MUTAGEN_AVAILABLE = True
+except ImportError:
+    MUTAGEN_AVAILABLE = False
+    print("AVISO: mutagen não instalado - duração calculada apenas por varredura de frames MP3")
+
+# Bitrates (kbps) por [versão][camada]; índice 0 = free, 15 = inválido
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],      # MPEG 1
+    2: [22050, 24000, 16000],      # MPEG 2
+    2.5: [11025, 12000, 8000],     # MPEG 2.5
+}
+
+
+def _skip_id3v2(data: bytes) -> int:
+    """Offset do primeiro byte depois da tag ID3v2 (0 se não houver)"""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _parse_frame_header(data: bytes, pos: int):
+    """Retorna (tamanho do frame, amostras, sample rate) ou None se não for um header válido"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+
+    b1, b2 = data[pos + 1], data[pos + 2]
+    version = {0: 2.5, 2: 2, 3: 1}.get((b1 >> 3) & 0x03)
+    layer = {1: 3, 2: 2, 3: 1}.get((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = _BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x01
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version != 1:
+        samples = 576
+        length = 72 * bitrate // sample_rate + padding
+    else:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+
+    return length, samples, sample_rate
+
+
+def scan_mp3_duration(data: bytes) -> float:
+    """Soma as amostras de todos os frames MPEG (ignora o frame Xing/Info)"""
+    pos = _skip_id3v2(data)
+    end = len(data)
+    if end >= 128 and data[-128:-125] == b"TAG":
+        end -= 128  # Tag ID3v1 no final
+
+    total_seconds = 0.0
+    first = True
+    while pos + 4 <= end:
+        header = _parse_frame_header(data, pos)
+        if header is None:
+            pos += 1  # Ressincronizar (lixo entre frames)
+            continue
+
+        length, samples, sample_rate = header
+        # O primeiro frame pode ser só o cabeçalho Xing/Info do encoder (sem áudio)
+        if first and (b"Xing" in data[pos + 4:pos + 40] or b"Info" in data[pos + 4:pos + 40]):
+            pos += length
+            first = False
+            continue
+        first = False
+
+        if pos + length > end:
+            break  # Frame truncado
+        total_seconds += samples / sample_rate
+        pos += length
+
+    return total_seconds
+
+
+def get_audio_duration(source: Union[Path, str, bytes], ext: str = None) -> float:
+    """
+    Duração em segundos de um arquivo (caminho) ou do conteúdo em memória.
+    ext (ex.: '.mp3') indica o formato quando source são bytes.
+    """
+    if isinstance(source, (str, Path)):
+        path = Path(source)
+        ext = (ext or path.suffix).lower()
+    else:
+        path = None
+        ext = (ext or ".mp3").lower()
+
+    if MUTAGEN_AVAILABLE:
+        try:
+            target = str(path) if path else io.BytesIO(source)
+            if ext == '.mp3':
+                audio = MP3(target)
+                # Sem cabeçalho VBR o mutagen só estima pelo bitrate do primeiro frame
+                if audio.info.bitrate_mode != BitrateMode.UNKNOWN:
+                    return audio.info.length
+            elif ext in ('.m4a', '.mp4', '.aac'):
+                return MP4(target).info.length
+            else:
+                # Fallback genérico
+                audio = MutagenFile(target)
+                if audio and audio.info:
+                    return audio.info.length
+        except Exception as e:
+            print(f"Erro ao extrair duração de {path or 'áudio em memória'}: {e}")
+
+    if ext == '.mp3':
+        try:
+            data = path.read_bytes() if path else source
+            return scan_mp3_duration(data)
+        except Exception as e:
+            print(f"Erro ao varrer frames de {path or 'áudio em memória'}: {e}")
+
+    return 0.0
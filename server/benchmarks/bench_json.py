@@ -0,0 +1,137 @@
+"""
+Benchmark da serialização das respostas grandes (fast_json)
+
+Mede, para a lista completa de músicas, metadata/all, a playlist e o preview
+de agendamentos, cada caminho de serialização (busca no banco + JSON):
+dicts com jsonable_encoder (como o FastAPI faz por padrão), dicts com json
+ou orjson, o array montado pelo SQLite (sql_json_array) e o snapshot em
+cache. Também confere se a saída de sql_json_array é idêntica, byte a byte,
+à de orjson sobre os dicts.
+
+    cd server
+    STORAGE_DIR=/tmp/bench/storage DATA_DIR=/tmp/bench/data python benchmarks/seed_catalog.py
+    STORAGE_DIR=/tmp/bench/storage DATA_DIR=/tmp/bench/data python benchmarks/bench_json.py
+"""
+
+import asyncio
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiosqlite  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from starlette.responses import JSONResponse  # noqa: E402
+
+import fast_json  # noqa: E402
+import library_view  # noqa: E402
+import main  # noqa: E402
+from fast_json import FastJSONResponse, SnapshotCache, sql_json_array  # noqa: E402
+
+CASES = [
+    # (nome, query, colunas REAL, repetições)
+    ("music/list", "SELECT * FROM music ORDER BY created_at DESC, id DESC", ["duration"], 5),
+    ("music/metadata/all", "SELECT * FROM library ORDER BY created_at DESC", library_view.REAL_COLUMNS, 5),
+    ("playlist (500)", "SELECT * FROM generated_playlist ORDER BY position LIMIT 500", ["duration"], 30),
+]
+
+
+async def fetch_dicts(query: str) -> list[dict]:
+    async with aiosqlite.connect(main.DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(query) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def query_columns(query: str) -> list[str]:
+    async with aiosqlite.connect(main.DB_PATH) as db:
+        async with db.execute(f"SELECT * FROM ({query}) LIMIT 0") as cursor:
+            return [column[0] for column in cursor.description]
+
+
+async def sql_body(query: str, columns: list[str], real_columns: list[str]) -> bytes:
+    async with aiosqlite.connect(main.DB_PATH) as db:
+        return (await sql_json_array(db, columns, query, float_columns=real_columns)).encode()
+
+
+def jsonable_body(content) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def json_fallback_body(content) -> bytes:
+    fast_json.ORJSON_AVAILABLE = False
+    try:
+        return FastJSONResponse(content).body
+    finally:
+        fast_json.ORJSON_AVAILABLE = True
+
+
+async def measure(build, repeat: int) -> tuple[float, float, int]:
+    """(mediana em ms, pico de memória em MB, tamanho em bytes)"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = await build()
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    await build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times) * 1000, peak / 1e6, len(body)
+
+
+def report(name: str, results: list[tuple[str, tuple]]):
+    print(name)
+    for label, (ms, mb, size) in results:
+        print(f"  {label:32s} {ms:8.2f} ms  pico {mb:7.2f} MB  {size:>10,d} B")
+
+
+async def run():
+    for name, query, real_columns, repeat in CASES:
+        columns = await query_columns(query)
+        snapshots = SnapshotCache()
+
+        async def before():
+            return jsonable_body(await fetch_dicts(query))
+
+        async def dicts_json():
+            return json_fallback_body(await fetch_dicts(query))
+
+        async def dicts_orjson():
+            return FastJSONResponse(await fetch_dicts(query)).body
+
+        async def sqlite_json():
+            return await sql_body(query, columns, real_columns)
+
+        async def cached():
+            return await snapshots.get(name, "r1", sqlite_json)
+
+        await cached()
+        variants = [("dicts + jsonable_encoder", before), ("dicts + json", dicts_json)]
+        if fast_json.ORJSON_AVAILABLE:
+            variants.append(("dicts + orjson", dicts_orjson))
+        variants += [("SQLite json_object", sqlite_json), ("snapshot em cache", cached)]
+        report(name, [(label, await measure(build, repeat)) for label, build in variants])
+
+        if fast_json.ORJSON_AVAILABLE:
+            identical = await sqlite_json() == await dicts_orjson()
+            print(f"  sql_json_array == orjson(dicts): {'sim' if identical else 'NÃO'}")
+
+    preview = json.loads((await main.get_schedule_preview(hours=24)).body)
+    variants = [("jsonable_encoder", lambda: jsonable_body(preview)), ("json", lambda: json_fallback_body(preview))]
+    if fast_json.ORJSON_AVAILABLE:
+        variants.append(("orjson", lambda: FastJSONResponse(preview).body))
+
+    async def wrap(build):
+        return build()
+
+    report(f"schedules/preview (24h, {len(preview['events'])} eventos)",
+           [(label, await measure(lambda build=build: wrap(build), 30)) for label, build in variants])
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+"""
+Teste de carga de /api/music/list: bytes transferidos e CPU do servidor por requisição
+
+Sobe o servidor (uvicorn, um worker) a partir de --server-dir sobre o banco
+de STORAGE_DIR / DATA_DIR, faz --requests chamadas por cenário e mede:
+- bytes: corpo como trafegou na rede (comprimido, quando for o caso)
+- cpu: tempo de CPU do processo do servidor (utime + stime de /proc) por chamada
+- latência média vista pelo cliente
+
+Para comparar antes/depois num catálogo de 20 mil músicas:
+
+    cd server
+    export STORAGE_DIR=/tmp/bench/storage DATA_DIR=/tmp/bench/data
+    python benchmarks/seed_catalog.py --tracks 20000
+    git worktree add /tmp/falavip-before <commit anterior>
+    python benchmarks/load_music_list.py --server-dir /tmp/falavip-before/server --label antes
+    python benchmarks/load_music_list.py --label depois
+
+Um servidor antigo ignora os parâmetros que não conhece (fields, limit) e
+responde a lista completa; a comparação continua válida cenário a cenário.
+Só funciona em Linux (lê /proc).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+
+# (nome, parâmetros, Accept-Encoding, revalidar com If-None-Match)
+SCENARIOS = [
+    ("lista completa, sem compressão", {}, "identity", False),
+    ("lista completa, gzip", {}, "gzip", False),
+    ("lista completa, br", {}, "br", False),
+    ("campos do player, gzip", {"fields": "id,original_name,is_ad"}, "gzip", False),
+    ("campos do player, If-None-Match (304)", {"fields": "id,original_name,is_ad"}, "gzip", True),
+    ("página limit=200, gzip", {"limit": 200}, "gzip", False),
+]
+
+
+def process_cpu_seconds(pid: int) -> float:
+    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def wait_ready(base_url: str, server: subprocess.Popen):
+    for _ in range(150):
+        if server.poll() is not None:
+            raise SystemExit("O servidor terminou ao iniciar")
+        try:
+            httpx.get(f"{base_url}/api/ai/status", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit("O servidor não respondeu")
+
+
+def run_scenario(base_url: str, pid: int, params: dict, accept_encoding: str,
+                 revalidate: bool, requests: int) -> tuple[int, int, float, float]:
+    """(status, bytes, cpu do servidor em ms, latência em ms) por requisição"""
+    with httpx.Client(base_url=base_url, headers={"Accept-Encoding": accept_encoding}, timeout=60) as client:
+        headers = {}
+        warmup = client.get("/api/music/list", params=params)
+        if revalidate and warmup.headers.get("etag"):
+            headers["If-None-Match"] = warmup.headers["etag"]
+
+        cpu_before = process_cpu_seconds(pid)
+        started = time.perf_counter()
+        size = status = 0
+        for _ in range(requests):
+            with client.stream("GET", "/api/music/list", params=params, headers=headers) as response:
+                size = sum(len(chunk) for chunk in response.iter_raw())
+                status = response.status_code
+        elapsed = time.perf_counter() - started
+        cpu = process_cpu_seconds(pid) - cpu_before
+
+    return status, size, cpu / requests * 1000, elapsed / requests * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--server-dir", type=Path, default=SERVER_DIR)
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--label", default="")
+    args = parser.parse_args()
+
+    env = dict(os.environ, OPENROUTER_API_KEY="", ELEVENLABS_API_KEY="")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=args.server_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url, server)
+        print(f"{args.label or args.server_dir} ({args.requests} requisições por cenário)")
+        for name, params, accept_encoding, revalidate in SCENARIOS:
+            status, size, cpu_ms, latency_ms = run_scenario(
+                base_url, server.pid, params, accept_encoding, revalidate, args.requests
+            )
+            print(f"  {name:40s} {status}  {size:>10,d} B  cpu {cpu_ms:7.1f} ms  latência {latency_ms:7.1f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
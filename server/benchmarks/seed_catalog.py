@@ -0,0 +1,73 @@
+"""
+Cria um catálogo sintético para os benchmarks (músicas, metadados e playlist)
+
+Usa o mesmo banco do servidor (STORAGE_DIR / DATA_DIR), então rode apontando
+para diretórios descartáveis:
+
+    cd server
+    STORAGE_DIR=/tmp/bench/storage DATA_DIR=/tmp/bench/data \
+        python benchmarks/seed_catalog.py --tracks 20000
+
+Os arquivos de áudio não são criados; só as linhas do banco. As durações
+têm precisão total de float (como as lidas pelo mutagen), o que importa para
+comparar a serialização de colunas REAL.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiosqlite  # noqa: E402
+
+import main  # noqa: E402
+
+GENRES = ["Rock", "Pop", "MPB", "Sertanejo", "Samba", "Forró", "Jazz", None]
+
+
+async def seed(tracks: int, classified: float, seed_value: int):
+    random.seed(seed_value)
+    await main.init_db()
+
+    base = datetime(2024, 1, 1)
+    music, metadata = [], []
+    for i in range(tracks):
+        music_id = uuid.uuid4().hex
+        artist = f"Artista {random.randint(1, tracks // 7 or 1)}"
+        title = f"Música {i}{' (Ao Vivo)' if i % 7 == 0 else ''}"
+        created_at = (base + timedelta(minutes=i)).isoformat()
+        music.append((music_id, f"{music_id}.mp3", f"{artist} - {title}.mp3",
+                      1 if i % 25 == 0 else 0, random.uniform(120, 360), created_at))
+        if random.random() < classified:
+            metadata.append((music_id, artist, title, None, random.choice(GENRES),
+                             str(random.randint(1970, 2024)), None, "{}", created_at, "filename"))
+
+    async with aiosqlite.connect(main.DB_PATH) as db:
+        await db.executemany(
+            "INSERT INTO music (id, filename, original_name, is_ad, duration, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            music
+        )
+        await db.executemany(
+            """INSERT INTO music_metadata (music_id, artist, title, album, genre, year, obs, raw_response,
+                                           classified_at, source)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            metadata
+        )
+        await db.commit()
+
+    result = await main.generate_playlist()
+    print(f"{tracks} músicas, {len(metadata)} classificadas, playlist com {result['count']} itens em {main.DB_PATH}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tracks", type=int, default=20000)
+    parser.add_argument("--classified", type=float, default=0.8, help="fração com metadados")
+    parser.add_argument("--seed", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(seed(args.tracks, args.classified, args.seed))
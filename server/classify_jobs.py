@@ -0,0 +1,508 @@
+"""
+Jobs persistentes de classificação de músicas com IA
+
+Um job é criado com todas as músicas ainda não classificadas e processado
+por um worker no servidor, independente da conexão HTTP que o iniciou.
+O estado (job e cada item) fica no banco: se o servidor reiniciar, os jobs
+em andamento continuam de onde pararam. A concorrência é adaptativa (AIMD):
+cresce aos poucos enquanto as chamadas dão certo e cai pela metade quando o
+upstream responde 429. Os nomes vão em lotes (vários por chamada); um lote
+com erro, ou os itens sem resposta válida, são divididos ao meio e tentados
+de novo até isolar a música problemática, que é repetida algumas vezes.
+Antes da IA, uma etapa local opcional resolve o que as tags e o nome do
+arquivo já informam.
+Qualquer cliente pode acompanhar o progresso (SSE ou WebSocket).
+"""
+
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import aiosqlite
+
+
+async def init_classification_tables(db: aiosqlite.Connection):
+    """Cria as tabelas de jobs e itens"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS classification_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            classified INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS classification_job_items (
+            job_id TEXT NOT NULL,
+            music_id TEXT NOT NULL,
+            music_name TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            artist TEXT,
+            title TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (job_id, music_id)
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_classification_items_status
+        ON classification_job_items (job_id, status)
+    """)
+
+    # Migração: contadores de itens resolvidos localmente e de chamadas à IA
+    try:
+        await db.execute("ALTER TABLE classification_jobs ADD COLUMN local_classified INTEGER NOT NULL DEFAULT 0")
+    except:
+        pass
+    try:
+        await db.execute("ALTER TABLE classification_jobs ADD COLUMN ai_requests INTEGER NOT NULL DEFAULT 0")
+    except:
+        pass
+
+
+# Itens por rodada da extração local (tags / nome do arquivo)
+LOCAL_CHUNK_SIZE = 50
+
+
+class RateLimiter:
+    """Limite de concorrência AIMD (aumento aditivo, redução multiplicativa)"""
+
+    def __init__(self, initial: float, minimum: float, maximum: float):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+
+    def on_success(self):
+        # +1 a cada "janela" de chamadas bem-sucedidas
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_rate_limited(self, pause: float):
+        now = time.monotonic()
+        # Várias respostas 429 da mesma rajada contam como um único corte
+        if now - self._last_decrease > pause:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+        self.paused_until = max(self.paused_until, now + pause)
+
+    @property
+    def slots(self) -> int:
+        return max(1, int(self.limit))
+
+
+class ClassificationJobs:
+    """Cria, executa e acompanha jobs de classificação"""
+
+    def __init__(self, db_path: Path, classify_batch: Callable[[list], Awaitable[dict]],
+                 extract_local: Optional[Callable[[list], Awaitable[dict]]] = None,
+                 on_progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+                 batch_size: int = 20, initial_concurrency: int = 4, max_concurrency: int = 8,
+                 max_attempts: int = 3, retry_delay: float = 2.0, rate_limit_pause: float = 5.0):
+        self.db_path = db_path
+        # classify_batch([{music_id, music_name}]) -> {music_id: metadata} com os itens
+        # classificados; erro com status_code 429 = rate limit
+        self.classify_batch = classify_batch
+        # extract_local([{music_id, music_name}]) -> {music_id: metadata} só com os
+        # itens resolvidos sem IA (tags / nome do arquivo), já gravados
+        self.extract_local = extract_local
+        self.batch_size = max(1, batch_size)
+        self.on_progress = on_progress
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.rate_limit_pause = rate_limit_pause
+
+        self._workers: dict[str, asyncio.Task] = {}
+        self._limiters: dict[str, RateLimiter] = {}
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        # Chamadas à IA ainda não gravadas, por job (vão junto com a próxima escrita do job)
+        self._ai_requests: dict[str, int] = {}
+
+    # ---------- Consulta ----------
+
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("SELECT * FROM classification_jobs WHERE id = ?", (job_id,)) as cursor:
+                row = await cursor.fetchone()
+        if not row:
+            return None
+
+        job = dict(row)
+        job["ai_requests"] += self._ai_requests.get(job_id, 0)
+        limiter = self._limiters.get(job_id)
+        job["concurrency"] = round(limiter.limit, 2) if limiter else None
+        job["percent"] = round((job["classified"] + job["failed"]) / job["total"] * 100) if job["total"] else 100
+        # Chamadas que a IA precisaria para os itens resolvidos localmente
+        job["ai_requests_avoided"] = -(-job["local_classified"] // self.batch_size)
+        return job
+
+    async def list_jobs(self, limit: int = 20) -> list[dict]:
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT * FROM classification_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def running_job_id(self) -> Optional[str]:
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT id FROM classification_jobs WHERE status = 'running' ORDER BY created_at DESC LIMIT 1"
+            ) as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def get_items(self, job_id: str, status: Optional[str] = None) -> list[dict]:
+        query = "SELECT * FROM classification_job_items WHERE job_id = ?"
+        params: list = [job_id]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(query, params) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    # ---------- Ciclo de vida ----------
+
+    async def create_job(self) -> dict:
+        """
+        Cria um job com as músicas sem classificação (ou retorna o job em
+        andamento, já que só faz sentido um por vez)
+        """
+        running = await self.running_job_id()
+        if running:
+            return await self.get_job(running)
+
+        job_id = uuid.uuid4().hex[:12]
+        now = datetime.now().isoformat()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                """SELECT m.id, m.original_name FROM music m
+                   LEFT JOIN music_metadata mm ON m.id = mm.music_id
+                   WHERE mm.music_id IS NULL"""
+            ) as cursor:
+                unclassified = await cursor.fetchall()
+
+            status = "running" if unclassified else "completed"
+            await db.execute(
+                """INSERT INTO classification_jobs (id, status, total, created_at, updated_at, finished_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (job_id, status, len(unclassified), now, now, None if unclassified else now)
+            )
+            await db.executemany(
+                """INSERT INTO classification_job_items (job_id, music_id, music_name, updated_at)
+                   VALUES (?, ?, ?, ?)""",
+                [(job_id, music_id, name, now) for music_id, name in unclassified]
+            )
+            await db.commit()
+
+        if unclassified:
+            self.start_worker(job_id)
+        return await self.get_job(job_id)
+
+    def start_worker(self, job_id: str):
+        worker = self._workers.get(job_id)
+        if worker and not worker.done():
+            return
+        self._workers[job_id] = asyncio.create_task(self._run(job_id))
+
+    async def resume(self):
+        """Retoma os jobs que estavam em andamento quando o servidor parou"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("SELECT id FROM classification_jobs WHERE status = 'running'") as cursor:
+                job_ids = [row[0] for row in await cursor.fetchall()]
+
+        for job_id in job_ids:
+            print(f"[AI] Retomando job de classificação {job_id}")
+            self.start_worker(job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        job = await self.get_job(job_id)
+        if not job or job["status"] != "running":
+            return False
+
+        worker = self._workers.get(job_id)
+        if worker and not worker.done():
+            worker.cancel()
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+
+        await self._finish(job_id, "cancelled")
+        return True
+
+    async def stop(self):
+        """Interrompe os workers (shutdown) mantendo os jobs como 'running' para retomar depois"""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        for worker in workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers.clear()
+
+        if self._ai_requests:
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.executemany(
+                    "UPDATE classification_jobs SET ai_requests = ai_requests + ? WHERE id = ?",
+                    [(count, job_id) for job_id, count in self._ai_requests.items()]
+                )
+                await db.commit()
+            self._ai_requests.clear()
+
+    # ---------- Progresso ----------
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers:
+            subscribers.discard(queue)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    async def _publish(self, event: str, data: dict):
+        for queue in list(self._subscribers.get(data["job_id"], ())):
+            queue.put_nowait((event, data))
+        if self.on_progress:
+            try:
+                await self.on_progress({"event": event, **data})
+            except Exception as e:
+                print(f"[AI] Erro ao notificar progresso: {e}")
+
+    # ---------- Worker ----------
+
+    async def _run(self, job_id: str):
+        limiter = self._limiters.setdefault(
+            job_id, RateLimiter(self.initial_concurrency, 1, self.max_concurrency)
+        )
+
+        # (not_before, lote) - lotes aguardando execução
+        pending = await self.get_items(job_id, "pending")
+        if self.extract_local:
+            pending = await self._run_local(job_id, pending)
+        queue = [(0.0, pending[i:i + self.batch_size]) for i in range(0, len(pending), self.batch_size)]
+        inflight: dict[asyncio.Task, list] = {}
+
+        try:
+            while queue or inflight:
+                now = time.monotonic()
+
+                # Disparar lotes prontos enquanto houver vaga
+                if now >= limiter.paused_until:
+                    ready = [entry for entry in queue if entry[0] <= now]
+                    for entry in ready[:max(0, limiter.slots - len(inflight))]:
+                        queue.remove(entry)
+                        chunk = entry[1]
+                        inflight[asyncio.create_task(self.classify_batch(chunk))] = chunk
+
+                # Esperar uma chamada terminar ou o próximo lote ficar pronto (não antes do
+                # fim da pausa); lotes já prontos sem vaga esperam uma chamada terminar
+                resume_at = max(now, limiter.paused_until)
+                wake_times = [max(not_before, resume_at) for not_before, _ in queue]
+                wake_times = [wake for wake in wake_times if wake > now]
+                timeout = min(wake_times) - now if wake_times else None
+                if inflight:
+                    done, _ = await asyncio.wait(inflight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(timeout or 0)
+                    continue
+
+                for task in done:
+                    chunk = inflight.pop(task)
+                    queue.extend(await self._handle_result(job_id, chunk, task, limiter))
+
+            await self._finish(job_id, "completed")
+
+        except asyncio.CancelledError:
+            for task in inflight:
+                task.cancel()
+            raise
+        finally:
+            self._workers.pop(job_id, None)
+
+    async def _run_local(self, job_id: str, pending: list) -> list:
+        """Resolve localmente o que for possível; retorna os itens que seguem para a IA"""
+        remaining = []
+        for i in range(0, len(pending), LOCAL_CHUNK_SIZE):
+            chunk = pending[i:i + LOCAL_CHUNK_SIZE]
+            try:
+                results = await self.extract_local(chunk)
+            except Exception as e:
+                print(f"[AI] Erro na extração local: {e}")
+                results = {}
+
+            outcomes = [(item, "done", None, results[item["music_id"]]) for item in chunk if item["music_id"] in results]
+            remaining.extend(item for item in chunk if item["music_id"] not in results)
+            if outcomes:
+                async with aiosqlite.connect(self.db_path) as db:
+                    await db.execute(
+                        "UPDATE classification_jobs SET local_classified = local_classified + ? WHERE id = ?",
+                        (len(outcomes), job_id)
+                    )
+                    await db.commit()
+                await self._record(job_id, outcomes)
+
+        if pending:
+            print(f"[AI] Job {job_id}: {len(pending) - len(remaining)} de {len(pending)} músicas resolvidas localmente")
+        return remaining
+
+    @staticmethod
+    def _split(chunk: list, retry_at: float) -> list:
+        """Divide o lote ao meio para isolar os itens problemáticos"""
+        middle = len(chunk) // 2
+        return [(retry_at, chunk[:middle]), (retry_at, chunk[middle:])]
+
+    async def _handle_result(self, job_id: str, chunk: list, task: asyncio.Task,
+                             limiter: RateLimiter) -> list:
+        """Grava o resultado do lote; retorna os lotes a tentar de novo [(horário, lote)]"""
+        error = task.exception()
+        now = time.monotonic()
+        self._ai_requests[job_id] = self._ai_requests.get(job_id, 0) + 1
+
+        if error is None:
+            limiter.on_success()
+            results = task.result()
+            done = [item for item in chunk if item["music_id"] in results]
+            missing = [item for item in chunk if item["music_id"] not in results]
+            await self._record(job_id, [(item, "done", None, results[item["music_id"]]) for item in done])
+
+            if not missing:
+                return []
+            if len(missing) > 1:
+                # Sem resposta válida para alguns itens: só eles voltam, em lotes menores
+                return self._split(missing, now)
+            error_message = "Resposta da IA sem dados válidos para esta música"
+            status_code = 502
+        else:
+            status_code = getattr(error, "status_code", None) or 500
+            if status_code == 429:
+                # Rate limit: reduzir a concorrência e tentar de novo sem contar tentativa
+                limiter.on_rate_limited(self.rate_limit_pause)
+                print(f"[AI] 429 do upstream, concorrência -> {limiter.limit:.1f}")
+                return [(now + self.rate_limit_pause, chunk)]
+
+            error_message = getattr(error, "detail", None) or str(error)
+            if len(chunk) > 1:
+                return self._split(chunk, now + self.retry_delay)
+            missing = chunk
+
+        # Um único item falhando: contar tentativa
+        item = missing[0]
+        item["attempts"] = item.get("attempts", 0) + 1
+        # Erros 4xx (música removida, requisição inválida) não melhoram repetindo
+        if item["attempts"] < self.max_attempts and not 400 <= status_code < 500:
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.execute(
+                    """UPDATE classification_job_items SET attempts = ?, error = ?, updated_at = ?
+                       WHERE job_id = ? AND music_id = ?""",
+                    (item["attempts"], error_message, datetime.now().isoformat(), job_id, item["music_id"])
+                )
+                await db.execute(
+                    "UPDATE classification_jobs SET ai_requests = ai_requests + ? WHERE id = ?",
+                    (self._ai_requests.pop(job_id, 0), job_id)
+                )
+                await db.commit()
+            return [(now + self.retry_delay * item["attempts"], [item])]
+
+        await self._record(job_id, [(item, "failed", error_message, {})])
+        return []
+
+    async def _record(self, job_id: str, outcomes: list):
+        """Grava os itens concluídos [(item, status, erro, metadata)] e publica o progresso"""
+        if not outcomes:
+            return
+
+        now = datetime.now().isoformat()
+        classified = sum(1 for _, status, _, _ in outcomes if status == "done")
+        failed = len(outcomes) - classified
+
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.executemany(
+                """UPDATE classification_job_items
+                   SET status = ?, attempts = ?, error = ?, artist = ?, title = ?, updated_at = ?
+                   WHERE job_id = ? AND music_id = ?""",
+                [(status, item.get("attempts", 0), error, metadata.get("artist"), metadata.get("title"),
+                  now, job_id, item["music_id"]) for item, status, error, metadata in outcomes]
+            )
+            await db.execute(
+                """UPDATE classification_jobs
+                   SET classified = classified + ?, failed = failed + ?, ai_requests = ai_requests + ?,
+                       updated_at = ?
+                   WHERE id = ?""",
+                (classified, failed, self._ai_requests.pop(job_id, 0), now, job_id)
+            )
+            await db.commit()
+
+        job = await self.get_job(job_id)
+        classified = job["classified"] - classified
+        failed = job["failed"] - failed
+        for item, status, error, metadata in outcomes:
+            success = status == "done"
+            if success:
+                classified += 1
+                print(f"✓ Classificado: {item['music_name']} -> {metadata.get('artist')} - {metadata.get('title')}")
+            else:
+                failed += 1
+                print(f"✗ Erro ao classificar {item['music_name']}: {error}")
+
+            await self._publish("progress", {
+                "job_id": job_id,
+                "current": classified + failed,
+                "total": job["total"],
+                "classified": classified,
+                "failed": failed,
+                "percent": round((classified + failed) / job["total"] * 100) if job["total"] else 100,
+                "concurrency": job["concurrency"],
+                "music_id": item["music_id"],
+                "music_name": item["music_name"],
+                "artist": metadata.get("artist"),
+                "title": metadata.get("title"),
+                "success": success,
+                "error": error
+            })
+
+    async def _finish(self, job_id: str, status: str):
+        now = datetime.now().isoformat()
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                """UPDATE classification_jobs
+                   SET status = ?, ai_requests = ai_requests + ?, updated_at = ?, finished_at = ?
+                   WHERE id = ?""",
+                (status, self._ai_requests.pop(job_id, 0), now, now, job_id)
+            )
+            await db.commit()
+
+        self._limiters.pop(job_id, None)
+        job = await self.get_job(job_id)
+        message = f"Concluído! {job['classified']} classificadas, {job['failed']} falhas"
+        if status == "cancelled":
+            message = f"Cancelado. {job['classified']} classificadas, {job['failed']} falhas"
+        await self._publish("complete", {
+            "job_id": job_id,
+            "status": status,
+            "total": job["total"],
+            "classified": job["classified"],
+            "failed": job["failed"],
+            "message": message
+        })
@@ -0,0 +1,133 @@
+"""
+Serialização JSON rápida para as respostas mais pesadas da API
+
+Quando o endpoint retorna dicts, o FastAPI percorre tudo com
+jsonable_encoder antes de serializar, o que domina o tempo em listas
+grandes. Aqui há três caminhos mais curtos:
+- FastJSONResponse: serializa direto (orjson se instalado, senão json);
+- sql_json_array: o próprio SQLite monta o array JSON (json_object), sem
+  criar um dict por linha em Python. Colunas REAL ficam de fora: o SQLite
+  as escreve com 15 dígitos significativos (245.33333333333334 vira
+  245.333333333333), então elas são serializadas aqui, como nos endpoints
+  que retornam dicts;
+- SnapshotCache: guarda os bytes já serializados de respostas que só mudam
+  quando a revisão do catálogo muda.
+"""
+
+import json
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Sequence, Union
+
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def dumps(content: Any) -> bytes:
+    """Serializa para bytes JSON (UTF-8, sem espaços)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse que serializa com orjson quando disponível"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def raw_json_response(body: Union[bytes, str], headers: Optional[dict] = None,
+                      status_code: int = 200) -> Response:
+    """Resposta com JSON já serializado"""
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+async def sql_json_array(db, columns: Sequence[str], query: str, params: Sequence = (),
+                         float_columns: Sequence[str] = ()) -> str:
+    """
+    Executa query (que deve expor as colunas em columns) e retorna o array JSON
+    de objetos montado pelo SQLite. A ordem do array é a ordem do ORDER BY da query.
+    As colunas em float_columns (REAL) são serializadas em Python, mantendo a
+    ordem das chaves.
+    """
+    if not any(column in float_columns for column in columns):
+        async with db.execute(
+            f"SELECT COALESCE(json_group_array(json_object({_pairs(columns)})), '[]') FROM ({query})",
+            params
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row[0]
+
+    # Por linha: trechos json_object das colunas seguidas não-REAL intercalados com os valores REAL
+    selects, keys, run = [], [], []
+    for column in columns:
+        if column not in float_columns:
+            run.append(column)
+            continue
+        if run:
+            selects.append(f"json_object({_pairs(run)})")
+            keys.append(None)
+            run = []
+        selects.append(_quote(column))
+        keys.append(dumps(column).decode() + ":")
+    if run:
+        selects.append(f"json_object({_pairs(run)})")
+        keys.append(None)
+
+    async with db.execute(f"SELECT {', '.join(selects)} FROM ({query})", params) as cursor:
+        rows = await cursor.fetchall()
+
+    objects = []
+    for row in rows:
+        parts = [value[1:-1] if key is None else key + dumps(value).decode() for key, value in zip(keys, row)]
+        objects.append("{" + ",".join(parts) + "}")
+    return "[" + ",".join(objects) + "]"
+
+
+def _pairs(columns: Sequence[str]) -> str:
+    return ", ".join(f"'{column}', {_quote(column)}" for column in columns)
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+class SnapshotCache:
+    """Respostas serializadas por chave, válidas enquanto a versão não muda"""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Any, tuple[str, bytes]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Any, version: str, build: Callable[[], Awaitable[Union[bytes, str]]]) -> bytes:
+        entry = self._entries.get(key)
+        if entry and entry[0] == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        body = await build()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        self._entries[key] = (version, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return body
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": sum(len(body) for _, body in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,179 @@
+"""
+Biblioteca materializada (music + music_metadata) e contagens por faceta
+
+A tabela library é a junção de music com music_metadata, mantida por
+triggers a cada upload, exclusão, classificação ou edição de metadados; as
+listagens leem dela sem LEFT JOIN. library_facets guarda quantas músicas
+há por artista e por gênero, ajustadas a cada mudança na library, então
+as listas de artistas e gêneros não precisam de GROUP BY.
+"""
+
+import aiosqlite
+
+MUSIC_COLUMNS = ["id", "filename", "original_name", "is_ad", "created_at", "duration"]
+METADATA_COLUMNS = ["artist", "title", "album", "genre", "year", "obs", "classified_at", "source"]
+LIBRARY_COLUMNS = MUSIC_COLUMNS + METADATA_COLUMNS
+REAL_COLUMNS = ["duration"]
+
+FACETS = ("artist", "genre")
+
+
+def _facet_change(kind: str, ref: str, delta: int) -> str:
+    """SQL que soma delta à contagem da faceta (ignora valores vazios)"""
+    return f"""
+        INSERT INTO library_facets (kind, value, count)
+        SELECT '{kind}', {ref}.{kind}, {delta} WHERE {ref}.{kind} IS NOT NULL AND {ref}.{kind} != ''
+        ON CONFLICT (kind, value) DO UPDATE SET count = count + {delta};
+    """
+
+
+_SET_METADATA = ", ".join(f"{column} = new.{column}" for column in METADATA_COLUMNS)
+_CLEAR_METADATA = ", ".join(f"{column} = NULL" for column in METADATA_COLUMNS)
+
+_TRIGGERS = [
+    # music -> library
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_music_ai AFTER INSERT ON music BEGIN
+        DELETE FROM library WHERE id = new.id;
+        INSERT INTO library ({', '.join(LIBRARY_COLUMNS)})
+        SELECT {', '.join('new.' + c for c in MUSIC_COLUMNS)}, {', '.join('mm.' + c for c in METADATA_COLUMNS)}
+        FROM (SELECT 1) LEFT JOIN music_metadata mm ON mm.music_id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_music_au AFTER UPDATE ON music BEGIN
+        UPDATE library SET {', '.join(f'{c} = new.{c}' for c in MUSIC_COLUMNS)} WHERE id = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS library_music_ad AFTER DELETE ON music BEGIN
+        DELETE FROM library WHERE id = old.id;
+    END
+    """,
+    # music_metadata -> library
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_metadata_ai AFTER INSERT ON music_metadata BEGIN
+        UPDATE library SET {_SET_METADATA} WHERE id = new.music_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_metadata_au AFTER UPDATE ON music_metadata BEGIN
+        UPDATE library SET {_SET_METADATA} WHERE id = new.music_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_metadata_ad AFTER DELETE ON music_metadata BEGIN
+        UPDATE library SET {_CLEAR_METADATA} WHERE id = old.music_id;
+    END
+    """,
+    # library -> library_facets
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_facets_ai AFTER INSERT ON library BEGIN
+        {''.join(_facet_change(kind, 'new', 1) for kind in FACETS)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS library_facets_ad AFTER DELETE ON library BEGIN
+        {''.join(_facet_change(kind, 'old', -1) for kind in FACETS)}
+        DELETE FROM library_facets WHERE count <= 0 AND kind IN ('artist', 'genre')
+            AND value IN (old.artist, old.genre);
+    END
+    """,
+]
+
+# Atualização de artista/gênero: só mexe na faceta que mudou
+for _kind in FACETS:
+    _TRIGGERS.append(f"""
+    CREATE TRIGGER IF NOT EXISTS library_facets_au_{_kind} AFTER UPDATE OF {_kind} ON library
+    WHEN old.{_kind} IS NOT new.{_kind} BEGIN
+        {_facet_change(_kind, 'old', -1)}
+        {_facet_change(_kind, 'new', 1)}
+        DELETE FROM library_facets WHERE kind = '{_kind}' AND value = old.{_kind} AND count <= 0;
+    END
+    """)
+
+
+async def init_library(db: aiosqlite.Connection):
+    """Cria a biblioteca materializada e reconstrói se estiver inconsistente"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS library (
+            id TEXT PRIMARY KEY,
+            filename TEXT,
+            original_name TEXT,
+            is_ad INTEGER,
+            created_at TIMESTAMP,
+            duration REAL,
+            artist TEXT,
+            title TEXT,
+            album TEXT,
+            genre TEXT,
+            year TEXT,
+            obs TEXT,
+            classified_at TIMESTAMP,
+            source TEXT
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_library_created ON library (created_at DESC)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_library_artist ON library (artist, title)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_library_genre ON library (genre, artist, title)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS library_facets (
+            kind TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, value)
+        )
+    """)
+
+    for sql in _TRIGGERS:
+        await db.execute(sql)
+
+    # Banco antigo (sem a tabela) ou alterado por fora dos triggers
+    async with db.execute("SELECT COUNT(*) FROM music") as cursor:
+        music_count = (await cursor.fetchone())[0]
+    async with db.execute("SELECT COUNT(*) FROM library") as cursor:
+        library_count = (await cursor.fetchone())[0]
+    async with db.execute("""
+        SELECT COUNT(*) FROM music m JOIN music_metadata mm ON mm.music_id = m.id
+    """) as cursor:
+        classified_count = (await cursor.fetchone())[0]
+    async with db.execute("SELECT COUNT(*) FROM library WHERE classified_at IS NOT NULL") as cursor:
+        library_classified = (await cursor.fetchone())[0]
+
+    consistent = music_count == library_count and classified_count == library_classified
+    for kind in FACETS:
+        if not consistent:
+            break
+        async with db.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM library_facets WHERE kind = ?", (kind,)
+        ) as cursor:
+            facet_total = (await cursor.fetchone())[0]
+        async with db.execute(
+            f"SELECT COUNT(*) FROM library WHERE {kind} IS NOT NULL AND {kind} != ''"
+        ) as cursor:
+            consistent = facet_total == (await cursor.fetchone())[0]
+
+    if not consistent:
+        await rebuild_library(db)
+
+
+async def rebuild_library(db: aiosqlite.Connection):
+    """Recria library e library_facets a partir de music e music_metadata"""
+    await db.execute("DELETE FROM library")
+    await db.execute("DELETE FROM library_facets")
+    # Os triggers de library_facets fazem as contagens durante a inserção
+    await db.execute(f"""
+        INSERT INTO library ({', '.join(LIBRARY_COLUMNS)})
+        SELECT {', '.join('m.' + c for c in MUSIC_COLUMNS)}, {', '.join('mm.' + c for c in METADATA_COLUMNS)}
+        FROM music m LEFT JOIN music_metadata mm ON mm.music_id = m.id
+    """)
+    print("[LIBRARY] Biblioteca materializada reconstruída")
+
+
+async def get_facets(db: aiosqlite.Connection, kind: str) -> list[tuple[str, int]]:
+    """[(valor, contagem)] de uma faceta, em ordem alfabética"""
+    async with db.execute(
+        "SELECT value, count FROM library_facets WHERE kind = ? AND count > 0 ORDER BY value",
+        (kind,)
+    ) as cursor:
+        return [(row[0], row[1]) for row in await cursor.fetchall()]
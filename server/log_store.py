@@ -0,0 +1,405 @@
+"""
+Armazenamento particionado dos logs de atividade
+
+Os logs ficam em uma tabela por mês (activity_logs_AAAAMM). Com isso:
+- a retenção apaga meses inteiros com DROP TABLE, sem varrer linhas;
+- consultas por intervalo só tocam as partições do período;
+- os totais por tipo ficam em activity_log_counts (por partição);
+- relatórios usam rollups por hora/dia, atualizados a cada lote gravado.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+import aiosqlite
+
+PARTITION_PREFIX = "activity_logs_"
+PARTITION_GLOB = "activity_logs_[0-9][0-9][0-9][0-9][0-9][0-9]"
+
+# Tipos de log cuja descrição identifica a faixa ("Música tocada: nome")
+SUBJECT_TYPES = ("music", "ad")
+
+
+def partition_for(timestamp: str) -> str:
+    """Nome da partição de um timestamp no formato 'AAAA-MM-DD HH:MM:SS'"""
+    return f"{PARTITION_PREFIX}{timestamp[0:4]}{timestamp[5:7]}"
+
+
+def partition_bounds(partition: str) -> tuple[str, str]:
+    """Início (inclusivo) e fim (exclusivo) do mês de uma partição"""
+    year = int(partition[-6:-2])
+    month = int(partition[-2:])
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year:04d}-{month:02d}-01 00:00:00", f"{next_year:04d}-{next_month:02d}-01 00:00:00"
+
+
+def rollup_subject(log_type: str, description: str) -> str:
+    """Extrai o item do log para os rollups (nome da música/propaganda)"""
+    if log_type in SUBJECT_TYPES:
+        _, sep, name = description.partition(": ")
+        return name if sep else description
+    return ""
+
+
+async def init_log_tables(db: aiosqlite.Connection):
+    """Cria tabelas auxiliares (contadores e rollups) e migra a tabela antiga"""
+    # Contadores por partição e tipo. A versão anterior era só por tipo.
+    async with db.execute("PRAGMA table_info(activity_log_counts)") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    if columns and "partition" not in columns:
+        await db.execute("DROP TABLE activity_log_counts")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS activity_log_counts (
+            partition TEXT NOT NULL,
+            type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (partition, type)
+        )
+    """)
+
+    # Rollups pré-agregados (granularity = 'hour' ou 'day')
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS activity_log_rollups (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            type TEXT NOT NULL,
+            subject TEXT NOT NULL DEFAULT '',
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket, type, subject)
+        )
+    """)
+
+    await _migrate_legacy_table(db)
+
+
+async def ensure_partition(db: aiosqlite.Connection, partition: str):
+    """Cria a tabela do mês com índices e triggers de contagem"""
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS {partition} (
+            id INTEGER PRIMARY KEY,
+            timestamp TIMESTAMP NOT NULL,
+            type TEXT NOT NULL,
+            description TEXT NOT NULL,
+            details TEXT
+        )
+    """)
+    await db.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{partition}_ts_id
+        ON {partition} (timestamp DESC, id DESC)
+    """)
+    await db.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{partition}_type_ts_id
+        ON {partition} (type, timestamp DESC, id DESC)
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{partition}_count_insert
+        AFTER INSERT ON {partition}
+        BEGIN
+            INSERT INTO activity_log_counts (partition, type, count) VALUES ('{partition}', NEW.type, 1)
+            ON CONFLICT(partition, type) DO UPDATE SET count = count + 1;
+        END
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{partition}_count_delete
+        AFTER DELETE ON {partition}
+        BEGIN
+            UPDATE activity_log_counts SET count = count - 1
+            WHERE partition = '{partition}' AND type = OLD.type;
+        END
+    """)
+
+
+async def list_partitions(db: aiosqlite.Connection) -> list[str]:
+    """Partições existentes, da mais recente para a mais antiga"""
+    async with db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name DESC",
+        (PARTITION_GLOB,)
+    ) as cursor:
+        return [row[0] for row in await cursor.fetchall()]
+
+
+def _is_dropped(error: aiosqlite.OperationalError) -> bool:
+    """Partição removida pela retenção entre a listagem e a consulta"""
+    return "no such table" in str(error)
+
+
+async def max_log_id(db: aiosqlite.Connection) -> int:
+    """Maior id entre todas as partições (ids são únicos globalmente)"""
+    max_id = 0
+    for partition in await list_partitions(db):
+        try:
+            async with db.execute(f"SELECT MAX(id) FROM {partition}") as cursor:
+                row = await cursor.fetchone()
+        except aiosqlite.OperationalError as e:
+            if _is_dropped(e):
+                continue
+            raise
+        if row and row[0]:
+            max_id = max(max_id, row[0])
+    return max_id
+
+
+async def _add_rollups(db: aiosqlite.Connection, rollups: Counter):
+    """Soma contagens (granularity, bucket, type, subject) -> n nos rollups"""
+    await db.executemany(
+        """INSERT INTO activity_log_rollups (granularity, bucket, type, subject, count)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(granularity, bucket, type, subject) DO UPDATE SET count = count + excluded.count""",
+        [(*key, n) for key, n in rollups.items()]
+    )
+
+
+async def insert_logs(db: aiosqlite.Connection, rows: list[tuple]):
+    """
+    Grava um lote de logs (id, timestamp, type, description, details)
+    nas partições do mês e atualiza os rollups. Não faz commit.
+    """
+    by_partition: dict[str, list[tuple]] = {}
+    rollups: Counter = Counter()
+
+    for row in rows:
+        _, timestamp, log_type, description, _ = row
+        by_partition.setdefault(partition_for(timestamp), []).append(row)
+
+        subject = rollup_subject(log_type, description)
+        rollups[("hour", f"{timestamp[:13]}:00", log_type, subject)] += 1
+        rollups[("day", timestamp[:10], log_type, subject)] += 1
+
+    for partition, partition_rows in by_partition.items():
+        await ensure_partition(db, partition)
+        await db.executemany(
+            f"""INSERT INTO {partition} (id, timestamp, type, description, details)
+                VALUES (?, ?, ?, ?, ?)""",
+            partition_rows
+        )
+
+    await _add_rollups(db, rollups)
+
+
+async def _migrate_legacy_table(db: aiosqlite.Connection):
+    """Move a antiga tabela única activity_logs para partições mensais"""
+    async with db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'activity_logs'"
+    ) as cursor:
+        if not await cursor.fetchone():
+            return
+
+    async with db.execute(
+        "SELECT DISTINCT substr(timestamp, 1, 7) FROM activity_logs WHERE timestamp IS NOT NULL"
+    ) as cursor:
+        months = [row[0] for row in await cursor.fetchall()]
+
+    print(f"[LOGS] Migrando activity_logs para {len(months)} partições mensais...")
+
+    for month in months:
+        partition = partition_for(f"{month}-01")
+        await ensure_partition(db, partition)
+        await db.execute(
+            f"""INSERT INTO {partition} (id, timestamp, type, description, details)
+                SELECT id, timestamp, type, description, details
+                FROM activity_logs WHERE substr(timestamp, 1, 7) = ?""",
+            (month,)
+        )
+
+    # Rollups históricos calculados uma única vez a partir da tabela antiga
+    async with db.execute(
+        "SELECT timestamp, type, description FROM activity_logs WHERE timestamp IS NOT NULL"
+    ) as cursor:
+        rollups: Counter = Counter()
+        async for timestamp, log_type, description in cursor:
+            subject = rollup_subject(log_type, description)
+            rollups[("hour", f"{timestamp[:13]}:00", log_type, subject)] += 1
+            rollups[("day", timestamp[:10], log_type, subject)] += 1
+    await _add_rollups(db, rollups)
+
+    await db.execute("DROP TABLE activity_logs")
+
+
+def _partition_in_range(partition: str, start: Optional[str], end: Optional[str]) -> bool:
+    p_start, p_end = partition_bounds(partition)
+    if start and p_end <= start:
+        return False
+    if end and p_start >= end:
+        return False
+    return True
+
+
+async def query_logs(db: aiosqlite.Connection, log_type: Optional[str] = None,
+                     start: Optional[str] = None, end: Optional[str] = None,
+                     cursor: Optional[tuple] = None, limit: int = 100,
+                     offset: int = 0) -> tuple[list[dict], bool]:
+    """
+    Busca logs do mais recente para o mais antigo percorrendo as partições.
+    Retorna (logs, has_more). Com cursor (timestamp, id) nenhuma linha é pulada.
+    """
+    conditions = []
+    params: list = []
+    if log_type:
+        conditions.append("type = ?")
+        params.append(log_type)
+    if start:
+        conditions.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        conditions.append("timestamp < ?")
+        params.append(end)
+    if cursor:
+        conditions.append("(timestamp, id) < (?, ?)")
+        params.extend(cursor)
+        offset = 0
+
+    db.row_factory = aiosqlite.Row
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    wanted = limit + 1  # Um a mais para saber se há próxima página
+    logs: list[dict] = []
+    counts = await _partition_counts(db, log_type) if offset and not (start or end) else {}
+
+    for partition in await list_partitions(db):
+        if not _partition_in_range(partition, start, end):
+            continue
+        if cursor and partition_bounds(partition)[0] > cursor[0]:
+            continue
+
+        # Pular partições inteiras usando os contadores (offset antigo)
+        if offset and partition in counts:
+            if offset >= counts[partition]:
+                offset -= counts[partition]
+                continue
+
+        try:
+            async with db.execute(
+                f"""SELECT * FROM {partition} {where}
+                    ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?""",
+                (*params, wanted - len(logs), offset)
+            ) as db_cursor:
+                rows = [dict(row) for row in await db_cursor.fetchall()]
+        except aiosqlite.OperationalError as e:
+            if _is_dropped(e):
+                continue
+            raise
+
+        if offset and not rows:
+            # Offset maior que a partição (com filtros de horário): descontar as linhas existentes
+            async with db.execute(f"SELECT COUNT(*) FROM {partition} {where}", params) as db_cursor:
+                offset -= (await db_cursor.fetchone())[0]
+            continue
+
+        offset = 0
+        logs.extend(rows)
+        if len(logs) >= wanted:
+            break
+
+    return logs[:limit], len(logs) > limit
+
+
+async def _partition_counts(db: aiosqlite.Connection, log_type: Optional[str]) -> dict[str, int]:
+    if log_type:
+        query = "SELECT partition, SUM(count) FROM activity_log_counts WHERE type = ? GROUP BY partition"
+        params = (log_type,)
+    else:
+        query = "SELECT partition, SUM(count) FROM activity_log_counts GROUP BY partition"
+        params = ()
+    async with db.execute(query, params) as cursor:
+        return {row[0]: row[1] for row in await cursor.fetchall()}
+
+
+async def count_logs(db: aiosqlite.Connection, log_type: Optional[str] = None,
+                     start: Optional[str] = None, end: Optional[str] = None) -> int:
+    """Total de logs: contadores quando não há intervalo, índice das partições quando há"""
+    if not (start or end):
+        return sum((await _partition_counts(db, log_type)).values())
+
+    conditions = []
+    params: list = []
+    if log_type:
+        conditions.append("type = ?")
+        params.append(log_type)
+    if start:
+        conditions.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        conditions.append("timestamp < ?")
+        params.append(end)
+
+    total = 0
+    for partition in await list_partitions(db):
+        if not _partition_in_range(partition, start, end):
+            continue
+        try:
+            async with db.execute(
+                f"SELECT COUNT(*) FROM {partition} WHERE {' AND '.join(conditions)}", params
+            ) as cursor:
+                total += (await cursor.fetchone())[0]
+        except aiosqlite.OperationalError as e:
+            if not _is_dropped(e):
+                raise
+    return total
+
+
+async def apply_retention(db: aiosqlite.Connection, cutoff: str) -> dict:
+    """
+    Remove logs anteriores a cutoff. Meses inteiros são descartados com DROP TABLE;
+    só o mês que contém o corte tem linhas apagadas (pelo índice de timestamp).
+    Rollups são mantidos. Não faz commit.
+    """
+    dropped = []
+    deleted = 0
+
+    for partition in await list_partitions(db):
+        p_start, p_end = partition_bounds(partition)
+        if p_end <= cutoff:
+            await db.execute(f"DROP TABLE {partition}")
+            await db.execute("DELETE FROM activity_log_counts WHERE partition = ?", (partition,))
+            dropped.append(partition)
+        elif p_start < cutoff:
+            cursor = await db.execute(f"DELETE FROM {partition} WHERE timestamp < ?", (cutoff,))
+            deleted += cursor.rowcount
+
+    return {"dropped_partitions": dropped, "deleted_rows": deleted}
+
+
+def _bucket_end(timestamp: str, granularity: str) -> str:
+    """Limite exclusivo em buckets: o bucket de end, incluído se end não estiver no início dele"""
+    if granularity == "hour":
+        if timestamp[14:] in ("", "00:00"):
+            return f"{timestamp[:13]}:00"
+        following = datetime.strptime(timestamp[:13], "%Y-%m-%d %H") + timedelta(hours=1)
+        return following.strftime("%Y-%m-%d %H:00")
+
+    if timestamp[11:] in ("", "00:00:00"):
+        return timestamp[:10]
+    following = datetime.strptime(timestamp[:10], "%Y-%m-%d") + timedelta(days=1)
+    return following.strftime("%Y-%m-%d")
+
+
+async def get_rollups(db: aiosqlite.Connection, granularity: str, log_type: Optional[str] = None,
+                      subject: Optional[str] = None, start: Optional[str] = None,
+                      end: Optional[str] = None) -> list[dict]:
+    """Lê os rollups pré-agregados (nunca varre as partições)"""
+    conditions = ["granularity = ?"]
+    params: list = [granularity]
+    if log_type:
+        conditions.append("type = ?")
+        params.append(log_type)
+    if subject is not None:
+        conditions.append("subject = ?")
+        params.append(subject)
+    if start:
+        conditions.append("bucket >= ?")
+        params.append(start[:13] + ":00" if granularity == "hour" else start[:10])
+    if end:
+        conditions.append("bucket < ?")
+        params.append(_bucket_end(end, granularity))
+
+    async with db.execute(
+        f"""SELECT bucket, type, subject, count FROM activity_log_rollups
+            WHERE {' AND '.join(conditions)}
+            ORDER BY bucket, type, subject""",
+        params
+    ) as cursor:
+        return [
+            {"bucket": row[0], "type": row[1], "subject": row[2], "count": row[3]}
+            for row in await cursor.fetchall()
+        ]
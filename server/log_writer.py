@@ -0,0 +1,165 @@
+"""
+Fila de escrita assíncrona (write-behind) para os logs de atividade
+
+Os logs chegam muito mais rápido do que vale a pena gravar um a um
+(troca de música, volume, conexões de todas as lojas). Em vez de abrir uma
+conexão e fazer commit por linha, os registros ficam em memória e são
+gravados em uma única transação a cada intervalo de flush.
+
+O id de cada log é reservado ao enfileirar (o POST /api/logs continua
+retornando o id). Se o banco ficar indisponível, a fila é limitada a
+max_pending registros: os mais antigos são descartados e contados em dropped.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import aiosqlite
+
+import log_store
+
+
+def normalize_timestamp(value: Optional[str] = None) -> str:
+    """
+    Converte um timestamp (ISO, opcionalmente com fuso) para o formato UTC do
+    SQLite; sem valor, o horário atual. ValueError se o valor não for ISO 8601.
+    """
+    if not value:
+        return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class LogWriter:
+    """Agrupa inserts em activity_logs e grava em lote periodicamente"""
+
+    def __init__(self, db_path: Path, flush_interval: float = 1.0, max_batch: int = 500,
+                 max_pending: int = 100_000):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+
+        # Registros aguardando gravação: (id, timestamp, type, description, details);
+        # id None = enfileirado antes do start, atribuído na gravação
+        self._pending: list[tuple] = []
+        self.dropped = 0
+
+        # Próximo id (único entre todas as partições mensais)
+        self._next_id: Optional[int] = None
+
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._running = False
+
+    def enqueue(self, log_type: str, description: str, details: Optional[str] = None,
+                timestamp: Optional[str] = None) -> Optional[int]:
+        """
+        Adiciona um log à fila (não bloqueia). Retorna o id reservado.
+        ValueError se o timestamp não for ISO 8601.
+        """
+        timestamp = normalize_timestamp(timestamp)
+        log_id = self._next_id
+        if log_id is not None:
+            self._next_id += 1
+        self._pending.append((log_id, timestamp, log_type, description, details))
+        self._trim()
+
+        # Lote cheio: acordar o writer antes do intervalo
+        if self._wake and len(self._pending) >= self.max_batch:
+            self._wake.set()
+        return log_id
+
+    def _trim(self):
+        """Descarta os registros mais antigos além de max_pending"""
+        excess = len(self._pending) - self.max_pending
+        if excess > 0:
+            del self._pending[:excess]
+            self.dropped += excess
+            print(f"[LOGS] Fila cheia: {excess} logs antigos descartados ({self.dropped} no total)")
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def _load_next_id(self, db: aiosqlite.Connection):
+        if self._next_id is None:
+            self._next_id = await log_store.max_log_id(db) + 1
+
+    async def _write(self, db: aiosqlite.Connection, batch: list[tuple]):
+        """Grava o lote na conexão (dentro da transação do flush)"""
+        await self._load_next_id(db)
+
+        rows = []
+        for log_id, *entry in batch:
+            if log_id is None:
+                log_id = self._next_id
+                self._next_id += 1
+            rows.append((log_id, *entry))
+        await log_store.insert_logs(db, rows)
+
+    async def flush(self) -> int:
+        """Grava todos os logs pendentes em uma única transação"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            batch, self._pending = self._pending, []
+            try:
+                async with aiosqlite.connect(self.db_path) as db:
+                    await self._write(db, batch)
+                    await db.commit()
+            except Exception as e:
+                # Devolver para a fila para tentar no próximo ciclo (ids já reservados;
+                # os atribuídos nesta tentativa ficam como lacuna)
+                print(f"[LOGS] Erro ao gravar lote de {len(batch)} logs: {e}")
+                self._pending = batch + self._pending
+                self._trim()
+                return 0
+
+            return len(batch)
+
+    async def _run(self):
+        """Loop do writer: grava a cada intervalo ou quando o lote enche"""
+        while self._running:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def start(self):
+        """Inicia o writer em background (chamar no startup da aplicação)"""
+        if self._task and not self._task.done():
+            return
+
+        try:
+            async with aiosqlite.connect(self.db_path) as db:
+                await self._load_next_id(db)
+        except Exception as e:
+            print(f"[LOGS] Erro ao ler o último id: {e}")
+
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Para o writer gravando o que ainda estiver pendente"""
+        self._running = False
+        if self._task:
+            # Acordar o loop para que termine o ciclo atual sem cancelar um flush no meio
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
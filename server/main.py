@@ -5,9 +5,13 @@ FastAPI + WebSocket para controle remoto do player
 
 import os
 import json
+import base64
+import hashlib
 import uuid
 import asyncio
-import random
+import re
+import shutil
+import tempfile
 import aiosqlite
 import httpx
 from pathlib import Path
@@ -15,23 +19,37 @@ from dotenv import load_dotenv
 
 load_dotenv()  # Carrega variáveis do arquivo .env
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Union
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-# Para extrair duração de áudio
-try:
-    from mutagen import File as MutagenFile
-    from mutagen.mp3 import MP3
-    from mutagen.mp4 import MP4
-    MUTAGEN_AVAILABLE = True
-except ImportError:
-    MUTAGEN_AVAILABLE = False
-    print("AVISO: mutagen não instalado - duração das músicas não será extraída")
+import library_view
+import log_store
+import music_search
+import play_history
+import playlist_engine
+import volume_timeline
+import ws_protocol
+from log_writer import LogWriter, normalize_timestamp
+from mix_jobs import MixJob, MixJobError, MixJobManager
+from tts_cache import TTSCache, cache_key, normalize_text
+from upstream_http import UpstreamClient
+from voice_catalog import VoiceCatalog
+from audio_mixer import (
+    BedCache, EmptyBedError, NUMPY_AVAILABLE, PCM_ARGS, SAMPLE_RATE, join_fragments, mix_pcm, pcm_from_bytes
+)
+
+# Duração de áudio (mutagen + varredura de frames MP3)
+from audio_probe import get_audio_duration
+from http_compression import CompressionMiddleware
+from fast_json import FastJSONResponse, SnapshotCache, raw_json_response, sql_json_array
+from playlist_feed import PlaylistFeed, DELTA_WINDOW, append_op, insert_op, played_op, reset_op
+from classify_jobs import ClassificationJobs, init_classification_tables
+from metadata_extractor import extract_metadata
 
 # Diretórios
 BASE_DIR = Path(__file__).parent
@@ -56,6 +74,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compressão das respostas JSON/HTML (não afeta SSE nem downloads de áudio)
+app.add_middleware(CompressionMiddleware, minimum_size=1000)
+
 # Gerenciador de conexões WebSocket
 class ConnectionManager:
     def __init__(self):
@@ -70,18 +91,58 @@ class ConnectionManager:
             "remaining": 0
         }
 
+        # Codificação negociada no handshake (ws_protocol) e ordem de envio por conexão:
+        # com deflate, cada mensagem depende das anteriores da mesma conexão
+        self.codecs: dict[WebSocket, ws_protocol.MessageCodec] = {}
+        self.send_locks: dict[WebSocket, asyncio.Lock] = {}
+
     async def connect(self, websocket: WebSocket):
-        await websocket.accept()
+        chosen = ws_protocol.choose_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=chosen)
+        self.codecs[websocket] = ws_protocol.MessageCodec(chosen)
+        self.send_locks[websocket] = asyncio.Lock()
         self.active_connections.append(websocket)
+        if chosen:
+            print(f"[WS] Conexão com subprotocolo {chosen}")
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        self.codecs.pop(websocket, None)
+        self.send_locks.pop(websocket, None)
+
+    async def send(self, websocket: WebSocket, message: dict):
+        """
+        Envia uma mensagem na codificação da conexão. Em qualquer erro a conexão
+        é encerrada: com deflate o contexto de compressão já avançou e as
+        mensagens seguintes não seriam decodificáveis pelo outro lado.
+        """
+        try:
+            async with self.send_locks[websocket]:
+                data = self.codecs[websocket].encode(message)
+                if isinstance(data, str):
+                    await websocket.send_text(data)
+                else:
+                    await websocket.send_bytes(data)
+        except Exception:
+            self.disconnect(websocket)
+            try:
+                await websocket.close(code=1011)
+            except Exception:
+                pass
+            raise
+
+    async def receive(self, websocket: WebSocket) -> dict:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        data = message.get("text") if message.get("text") is not None else message.get("bytes")
+        return self.codecs[websocket].decode(data)
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections:
+        for connection in list(self.active_connections):
             try:
-                await connection.send_json(message)
+                await self.send(connection, message)
             except:
                 pass
 
@@ -89,36 +150,14 @@ class ConnectionManager:
         """Envia mensagem para o player (primeira conexão)"""
         if self.active_connections:
             try:
-                await self.active_connections[0].send_json(message)
+                await self.send(self.active_connections[0], message)
             except:
                 pass
 
 manager = ConnectionManager()
 
-
-# Função para extrair duração de áudio
-def get_audio_duration(filepath: Path) -> float:
-    """Extrai duração de um arquivo de áudio em segundos"""
-    if not MUTAGEN_AVAILABLE:
-        return 0.0
-
-    try:
-        ext = filepath.suffix.lower()
-        if ext == '.mp3':
-            audio = MP3(str(filepath))
-            return audio.info.length
-        elif ext in ('.m4a', '.mp4', '.aac'):
-            audio = MP4(str(filepath))
-            return audio.info.length
-        else:
-            # Fallback genérico
-            audio = MutagenFile(str(filepath))
-            if audio and audio.info:
-                return audio.info.length
-    except Exception as e:
-        print(f"Erro ao extrair duração de {filepath}: {e}")
-
-    return 0.0
+# Versões da playlist gerada (deltas por WebSocket)
+playlist_feed = PlaylistFeed()
 
 
 # Modelos Pydantic
@@ -154,6 +193,13 @@ class PlayNextSong(BaseModel):
 # Inicialização do banco de dados
 async def init_db():
     async with aiosqlite.connect(DB_PATH) as db:
+        # Vacuum incremental: espaço de partições/linhas removidas é devolvido aos poucos
+        async with db.execute("PRAGMA auto_vacuum") as cursor:
+            auto_vacuum = (await cursor.fetchone())[0]
+        if auto_vacuum != 2:
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await db.execute("VACUUM")  # Necessário para aplicar em banco já existente
+
         # Tabela de músicas
         await db.execute("""
             CREATE TABLE IF NOT EXISTS music (
@@ -259,16 +305,11 @@ async def init_db():
             )
         """)
 
-        # Tabela de logs de atividade
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS activity_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                type TEXT NOT NULL,
-                description TEXT NOT NULL,
-                details TEXT
-            )
-        """)
+        # Logs de atividade: partições mensais, contadores e rollups
+        await log_store.init_log_tables(db)
+
+        # Histórico estruturado de execuções (proof-of-play) e resumos
+        await play_history.init_play_tables(db)
 
         # Tabela de playlist gerada
         await db.execute("""
@@ -302,6 +343,67 @@ async def init_db():
             )
         """)
 
+        # Migração: origem dos metadados ('ai', 'tags', 'filename' ou 'manual')
+        try:
+            await db.execute("ALTER TABLE music_metadata ADD COLUMN source TEXT DEFAULT 'ai'")
+        except:
+            pass
+
+        # Velocidade de fala aprendida por voz/modelo (para prever a duração do TTS)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS voice_speech_rates (
+                voice_id TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                samples INTEGER NOT NULL DEFAULT 0,
+                total_chars INTEGER NOT NULL DEFAULT 0,
+                total_seconds REAL NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (voice_id, model_id)
+            )
+        """)
+
+        # Jobs de classificação com IA (persistentes, retomados no startup)
+        await init_classification_tables(db)
+
+        # Índice de busca full-text (music + music_metadata)
+        await music_search.init_search_index(db)
+
+        # Biblioteca materializada (music + music_metadata) e contagens de artistas/gêneros
+        await library_view.init_library(db)
+
+        # Revisão do catálogo: incrementada por trigger a cada mudança em music.
+        # O epoch aleatório diferencia bancos recriados (a revisão volta a zero)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_revision (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                epoch TEXT NOT NULL,
+                revision INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        await db.execute(
+            "INSERT OR IGNORE INTO catalog_revision (id, epoch, revision) VALUES (1, ?, 0)",
+            (uuid.uuid4().hex[:8],)
+        )
+        # Migração: revisão separada dos metadados (não invalida a lista dos players)
+        try:
+            await db.execute("ALTER TABLE catalog_revision ADD COLUMN metadata_revision INTEGER NOT NULL DEFAULT 0")
+        except:
+            pass
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            await db.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS music_revision_{event.lower()} AFTER {event} ON music BEGIN
+                    UPDATE catalog_revision SET revision = revision + 1 WHERE id = 1;
+                END
+            """)
+            await db.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS music_metadata_revision_{event.lower()} AFTER {event} ON music_metadata BEGIN
+                    UPDATE catalog_revision SET metadata_revision = metadata_revision + 1 WHERE id = 1;
+                END
+            """)
+
+        # Paginação por cursor de /api/music/list
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_music_created ON music (created_at DESC, id DESC)")
+
         # Configuração inicial de volume
         await db.execute("""
             INSERT OR IGNORE INTO settings (key, value) VALUES ('volume', '0.5')
@@ -313,18 +415,138 @@ async def init_db():
 @app.on_event("startup")
 async def startup():
     await init_db()
+    await log_writer.start()
+    elevenlabs_http.start()
+    openrouter_http.start()
+    if ELEVENLABS_API_KEY and not voice_catalog.is_fresh:
+        voice_catalog.refresh()  # Aquecer o catálogo de vozes em background
+    if OPENROUTER_API_KEY:
+        await classification_jobs.resume()
+    app.state.log_maintenance = asyncio.create_task(log_maintenance_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.log_maintenance.cancel()
+    for job_id in list(mix_jobs.jobs):
+        mix_jobs.cancel(job_id)
+    await classification_jobs.stop()
+    await elevenlabs_http.close()
+    await openrouter_http.close()
+    await log_writer.stop()
 
 
 # ============ ROTAS DE MÚSICA ============
 
+async def get_catalog_revision(db, include_metadata: bool = False) -> str:
+    """Revisão atual do catálogo de músicas ('<epoch>-<revisão>[-<revisão dos metadados>]')"""
+    async with db.execute(
+        "SELECT epoch, revision, metadata_revision FROM catalog_revision WHERE id = 1"
+    ) as cursor:
+        epoch, revision, metadata_revision = await cursor.fetchone()
+    if include_metadata:
+        return f"{epoch}-{revision}-{metadata_revision}"
+    return f"{epoch}-{revision}"
+
+
+# Respostas grandes já serializadas, válidas enquanto a revisão não muda
+json_snapshots = SnapshotCache()
+
+
+def catalog_etag(revision: str, *params) -> str:
+    """ETag fraco da revisão do catálogo + parâmetros da consulta"""
+    variant = hashlib.sha1(json.dumps(params).encode()).hexdigest()[:8]
+    return f'W/"{revision}-{variant}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+
+def encode_cursor(created_at, music_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, music_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, music_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return created_at, music_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
 @app.get("/api/music/list")
-async def list_music():
-    """Lista todas as músicas disponíveis"""
+async def list_music(request: Request, limit: Optional[int] = None,
+                     cursor: Optional[str] = None, fields: Optional[str] = None):
+    """
+    Lista as músicas disponíveis (mais recentes primeiro).
+    fields=id,original_name,... limita as colunas. Sem limit retorna a lista
+    completa; com limit retorna {items, next_cursor, revision} paginado.
+    Responde 304 se o If-None-Match bater com a revisão do catálogo.
+    """
     async with aiosqlite.connect(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM music ORDER BY created_at DESC") as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+
+        revision = await get_catalog_revision(db)
+        etag = catalog_etag(revision, limit, cursor, fields)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        # Projeção de colunas (validada contra o schema)
+        async with db.execute("PRAGMA table_info(music)") as cur:
+            schema = await cur.fetchall()
+        available = [row["name"] for row in schema]
+        real_columns = [row["name"] for row in schema if row["type"].upper() == "REAL"]
+        if fields:
+            columns = [f.strip() for f in fields.split(",") if f.strip()]
+            invalid = [c for c in columns if c not in available]
+            if invalid:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Campos inválidos: {', '.join(invalid)}. Disponíveis: {', '.join(available)}"
+                )
+        else:
+            columns = available
+
+        if limit is None:
+            # Lista completa: serializada pelo SQLite uma vez por revisão
+            body = await json_snapshots.get(
+                ("music_list", tuple(columns)), revision,
+                lambda: sql_json_array(
+                    db, columns, "SELECT * FROM music ORDER BY created_at DESC, id DESC",
+                    float_columns=real_columns
+                )
+            )
+            return raw_json_response(body, headers={"ETag": etag})
+
+        limit = max(1, min(limit, 1000))
+        # Colunas do cursor são sempre lidas, mesmo fora da projeção
+        select = list(dict.fromkeys(columns + ["created_at", "id"]))
+        where, params = "", []
+        if cursor:
+            created_at, music_id = decode_cursor(cursor)
+            where = "WHERE created_at < ? OR (created_at = ? AND id < ?)"
+            params = [created_at, created_at, music_id]
+
+        async with db.execute(
+            f"""SELECT {', '.join(select)} FROM music {where}
+                ORDER BY created_at DESC, id DESC LIMIT ?""",
+            params + [limit + 1]
+        ) as cur:
+            rows = [dict(row) for row in await cur.fetchall()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
+    return FastJSONResponse({
+        "items": [{c: row[c] for c in columns} for row in rows],
+        "next_cursor": next_cursor,
+        "revision": revision,
+        "limit": limit
+    }, headers={"ETag": etag})
 
 
 @app.post("/api/music/upload")
@@ -435,6 +657,9 @@ async def delete_music(music_id: str):
             await db.execute("DELETE FROM music WHERE id = ?", (music_id,))
             await db.commit()
 
+    # PCM pré-decodificado (se foi usada como fundo de vinheta)
+    bed_cache.invalidate(music_id)
+
     # Notificar clientes - incluir flag para regenerar playlist
     await manager.broadcast({
         "type": "music_deleted",
@@ -474,183 +699,172 @@ async def scan_music_durations():
     return {"success": True, "updated": updated}
 
 
-async def generate_playlist_internal(hours: int = 24, from_position: int = 0) -> List[dict]:
+# Última linha do tempo de volume compilada, indexada pelas regras que a geraram
+_volume_timeline_cache: Dict[str, list] = {}
+
+
+async def load_volume_timeline(db) -> list:
+    """Segmentos da linha do tempo de volume (recompila só quando as regras mudam)"""
+    async with db.execute("SELECT hour, volume FROM hourly_volumes") as cursor:
+        hourly_volumes = {row[0]: row[1] for row in await cursor.fetchall()}
+    async with db.execute("""
+        SELECT time_start, time_end, volume, volume_start, volume_end, is_gradient
+        FROM volume_schedules ORDER BY id
+    """) as cursor:
+        volume_schedules = [
+            dict(zip(("time_start", "time_end", "volume", "volume_start", "volume_end", "is_gradient"), row))
+            for row in await cursor.fetchall()
+        ]
+
+    key = json.dumps([sorted(hourly_volumes.items()), volume_schedules])
+    if key not in _volume_timeline_cache:
+        _volume_timeline_cache.clear()
+        _volume_timeline_cache[key] = volume_timeline.compile_timeline(hourly_volumes, volume_schedules)
+    return _volume_timeline_cache[key]
+
+
+async def generate_playlist_internal(hours: int = 24, from_position: int = 0) -> tuple[List[dict], dict]:
     """
-    Gera playlist para as próximas X horas.
-    Inclui músicas aleatórias, propagandas por tempo/músicas, e músicas agendadas.
+    Gera playlist para as próximas X horas (algoritmo em playlist_engine).
+    Retorna a playlist e o segmento (semente + agendamentos) que a reproduz.
     """
-    now = datetime.now()
-    end_time = now + timedelta(hours=hours)
-    playlist = []
-    position = from_position
-
     async with aiosqlite.connect(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
 
-        # Obter todas as músicas (não propagandas) com duração
-        async with db.execute(
-            "SELECT id, original_name, duration FROM music WHERE is_ad = 0 AND duration > 0"
-        ) as cursor:
-            music_rows = await cursor.fetchall()
-            music_list = [dict(row) for row in music_rows]
-
-        if not music_list:
-            return []
-
-        # Embaralhar músicas
-        random.shuffle(music_list)
-        music_index = 0
+        # Catálogo completo: músicas para o sorteio e nomes/durações de propagandas e agendadas
+        async with db.execute("SELECT id, original_name, duration, is_ad FROM music") as cursor:
+            catalogue = [dict(row) for row in await cursor.fetchall()]
 
-        # Obter propagandas ativas
-        async with db.execute(
-            """SELECT as_.*, m.original_name, m.duration as ad_duration
-               FROM ad_schedules as_
-               JOIN music m ON as_.music_id = m.id
-               WHERE as_.enabled = 1"""
-        ) as cursor:
+        async with db.execute("SELECT * FROM ad_schedules") as cursor:
             ad_schedules = [dict(row) for row in await cursor.fetchall()]
 
-        # Separar propagandas por tipo
-        time_based_ads = [a for a in ad_schedules if a.get('interval_type', 'minutes') == 'minutes']
-        song_based_ads = [a for a in ad_schedules if a.get('interval_type') == 'songs']
-
-        # Obter músicas agendadas
-        async with db.execute(
-            """SELECT ss.*, m.original_name, m.duration
-               FROM scheduled_songs ss
-               JOIN music m ON ss.music_id = m.id"""
-        ) as cursor:
+        async with db.execute("SELECT * FROM scheduled_songs") as cursor:
             scheduled_songs = [dict(row) for row in await cursor.fetchall()]
 
-        # Obter volumes por hora
-        async with db.execute("SELECT hour, volume FROM hourly_volumes") as cursor:
-            hourly_volumes = {row["hour"]: row["volume"] for row in await cursor.fetchall()}
+        timeline = await load_volume_timeline(db)
 
-    # Tracking de propagandas
-    last_ad_time = {ad['id']: now for ad in time_based_ads}
-    songs_since_last_ad = 0
-    ad_rotation_index = 0
+    segment = playlist_engine.build_segment(
+        playlist_engine.new_seed(), datetime.now(), hours, from_position,
+        ad_schedules, scheduled_songs, timeline
+    )
+    return playlist_engine.generate_playlist(segment, catalogue), segment
 
-    current_time = now
-    last_hour_added = -1
 
-    while current_time < end_time:
-        # Verificar mudança de volume por hora
-        current_hour = current_time.hour
-        if current_hour != last_hour_added and current_hour in hourly_volumes:
-            # Adicionar evento de volume apenas na primeira passagem de cada hora
-            if position == from_position or current_hour != now.hour:
-                playlist.append({
-                    "position": position,
-                    "music_id": None,
-                    "music_name": f"Volume ajustado para {int(hourly_volumes[current_hour] * 100)}%",
-                    "duration": 0,
-                    "scheduled_time": current_time.isoformat(),
-                    "event_type": "volume"
-                })
-                position += 1
-            last_hour_added = current_hour
-
-        # Verificar música agendada para este horário
-        current_time_str = current_time.strftime('%H:%M')
-        scheduled_now = [s for s in scheduled_songs if s['scheduled_time'] == current_time_str]
-
-        for scheduled in scheduled_now:
-            playlist.append({
-                "position": position,
-                "music_id": scheduled['music_id'],
-                "music_name": scheduled['original_name'],
-                "duration": scheduled['duration'] or 180,
-                "scheduled_time": current_time.isoformat(),
-                "event_type": "scheduled_song"
-            })
-            position += 1
-            current_time += timedelta(seconds=scheduled['duration'] or 180)
-            continue
+async def get_playlist_plan(db) -> dict:
+    """Segmentos que reproduzem a playlist gerada atual (vazio se não houver)"""
+    async with db.execute("SELECT value FROM settings WHERE key = 'playlist_plan'") as cursor:
+        row = await cursor.fetchone()
+    if not row:
+        return {"segments": [], "inserts": []}
+    try:
+        plan = json.loads(row[0])
+    except json.JSONDecodeError:
+        return {"segments": [], "inserts": []}
+    plan.setdefault("inserts", [])
+    return plan
 
-        # Verificar propaganda por tempo
-        ad_to_play = None
-        for ad in time_based_ads:
-            interval_minutes = ad.get('interval_value') or ad.get('interval_minutes', 30)
-            if (current_time - last_ad_time[ad['id']]).total_seconds() >= interval_minutes * 60:
-                ad_to_play = ad
-                last_ad_time[ad['id']] = current_time
-                break
 
-        # Verificar propaganda por número de músicas
-        if not ad_to_play and song_based_ads:
-            min_interval = min(a.get('interval_value', 5) for a in song_based_ads)
-            if songs_since_last_ad >= min_interval:
-                ad_to_play = song_based_ads[ad_rotation_index % len(song_based_ads)]
-                ad_rotation_index += 1
-                songs_since_last_ad = 0
+async def write_playlist_plan(db, plan: dict) -> dict:
+    """
+    Grava o plano descartando do início os segmentos já tocados por inteiro
+    (o plano vai em cada playlist_updated e cresceria a cada extensão).
+    """
+    async with db.execute("SELECT MIN(position) FROM generated_playlist WHERE played = 0") as cursor:
+        first_unplayed = (await cursor.fetchone())[0]
+
+    if first_unplayed is not None:
+        segments = plan["segments"]
+        while len(segments) > 1 and segments[0].get("end_position", first_unplayed) < first_unplayed:
+            segments.pop(0)
+            inserts = []
+            for insert in plan["inserts"]:
+                # Inserção que só deslocou segmentos descartados e já tocou: não afeta mais nada
+                if insert["segments"] <= 1 and insert["item"]["position"] < first_unplayed:
+                    continue
+                insert["segments"] = max(0, insert["segments"] - 1)
+                inserts.append(insert)
+            plan["inserts"] = inserts
+
+    await db.execute(
+        "INSERT OR REPLACE INTO settings (key, value) VALUES ('playlist_plan', ?)",
+        (json.dumps(plan),)
+    )
+    return plan
+
+
+async def save_playlist_plan(db, segment: dict, playlist: List[dict], append: bool = False) -> dict:
+    """Grava o segmento gerado (append=True quando a playlist foi estendida)"""
+    plan = await get_playlist_plan(db) if append else {"segments": [], "inserts": []}
+    end_position = playlist[-1]["position"] if playlist else segment["from_position"] - 1
+    plan["segments"].append({**segment, "end_position": end_position})
+    return await write_playlist_plan(db, plan)
+
+
+async def record_playlist_insert(db, item: dict) -> dict:
+    """Registra no plano a música inserida como próxima (posições seguintes deslocadas em +1)"""
+    plan = await get_playlist_plan(db)
+    for segment in plan["segments"]:
+        if segment.get("end_position", -1) >= item["position"]:
+            segment["end_position"] += 1
+    plan["inserts"].append({"segments": len(plan["segments"]), "item": item})
+    return await write_playlist_plan(db, plan)
 
-        if ad_to_play:
-            ad_duration = ad_to_play.get('ad_duration') or 30
-            playlist.append({
-                "position": position,
-                "music_id": ad_to_play['music_id'],
-                "music_name": ad_to_play['original_name'],
-                "duration": ad_duration,
-                "scheduled_time": current_time.isoformat(),
-                "event_type": "ad"
-            })
-            position += 1
-            current_time += timedelta(seconds=ad_duration)
-            continue
 
-        # Adicionar música aleatória
-        if music_list:
-            music = music_list[music_index % len(music_list)]
-            music_index += 1
+@app.post("/api/playlist/generate")
+async def generate_playlist(hours: int = 24):
+    """Gera uma nova playlist para as próximas X horas"""
+    async with playlist_feed.lock:
+        playlist, segment, plan = await store_generated_playlist(hours)
+        await publish_playlist_delta([reset_op(playlist)])
 
-            playlist.append({
-                "position": position,
-                "music_id": music['id'],
-                "music_name": music['original_name'],
-                "duration": music['duration'],
-                "scheduled_time": current_time.isoformat(),
-                "event_type": "music"
-            })
-            position += 1
-            current_time += timedelta(seconds=music['duration'])
-            songs_since_last_ad += 1
-        else:
-            # Sem músicas, avançar 1 minuto
-            current_time += timedelta(minutes=1)
+    # Notificar clientes (o plano permite aos players gerar a mesma playlist offline)
+    await manager.broadcast({
+        "type": "playlist_generated",
+        "count": len(playlist),
+        "seed": segment["seed"],
+        "plan": plan
+    })
 
-    return playlist
+    return {"success": True, "count": len(playlist), "playlist": playlist[:50]}
 
 
-@app.post("/api/playlist/generate")
-async def generate_playlist(hours: int = 24):
-    """Gera uma nova playlist para as próximas X horas"""
-    playlist = await generate_playlist_internal(hours)
+async def store_generated_playlist(hours: int) -> tuple[List[dict], dict, dict]:
+    """Gera e grava uma playlist nova no lugar da atual (chamar com playlist_feed.lock)"""
+    playlist, segment = await generate_playlist_internal(hours)
 
-    # Salvar no banco
     async with aiosqlite.connect(DB_PATH) as db:
         # Limpar playlist anterior
         await db.execute("DELETE FROM generated_playlist")
 
         # Inserir nova playlist
-        for item in playlist:
-            await db.execute(
-                """INSERT INTO generated_playlist
-                   (position, music_id, music_name, duration, scheduled_time, event_type, played)
-                   VALUES (?, ?, ?, ?, ?, ?, 0)""",
-                (item['position'], item['music_id'] or '', item['music_name'],
-                 item['duration'], item['scheduled_time'], item['event_type'])
-            )
+        await insert_playlist_items(db, playlist)
 
+        plan = await save_playlist_plan(db, segment, playlist)
         await db.commit()
 
-    # Notificar clientes
-    await manager.broadcast({
-        "type": "playlist_generated",
-        "count": len(playlist)
-    })
+    return playlist, segment, plan
 
-    return {"success": True, "count": len(playlist), "playlist": playlist[:50]}
+
+async def insert_playlist_items(db, items: List[dict]):
+    await db.executemany(
+        """INSERT INTO generated_playlist
+           (position, music_id, music_name, duration, scheduled_time, event_type, played)
+           VALUES (?, ?, ?, ?, ?, ?, 0)""",
+        [(item['position'], item['music_id'] or '', item['music_name'],
+          item['duration'], item['scheduled_time'], item['event_type']) for item in items]
+    )
+
+
+async def count_pending_playlist(db) -> int:
+    async with db.execute("SELECT COUNT(*) FROM generated_playlist WHERE played = 0") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def publish_playlist_delta(ops: list):
+    """Envia a mudança na playlist como delta versionado (chamar com playlist_feed.lock)"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        pending = await count_pending_playlist(db)
+    await manager.broadcast(playlist_feed.next_delta(ops, pending))
 
 
 @app.get("/api/playlist")
@@ -666,20 +880,47 @@ async def get_playlist(limit: int = 100, include_played: bool = False):
             query = "SELECT * FROM generated_playlist WHERE played = 0 ORDER BY position LIMIT ?"
             params = (limit,)
 
-        async with db.execute(query, params) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        async with db.execute("PRAGMA table_info(generated_playlist)") as cursor:
+            schema = await cursor.fetchall()
+        columns = [row["name"] for row in schema]
+        real_columns = [row["name"] for row in schema if row["type"].upper() == "REAL"]
+        return raw_json_response(await sql_json_array(db, columns, query, params, float_columns=real_columns))
+
+
+@app.get("/api/playlist/window")
+async def get_playlist_window(limit: int = DELTA_WINDOW):
+    """Próximas entradas com a versão atual, para (re)sincronizar quem segue os playlist_delta"""
+    limit = max(1, min(limit, 1000))
+    async with playlist_feed.lock:
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT * FROM generated_playlist WHERE played = 0 ORDER BY position LIMIT ?",
+                (limit,)
+            ) as cursor:
+                items = [dict(row) for row in await cursor.fetchall()]
+            pending = await count_pending_playlist(db)
+        return playlist_feed.state(items, pending)
+
+
+@app.get("/api/playlist/plan")
+async def get_playlist_plan_endpoint():
+    """Segmentos (semente + agendamentos) da playlist gerada, para geração offline nos players"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        return await get_playlist_plan(db)
 
 
 @app.post("/api/playlist/mark-played/{position}")
 async def mark_song_played(position: int):
     """Marca uma música como tocada"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE generated_playlist SET played = 1 WHERE position <= ?",
-            (position,)
-        )
-        await db.commit()
+    async with playlist_feed.lock:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                "UPDATE generated_playlist SET played = 1 WHERE position <= ?",
+                (position,)
+            )
+            await db.commit()
+        await publish_playlist_delta([played_op(position)])
 
     return {"success": True}
 
@@ -687,9 +928,15 @@ async def mark_song_played(position: int):
 @app.post("/api/playlist/skip")
 async def skip_and_regenerate():
     """Pula a música atual e toca a próxima (sem regenerar imediatamente)"""
+    async with playlist_feed.lock:
+        return await _skip_and_regenerate()
+
+
+async def _skip_and_regenerate():
     skipped_song = None
     next_song = None
     next_position = 1
+    ops = []
 
     async with aiosqlite.connect(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
@@ -710,6 +957,8 @@ async def skip_and_regenerate():
                     (current_pos,)
                 )
                 await db.commit()
+                # É a primeira não tocada: equivale a marcar tudo até ela
+                ops.append(played_op(current_pos))
 
         # Verificar qual é a próxima música (pode ser a inserida manualmente)
         async with db.execute(
@@ -720,13 +969,10 @@ async def skip_and_regenerate():
                 next_song = next_row['music_name']
 
         # Contar quantas músicas restam na playlist
-        async with db.execute(
-            "SELECT COUNT(*) as remaining FROM generated_playlist WHERE played = 0"
-        ) as cursor:
-            count_row = await cursor.fetchone()
-            remaining = count_row['remaining'] if count_row else 0
+        remaining = await count_pending_playlist(db)
 
     # Só regenerar se restam poucas músicas (menos de 10)
+    plan = None
     if remaining < 10:
         # Encontrar a última posição da playlist
         async with aiosqlite.connect(DB_PATH) as db:
@@ -738,28 +984,29 @@ async def skip_and_regenerate():
                 last_position = max_row['max_pos'] if max_row and max_row['max_pos'] else 0
 
         # Gerar mais músicas a partir da última posição
-        new_playlist = await generate_playlist_internal(hours=24, from_position=last_position + 1)
+        new_playlist, segment = await generate_playlist_internal(hours=24, from_position=last_position + 1)
 
         # Inserir nova playlist no banco
         async with aiosqlite.connect(DB_PATH) as db:
-            for item in new_playlist:
-                await db.execute(
-                    """INSERT INTO generated_playlist
-                       (position, music_id, music_name, duration, scheduled_time, event_type, played)
-                       VALUES (?, ?, ?, ?, ?, ?, 0)""",
-                    (item['position'], item['music_id'] or '', item['music_name'],
-                     item['duration'], item['scheduled_time'], item['event_type'])
-                )
+            await insert_playlist_items(db, new_playlist)
+            plan = await save_playlist_plan(db, segment, new_playlist, append=True)
             await db.commit()
+        ops.append(append_op(new_playlist))
+
+    if ops:
+        await publish_playlist_delta(ops)
 
     # Notificar clientes
-    await manager.broadcast({
+    message = {
         "type": "playlist_updated",
         "action": "skip",
         "skipped_song": skipped_song,
         "next_song": next_song,
         "message": f"Música pulada: {skipped_song}"
-    })
+    }
+    if plan:
+        message["plan"] = plan
+    await manager.broadcast(message)
 
     return {
         "success": True,
@@ -796,70 +1043,89 @@ async def insert_song_next(data: InsertSongRequest):
     Preserva a playlist existente, apenas insere no meio.
     """
     music_id = data.music_id
+    generated = None
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-
-        # Verificar se a música existe
-        async with db.execute(
-            "SELECT id, original_name, duration FROM music WHERE id = ?", (music_id,)
-        ) as cursor:
-            music = await cursor.fetchone()
-            if not music:
-                raise HTTPException(status_code=404, detail="Música não encontrada")
+    async with playlist_feed.lock:
+        ops = []
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
 
-        # Encontrar a posição atual (primeira não tocada)
-        async with db.execute(
-            "SELECT position, scheduled_time, duration FROM generated_playlist WHERE played = 0 ORDER BY position LIMIT 1"
-        ) as cursor:
-            current = await cursor.fetchone()
+            # Verificar se a música existe
+            async with db.execute(
+                "SELECT id, original_name, duration FROM music WHERE id = ?", (music_id,)
+            ) as cursor:
+                music = await cursor.fetchone()
+                if not music:
+                    raise HTTPException(status_code=404, detail="Música não encontrada")
 
-        if not current:
-            # Se não há playlist, gerar uma nova com a música no início
-            await generate_playlist(hours=24)
-            # Buscar a nova posição
+            # Encontrar a posição atual (primeira não tocada)
             async with db.execute(
-                "SELECT MAX(position) as max_pos FROM generated_playlist"
+                "SELECT position, scheduled_time, duration FROM generated_playlist WHERE played = 0 ORDER BY position LIMIT 1"
             ) as cursor:
-                max_row = await cursor.fetchone()
-                insert_position = (max_row['max_pos'] or 0) + 1
+                current = await cursor.fetchone()
+
+            if not current:
+                # Se não há playlist, gerar uma nova com a música no início
+                generated = await store_generated_playlist(24)
+                ops.append(reset_op(generated[0]))
+                # Buscar a nova posição
+                async with db.execute(
+                    "SELECT MAX(position) as max_pos FROM generated_playlist"
+                ) as cursor:
+                    max_row = await cursor.fetchone()
+                    insert_position = (max_row['max_pos'] or 0) + 1
+
+                insert_time = datetime.now()
+            else:
+                current_position = current['position']
+                current_duration = current['duration'] or 180
 
-            insert_time = datetime.now()
-        else:
-            current_position = current['position']
-            current_duration = current['duration'] or 180
+                # Calcular o horário para a música inserida
+                try:
+                    current_time = datetime.fromisoformat(current['scheduled_time'])
+                except:
+                    current_time = datetime.now()
 
-            # Calcular o horário para a música inserida
-            try:
-                current_time = datetime.fromisoformat(current['scheduled_time'])
-            except:
-                current_time = datetime.now()
+                insert_time = current_time + timedelta(seconds=current_duration)
+                insert_position = current_position + 1
 
-            insert_time = current_time + timedelta(seconds=current_duration)
-            insert_position = current_position + 1
+                # Deslocar todas as posições futuras para abrir espaço
+                await db.execute(
+                    "UPDATE generated_playlist SET position = position + 1 WHERE position >= ? AND played = 0",
+                    (insert_position,)
+                )
 
-            # Deslocar todas as posições futuras para abrir espaço
-            await db.execute(
-                "UPDATE generated_playlist SET position = position + 1 WHERE position >= ? AND played = 0",
-                (insert_position,)
-            )
+            # Inserir a música solicitada na posição
+            inserted = {
+                "position": insert_position,
+                "music_id": music_id,
+                "music_name": music['original_name'],
+                "duration": music['duration'] or 180,
+                "scheduled_time": insert_time.isoformat(),
+                "event_type": "music"
+            }
+            await insert_playlist_items(db, [inserted])
+            plan = await record_playlist_insert(db, inserted)
 
-        # Inserir a música solicitada na posição
-        await db.execute(
-            """INSERT INTO generated_playlist
-               (position, music_id, music_name, duration, scheduled_time, event_type, played)
-               VALUES (?, ?, ?, ?, ?, 'music', 0)""",
-            (insert_position, music_id, music['original_name'],
-             music['duration'] or 180, insert_time.isoformat())
-        )
+            await db.commit()
 
-        await db.commit()
+        ops.append(insert_op(inserted))
+        await publish_playlist_delta(ops)
 
     # Notificar clientes
+    if generated:
+        playlist, segment, plan = generated
+        await manager.broadcast({
+            "type": "playlist_generated",
+            "count": len(playlist),
+            "seed": segment["seed"],
+            "plan": plan
+        })
     await manager.broadcast({
         "type": "playlist_updated",
         "inserted_song": music['original_name'],
-        "message": f"Música '{music['original_name']}' inserida como próxima"
+        "message": f"Música '{music['original_name']}' inserida como próxima",
+        "plan": plan
     })
 
     return {
@@ -916,12 +1182,16 @@ async def get_settings():
             if str(h) not in hourly_volumes:
                 hourly_volumes[str(h)] = 0.5
 
+        # Volumes por hora + faixas compilados (o player consulta por minuto)
+        timeline = await load_volume_timeline(db)
+
         return {
             "volume": volume,
             "volume_schedules": volume_schedules,
             "ad_schedules": ad_schedules,
             "scheduled_songs": scheduled_songs,
             "hourly_volumes": hourly_volumes,
+            "volume_timeline": timeline,
             "player_status": manager.player_status
         }
 
@@ -1176,20 +1446,19 @@ async def get_schedule_preview(hours: int = 6, avg_song_duration: int = 4, use_g
                     "source": "generated_playlist"
                 }
 
-                return {
+                return FastJSONResponse({
                     "start": now.isoformat(),
                     "end": (now + timedelta(hours=hours)).isoformat(),
                     "hours": hours,
                     "events": events,
                     "stats": stats,
                     "generated": True
-                }
+                })
     async with aiosqlite.connect(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
 
-        # Volumes por hora
-        async with db.execute("SELECT hour, volume FROM hourly_volumes") as cursor:
-            hourly_volumes = {row['hour']: row['volume'] for row in await cursor.fetchall()}
+        # Volumes por hora e faixas de volume, compilados
+        timeline = volume_timeline.VolumeTimeline(await load_volume_timeline(db))
 
         # Propagandas por tempo (minutos)
         async with db.execute("""
@@ -1261,26 +1530,17 @@ async def get_schedule_preview(hours: int = 6, avg_song_duration: int = 4, use_g
         interval = ad.get('interval_value') or ad.get('interval_minutes', 30)
         next_time_ad[ad['id']] = now + timedelta(minutes=interval)
 
-    # Eventos de mudança de volume por hora
-    volume_events = []
-    current_volume = hourly_volumes.get(now.hour, 0.5)
-    for h in range(hours + 1):
-        event_time = now + timedelta(hours=h)
-        hour = event_time.hour
-        volume = hourly_volumes.get(hour, 0.5)
-
-        if h == 0 or volume != current_volume:
-            volume_events.append({
-                "time": event_time.replace(minute=0, second=0, microsecond=0).isoformat(),
-                "hour": hour,
-                "type": "volume",
-                "subtype": "hourly",
-                "description": f"Volume ajustado para {int(volume * 100)}%",
-                "volume": volume
-            })
-            current_volume = volume
-
-    events.extend(volume_events)
+    # Eventos de mudança de volume (por hora e faixas, da linha do tempo compilada)
+    for event_time, volume, volume_end in timeline.changes(now, end_time):
+        events.append({
+            "time": event_time.isoformat(),
+            "hour": event_time.hour,
+            "type": "volume",
+            "subtype": "gradient" if volume_end != volume else "fixed",
+            "description": volume_timeline.describe(volume, volume_end),
+            "volume": round(volume, 3),
+            "volume_end": volume_end
+        })
 
     # Simular reprodução
     while current_time < end_time:
@@ -1397,7 +1657,7 @@ async def get_schedule_preview(hours: int = 6, avg_song_duration: int = 4, use_g
         ]
     }
 
-    return {
+    return FastJSONResponse({
         "start": now.isoformat(),
         "end": end_time.isoformat(),
         "hours": hours,
@@ -1405,105 +1665,326 @@ async def get_schedule_preview(hours: int = 6, avg_song_duration: int = 4, use_g
         "events": events,
         "stats": stats,
         "debug": debug
-    }
+    })
 
 
 # ============ LOGS DE ATIVIDADE ============
 
+# Logs são gravados em lote pelo writer (uma transação por intervalo)
+log_writer = LogWriter(DB_PATH, flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", "1.0")))
+
+# Retenção automática dos logs brutos em dias (padrão 0 = desativada, manter tudo).
+# Rollups não expiram.
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "0"))
+LOG_MAINTENANCE_INTERVAL = 3600  # segundos
+LOG_VACUUM_PAGES = 2000  # Páginas devolvidas por ciclo de vacuum incremental
+
+
 class LogEntry(BaseModel):
     type: str  # "music", "ad", "volume_manual", "volume_scheduled"
     description: str
     details: Optional[str] = None
+    timestamp: Optional[str] = None  # Horário real do evento (ISO) - logs enviados depois de offline
+
+
+class LogBatch(BaseModel):
+    logs: List[LogEntry]
+
+
+def parse_log_time(value: Optional[str], param: str) -> Optional[str]:
+    """Valida filtro de horário (ISO) e converte para o formato armazenado (UTC)"""
+    if not value:
+        return None
+    try:
+        datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Parâmetro '{param}' inválido (use ISO 8601)")
+    return normalize_timestamp(value)
+
+
+def encode_log_cursor(timestamp: str, log_id: int) -> str:
+    return f"{timestamp}|{log_id}"
+
+
+def decode_log_cursor(cursor: str) -> tuple:
+    try:
+        timestamp, log_id = cursor.rsplit("|", 1)
+        return timestamp, int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
 
 
 @app.get("/api/logs")
 async def get_logs(
     type: Optional[str] = None,
     limit: int = 100,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None
 ):
-    """Lista logs de atividade com filtros opcionais"""
+    """
+    Lista logs de atividade com filtros opcionais.
+    - cursor: paginação por (timestamp, id) - use o next_cursor da página anterior
+    - offset: paginação antiga (mantida por compatibilidade)
+    - start/end: intervalo de horário (ISO 8601)
+    """
+    # Garantir que logs ainda na fila apareçam na consulta
+    await log_writer.flush()
+
+    limit = max(1, min(limit, 1000))
+    start_ts = parse_log_time(start, "start")
+    end_ts = parse_log_time(end, "end")
+    cursor_key = decode_log_cursor(cursor) if cursor else None
+
     async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+        logs, has_more = await log_store.query_logs(
+            db, type, start_ts, end_ts, cursor_key, limit, offset
+        )
+        total = await log_store.count_logs(db, type, start_ts, end_ts)
 
-        if type:
-            query = """
-                SELECT * FROM activity_logs
-                WHERE type = ?
-                ORDER BY timestamp DESC
-                LIMIT ? OFFSET ?
-            """
-            params = (type, limit, offset)
-        else:
-            query = """
-                SELECT * FROM activity_logs
-                ORDER BY timestamp DESC
-                LIMIT ? OFFSET ?
-            """
-            params = (limit, offset)
-
-        async with db.execute(query, params) as cursor:
-            logs = [dict(row) for row in await cursor.fetchall()]
-
-        # Contar total
-        if type:
-            count_query = "SELECT COUNT(*) FROM activity_logs WHERE type = ?"
-            count_params = (type,)
-        else:
-            count_query = "SELECT COUNT(*) FROM activity_logs"
-            count_params = ()
+    next_cursor = encode_log_cursor(logs[-1]["timestamp"], logs[-1]["id"]) if has_more else None
 
-        async with db.execute(count_query, count_params) as cursor:
-            row = await cursor.fetchone()
-            total = row[0] if row else 0
+    return {
+        "logs": logs,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }
 
-        return {
-            "logs": logs,
-            "total": total,
-            "limit": limit,
-            "offset": offset
-        }
 
+@app.get("/api/logs/counts")
+async def get_log_counts():
+    """Totais de logs por tipo (mantidos incrementalmente)"""
+    await log_writer.flush()
 
-@app.post("/api/logs")
-async def create_log(data: LogEntry):
-    """Cria um novo registro de log"""
     async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            """INSERT INTO activity_logs (type, description, details)
-               VALUES (?, ?, ?)""",
-            (data.type, data.description, data.details)
-        )
-        await db.commit()
-        log_id = cursor.lastrowid
+        async with db.execute(
+            """SELECT type, SUM(count) FROM activity_log_counts
+               GROUP BY type HAVING SUM(count) > 0 ORDER BY type"""
+        ) as cursor:
+            counts = {row[0]: row[1] for row in await cursor.fetchall()}
 
-    return {"success": True, "id": log_id}
+    return {
+        "counts": counts,
+        "total": sum(counts.values()),
+        "writer": {"pending": log_writer.pending_count, "dropped": log_writer.dropped}
+    }
 
 
-@app.delete("/api/logs")
-async def clear_logs(before_days: int = 30):
-    """Limpa logs mais antigos que X dias"""
+@app.get("/api/logs/rollups")
+async def get_log_rollups(
+    granularity: str = "day",
+    type: Optional[str] = None,
+    subject: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None
+):
+    """
+    Contagens pré-agregadas por hora ou dia (ex.: execuções por música/propaganda).
+    Não varre os logs brutos e continua disponível após a retenção apagar as partições.
+    """
+    if granularity not in ("hour", "day"):
+        raise HTTPException(status_code=400, detail="granularity deve ser 'hour' ou 'day'")
+
+    await log_writer.flush()
+    start_ts = parse_log_time(start, "start")
+    end_ts = parse_log_time(end, "end")
+
     async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """DELETE FROM activity_logs
-               WHERE timestamp < datetime('now', ?)""",
-            (f'-{before_days} days',)
-        )
-        await db.commit()
+        rollups = await log_store.get_rollups(db, granularity, type, subject, start_ts, end_ts)
 
-    return {"success": True}
+    return {"granularity": granularity, "rollups": rollups}
 
 
-async def log_activity(log_type: str, description: str, details: str = None):
-    """Helper para criar logs internamente"""
+@app.post("/api/logs")
+async def create_log(data: LogEntry):
+    """Cria um novo registro de log"""
+    try:
+        log_id = log_writer.enqueue(data.type, data.description, data.details, data.timestamp)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Campo 'timestamp' inválido (use ISO 8601)")
+    return {"success": True, "id": log_id}
+
+
+@app.post("/api/logs/batch")
+async def create_logs_batch(data: LogBatch):
+    """
+    Recebe vários logs de uma vez (buffer do cliente). Registros com timestamp
+    inválido são recusados e contados em rejected; os demais são gravados.
+    """
+    rejected = 0
+    for entry in data.logs:
+        try:
+            log_writer.enqueue(entry.type, entry.description, entry.details, entry.timestamp)
+        except ValueError:
+            rejected += 1
+    if rejected:
+        print(f"[LOGS] {rejected} logs recusados por timestamp inválido")
+    return {"success": True, "received": len(data.logs) - rejected, "rejected": rejected}
+
+
+async def incremental_vacuum(db):
+    """Devolve ao disco até LOG_VACUUM_PAGES páginas livres"""
+    # Via execute o sqlite3 só dá um passo no pragma (uma página); o script roda até o fim
+    await db.executescript(f"PRAGMA incremental_vacuum({LOG_VACUUM_PAGES});")
+
+
+async def purge_logs(before_days: int) -> dict:
+    """Aplica retenção (descarta partições antigas) e devolve espaço ao disco"""
+    await log_writer.flush()
+    cutoff = (datetime.utcnow() - timedelta(days=before_days)).strftime("%Y-%m-%d %H:%M:%S")
+
     async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """INSERT INTO activity_logs (type, description, details)
-               VALUES (?, ?, ?)""",
-            (log_type, description, details)
-        )
+        result = await log_store.apply_retention(db, cutoff)
+        await db.commit()
+        await incremental_vacuum(db)
+
+    if result["dropped_partitions"] or result["deleted_rows"]:
+        print(f"[LOGS] Retenção ({before_days} dias): {len(result['dropped_partitions'])} partições removidas, "
+              f"{result['deleted_rows']} linhas apagadas")
+    return result
+
+
+async def log_maintenance_loop():
+    """Retenção automática e vacuum incremental periódicos"""
+    while True:
+        try:
+            if LOG_RETENTION_DAYS > 0:
+                await purge_logs(LOG_RETENTION_DAYS)
+            else:
+                async with aiosqlite.connect(DB_PATH) as db:
+                    await incremental_vacuum(db)
+        except Exception as e:
+            print(f"[LOGS] Erro na manutenção dos logs: {e}")
+        await asyncio.sleep(LOG_MAINTENANCE_INTERVAL)
+
+
+@app.delete("/api/logs")
+async def clear_logs(before_days: int = 30):
+    """Limpa logs mais antigos que X dias"""
+    result = await purge_logs(before_days)
+    return {"success": True, **result}
+
+
+async def log_activity(log_type: str, description: str, details: str = None):
+    """Helper para criar logs internamente"""
+    log_writer.enqueue(log_type, description, details)
+
+
+# ============ HISTÓRICO DE EXECUÇÕES (PROOF-OF-PLAY) ============
+
+class PlayRecord(BaseModel):
+    music_id: Optional[str] = None
+    music_name: Optional[str] = None
+    event_type: str = "music"  # "music", "ad", "scheduled_song"
+    playlist_position: Optional[int] = None
+    started_at: str  # ISO 8601
+    ended_at: Optional[str] = None
+    duration_played: Optional[float] = None  # segundos
+    completed: bool = False  # Tocou até o fim
+    skipped: bool = False  # Interrompida por skip
+
+
+class PlayBatch(BaseModel):
+    plays: List[PlayRecord]
+
+
+@app.post("/api/plays/batch")
+async def create_plays_batch(data: PlayBatch):
+    """
+    Recebe execuções registradas pelo player (enviadas em lote). Execuções com
+    started_at/ended_at inválido são recusadas (rejected), sem trocar pelo
+    horário atual, que as colocaria no bucket errado dos relatórios.
+    """
+    plays = []
+    rejected = 0
+    for record in data.plays:
+        try:
+            if not record.started_at:
+                raise ValueError("started_at vazio")
+            started_at = normalize_timestamp(record.started_at)
+            ended_at = normalize_timestamp(record.ended_at) if record.ended_at else None
+        except ValueError:
+            rejected += 1
+            continue
+
+        duration_played = record.duration_played
+        if duration_played is None and ended_at:
+            duration_played = (
+                datetime.fromisoformat(ended_at) - datetime.fromisoformat(started_at)
+            ).total_seconds()
+
+        plays.append({
+            "music_id": record.music_id,
+            "music_name": record.music_name,
+            "event_type": record.event_type,
+            "playlist_position": record.playlist_position,
+            "started_at": started_at,
+            "ended_at": ended_at,
+            "duration_played": max(0.0, duration_played or 0.0),
+            "completed": 1 if record.completed else 0,
+            "skipped": 1 if record.skipped else 0
+        })
+
+    async with aiosqlite.connect(DB_PATH) as db:
+        await play_history.record_plays(db, plays)
         await db.commit()
 
+    if rejected:
+        print(f"[PLAYS] {rejected} execuções recusadas por horário inválido")
+    return {"success": True, "received": len(plays), "rejected": rejected}
+
+
+@app.get("/api/reports/plays")
+async def get_play_report(
+    granularity: str = "day",
+    music_id: Optional[str] = None,
+    event_type: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    utc_offset: int = 0
+):
+    """
+    Relatório de execuções por hora ou dia (ex.: propaganda X no último mês).
+    utc_offset: fuso local em horas (ex.: -3) para agrupar por hora/dia locais.
+    """
+    if granularity not in ("hour", "day"):
+        raise HTTPException(status_code=400, detail="granularity deve ser 'hour' ou 'day'")
+
+    start_ts = parse_log_time(start, "start")
+    end_ts = parse_log_time(end, "end")
+
+    async with aiosqlite.connect(DB_PATH) as db:
+        buckets = await play_history.query_play_report(
+            db, granularity, music_id, event_type, start_ts, end_ts, utc_offset
+        )
+
+    return {
+        "granularity": granularity,
+        "utc_offset": utc_offset,
+        "buckets": buckets,
+        "total_plays": sum(b["plays"] for b in buckets)
+    }
+
+
+@app.get("/api/reports/plays/totals")
+async def get_play_totals(
+    event_type: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None
+):
+    """Total de execuções por música/propaganda no período"""
+    start_ts = parse_log_time(start, "start")
+    end_ts = parse_log_time(end, "end")
+
+    async with aiosqlite.connect(DB_PATH) as db:
+        totals = await play_history.query_play_totals(db, event_type, start_ts, end_ts)
+
+    return {"totals": totals}
+
 
 # ============ BROADCAST DE SCHEDULES ============
 
@@ -1515,7 +1996,8 @@ async def broadcast_schedules():
         "volume_schedules": settings.get('volume_schedules', []),
         "ad_schedules": settings.get('ad_schedules', []),
         "scheduled_songs": settings.get('scheduled_songs', []),
-        "hourly_volumes": settings.get('hourly_volumes', {})
+        "hourly_volumes": settings.get('hourly_volumes', {}),
+        "volume_timeline": settings.get('volume_timeline', [])
     })
 
 
@@ -1567,10 +2049,29 @@ async def player_skip():
 
 # Configuração ElevenLabs (API Key deve ser definida como variável de ambiente)
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY", "")
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io").rstrip("/")
+
+# Cache de síntese (áudios idênticos não são gerados de novo)
+tts_cache = TTSCache(
+    Path(os.getenv("TTS_CACHE_DIR", str(DATA_DIR / "tts_cache"))),
+    max_bytes=int(os.getenv("TTS_CACHE_MAX_MB", "500")) * 1024 * 1024
+)
+_tts_inflight: Dict[str, asyncio.Task] = {}
 
 # Configuração OpenRouter (para classificação de músicas com IA)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "google/gemini-2.0-flash-001")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api").rstrip("/")
+
+# Clientes HTTP compartilhados (pool de conexões, retry com jitter e métricas)
+elevenlabs_http = UpstreamClient(
+    "elevenlabs", ELEVENLABS_BASE_URL,
+    max_connections=int(os.getenv("ELEVENLABS_MAX_CONNECTIONS", "10"))
+)
+openrouter_http = UpstreamClient(
+    "openrouter", OPENROUTER_BASE_URL,
+    max_connections=int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "20"))
+)
 
 class TTSRequest(BaseModel):
     text: str
@@ -1582,35 +2083,182 @@ class TTSRequest(BaseModel):
     is_ad: bool = False  # Se é propaganda ou música
 
 
+# Velocidade padrão quando ainda não há medições: ~150 palavras/min, ~5 caracteres/palavra
+DEFAULT_CHARS_PER_SECOND = 12.5
+
+
+async def record_speech_rate(voice_id: str, model_id: str, text: str, audio_content: bytes):
+    """Acumula caracteres/segundos do áudio gerado para a voz e modelo"""
+    duration = get_audio_duration(audio_content, ".mp3")
+    chars = len(normalize_text(text))
+    if duration <= 0 or not chars:
+        return
+
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                """INSERT INTO voice_speech_rates (voice_id, model_id, samples, total_chars, total_seconds, updated_at)
+                   VALUES (?, ?, 1, ?, ?, ?)
+                   ON CONFLICT(voice_id, model_id) DO UPDATE SET
+                       samples = samples + 1,
+                       total_chars = total_chars + excluded.total_chars,
+                       total_seconds = total_seconds + excluded.total_seconds,
+                       updated_at = excluded.updated_at""",
+                (voice_id, model_id, chars, duration, datetime.now().isoformat())
+            )
+            await db.commit()
+    except Exception as e:
+        print(f"[TTS] Erro ao registrar velocidade de fala: {e}")
+
+
+async def get_speech_rate(voice_id: Optional[str], model_id: Optional[str]) -> tuple[float, str]:
+    """
+    Caracteres por segundo aprendidos: voz+modelo, depois a voz em qualquer
+    modelo, depois a média geral. Retorna (taxa, origem).
+    """
+    queries = []
+    if voice_id:
+        if model_id:
+            queries.append(("voice_model", "WHERE voice_id = ? AND model_id = ?", (voice_id, model_id)))
+        queries.append(("voice", "WHERE voice_id = ?", (voice_id,)))
+    queries.append(("global", "", ()))
+
+    async with aiosqlite.connect(DB_PATH) as db:
+        for source, where, params in queries:
+            async with db.execute(
+                f"SELECT SUM(total_chars), SUM(total_seconds) FROM voice_speech_rates {where}", params
+            ) as cursor:
+                chars, seconds = await cursor.fetchone()
+            if chars and seconds:
+                return chars / seconds, source
+
+    return DEFAULT_CHARS_PER_SECOND, "default"
+
+
+async def synthesize_speech(text: str, voice_id: str, model_id: str,
+                            stability: float, similarity_boost: float) -> bytes:
+    """
+    Retorna o áudio TTS (MP3), do cache quando os mesmos parâmetros já foram
+    gerados. Pedidos iguais simultâneos compartilham uma única chamada à API.
+    Erros HTTP do ElevenLabs são propagados (httpx.HTTPError).
+    """
+    voice_settings = {"stability": stability, "similarity_boost": similarity_boost}
+    key = cache_key(text, voice_id, model_id, voice_settings)
+
+    cached = await asyncio.to_thread(tts_cache.get, key)
+    if cached is not None:
+        print(f"[TTS] Cache hit {key[:12]} ({len(cached)} bytes)")
+        return cached
+
+    task = _tts_inflight.get(key)
+    if task is None:
+        # A síntese roda numa task própria: cancelar quem pediu primeiro
+        # (ex.: job de mix cancelado) não derruba os outros que aguardam o mesmo áudio
+        task = asyncio.create_task(_synthesize_uncached(key, text, voice_id, model_id, voice_settings))
+        _tts_inflight[key] = task
+        task.add_done_callback(lambda done: _tts_inflight.pop(key, None))
+        # Evita aviso de exceção não consumida quando todos que aguardavam foram cancelados
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return await asyncio.shield(task)
+
+
+async def _synthesize_uncached(key: str, text: str, voice_id: str, model_id: str,
+                               voice_settings: dict) -> bytes:
+    """Chama o ElevenLabs e salva o resultado no cache"""
+    response = await elevenlabs_http.post(
+        f"/v1/text-to-speech/{voice_id}",
+        headers={
+            "xi-api-key": ELEVENLABS_API_KEY,
+            "Content-Type": "application/json"
+        },
+        json={
+            "text": text,
+            "model_id": model_id,
+            "voice_settings": voice_settings
+        }
+    )
+    response.raise_for_status()
+    audio_content = response.content
+
+    await asyncio.to_thread(tts_cache.put, key, audio_content)
+    await record_speech_rate(voice_id, model_id, text, audio_content)
+    return audio_content
+
+
+async def fetch_elevenlabs_voices() -> list:
+    """Busca a lista de vozes no ElevenLabs (formato simplificado)"""
+    response = await elevenlabs_http.get(
+        "/v1/voices",
+        headers={"xi-api-key": ELEVENLABS_API_KEY}
+    )
+    response.raise_for_status()
+    data = response.json()
+
+    voices = []
+    for voice in data.get("voices", []):
+        voices.append({
+            "voice_id": voice.get("voice_id"),
+            "name": voice.get("name"),
+            "category": voice.get("category", "custom"),
+            "preview_url": voice.get("preview_url"),
+            "labels": voice.get("labels", {})
+        })
+    return voices
+
+
+# Catálogo de vozes em cache (TTL com stale-while-revalidate)
+voice_catalog = VoiceCatalog(
+    fetch_elevenlabs_voices,
+    cache_path=DATA_DIR / "voices.json",
+    preview_dir=DATA_DIR / "voice_previews",
+    ttl=float(os.getenv("VOICES_CACHE_TTL", "3600"))
+)
+
+
 @app.get("/api/tts/voices")
-async def get_elevenlabs_voices():
-    """Lista vozes disponíveis no ElevenLabs"""
+async def get_elevenlabs_voices(refresh: bool = False):
+    """Lista vozes disponíveis no ElevenLabs (do cache; refresh=true força atualização)"""
     if not ELEVENLABS_API_KEY:
         raise HTTPException(status_code=500, detail="API Key do ElevenLabs não configurada")
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                "https://api.elevenlabs.io/v1/voices",
-                headers={"xi-api-key": ELEVENLABS_API_KEY}
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            # Retornar lista simplificada de vozes
-            voices = []
-            for voice in data.get("voices", []):
-                voices.append({
-                    "voice_id": voice.get("voice_id"),
-                    "name": voice.get("name"),
-                    "category": voice.get("category", "custom"),
-                    "preview_url": voice.get("preview_url"),
-                    "labels": voice.get("labels", {})
-                })
+    try:
+        voices = await voice_catalog.get(force=refresh)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar vozes: {str(e)}")
+
+    return {
+        "voices": [
+            {**voice, "local_preview_url": f"/api/tts/voices/{voice['voice_id']}/preview"}
+            for voice in voices
+        ],
+        "fresh": voice_catalog.is_fresh
+    }
 
-            return {"voices": voices}
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=500, detail=f"Erro ao buscar vozes: {str(e)}")
+
+async def download_voice_preview(url: str) -> bytes:
+    response = await elevenlabs_http.get(url)
+    response.raise_for_status()
+    return response.content
+
+
+@app.get("/api/tts/voices/status")
+async def get_voice_catalog_status():
+    """Estado do cache do catálogo de vozes"""
+    return voice_catalog.status()
+
+
+@app.get("/api/tts/voices/{voice_id}/preview")
+async def get_voice_preview(voice_id: str):
+    """Áudio de prévia da voz (baixado uma vez e servido localmente)"""
+    try:
+        path = await voice_catalog.get_preview(voice_id, download_voice_preview)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Erro ao baixar prévia: {str(e)}")
+
+    if not path:
+        raise HTTPException(status_code=404, detail="Prévia da voz não encontrada")
+
+    return FileResponse(path, media_type="audio/mpeg", headers={"Cache-Control": "public, max-age=86400"})
 
 
 @app.post("/api/tts/generate")
@@ -1622,87 +2270,64 @@ async def generate_tts(data: TTSRequest):
     if not data.text.strip():
         raise HTTPException(status_code=400, detail="Texto não pode estar vazio")
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            # Chamada à API ElevenLabs
-            response = await client.post(
-                f"https://api.elevenlabs.io/v1/text-to-speech/{data.voice_id}",
-                headers={
-                    "xi-api-key": ELEVENLABS_API_KEY,
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "text": data.text,
-                    "model_id": data.model_id,
-                    "voice_settings": {
-                        "stability": data.stability,
-                        "similarity_boost": data.similarity_boost
-                    }
-                }
-            )
-            response.raise_for_status()
-
-            # Salvar o áudio gerado
-            audio_content = response.content
+    try:
+        # Chamada à API ElevenLabs (ou cache)
+        audio_content = await synthesize_speech(
+            data.text, data.voice_id, data.model_id, data.stability, data.similarity_boost
+        )
 
-            # Gerar nome do arquivo
-            if data.name:
-                safe_name = "".join(c for c in data.name if c.isalnum() or c in (' ', '-', '_')).strip()
-                safe_name = safe_name[:50]  # Limitar tamanho
-            else:
-                safe_name = f"tts_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        # Gerar nome do arquivo
+        if data.name:
+            safe_name = "".join(c for c in data.name if c.isalnum() or c in (' ', '-', '_')).strip()
+            safe_name = safe_name[:50]  # Limitar tamanho
+        else:
+            safe_name = f"tts_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
 
-            music_id = str(uuid.uuid4())
-            filename = f"{music_id}.mp3"
-            filepath = STORAGE_DIR / filename
+        music_id = str(uuid.uuid4())
+        filename = f"{music_id}.mp3"
+        filepath = STORAGE_DIR / filename
 
-            # Salvar arquivo
-            with open(filepath, "wb") as f:
-                f.write(audio_content)
+        # Salvar arquivo
+        with open(filepath, "wb") as f:
+            f.write(audio_content)
 
-            # Obter duração
-            duration = None
-            if MUTAGEN_AVAILABLE:
-                try:
-                    audio = MP3(str(filepath))
-                    duration = audio.info.length
-                except:
-                    pass
+        # Obter duração
+        duration = get_audio_duration(filepath) or None
 
-            # Salvar no banco de dados
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute(
-                    """INSERT INTO music (id, filename, original_name, duration, is_ad, created_at)
-                       VALUES (?, ?, ?, ?, ?, ?)""",
-                    (music_id, filename, f"{safe_name}.mp3", duration, data.is_ad, datetime.now().isoformat())
-                )
-                await db.commit()
+        # Salvar no banco de dados
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                """INSERT INTO music (id, filename, original_name, duration, is_ad, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (music_id, filename, f"{safe_name}.mp3", duration, data.is_ad, datetime.now().isoformat())
+            )
+            await db.commit()
 
-            # Notificar clientes
-            await manager.broadcast({
-                "type": "music_added",
-                "music_id": music_id,
-                "music_name": f"{safe_name}.mp3"
-            })
+        # Notificar clientes
+        await manager.broadcast({
+            "type": "music_added",
+            "music_id": music_id,
+            "music_name": f"{safe_name}.mp3"
+        })
 
-            return {
-                "success": True,
-                "music_id": music_id,
-                "filename": f"{safe_name}.mp3",
-                "duration": duration,
-                "is_ad": data.is_ad
-            }
+        return {
+            "success": True,
+            "music_id": music_id,
+            "filename": f"{safe_name}.mp3",
+            "duration": duration,
+            "is_ad": data.is_ad
+        }
 
-        except httpx.HTTPStatusError as e:
-            error_detail = "Erro na API ElevenLabs"
-            try:
-                error_json = e.response.json()
-                error_detail = error_json.get("detail", {}).get("message", str(e))
-            except:
-                pass
-            raise HTTPException(status_code=e.response.status_code, detail=error_detail)
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=500, detail=f"Erro de conexão: {str(e)}")
+    except httpx.HTTPStatusError as e:
+        error_detail = "Erro na API ElevenLabs"
+        try:
+            error_json = e.response.json()
+            error_detail = error_json.get("detail", {}).get("message", str(e))
+        except:
+            pass
+        raise HTTPException(status_code=e.response.status_code, detail=error_detail)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Erro de conexão: {str(e)}")
 
 
 @app.get("/api/tts/status")
@@ -1714,10 +2339,32 @@ async def get_tts_status():
     }
 
 
+@app.get("/api/upstream/stats")
+async def get_upstream_stats():
+    """Métricas das chamadas às APIs externas (latência, erros, retries)"""
+    return {
+        "elevenlabs": elevenlabs_http.stats(),
+        "openrouter": openrouter_http.stats()
+    }
+
+
+@app.get("/api/tts/cache/stats")
+async def get_tts_cache_stats():
+    """Estatísticas do cache de síntese (itens, tamanho, taxa de acerto)"""
+    return tts_cache.stats()
+
+
+@app.delete("/api/tts/cache")
+async def clear_tts_cache():
+    """Limpa o cache de síntese"""
+    removed = await asyncio.to_thread(tts_cache.clear)
+    return {"success": True, "removed": removed}
+
+
 # ============ AUDIO MIXING (TTS + Background Music) ============
 
-class MixAudioRequest(BaseModel):
-    text: str  # Texto para TTS
+class MixSettings(BaseModel):
+    """Configurações comuns de voz e mixagem"""
     voice_id: str = "21m00Tcm4TlvDq8ikWAM"
     model_id: str = "eleven_multilingual_v2"
     stability: float = 0.5
@@ -1737,13 +2384,280 @@ class MixAudioRequest(BaseModel):
     voice_volume: float = 1.0  # Volume da voz (0.0 a 1.0)
     fade_duration: float = 0.5  # Duração do fade entre volumes
 
-    # Metadados
-    name: Optional[str] = None
     is_ad: bool = True
 
 
+class MixAudioRequest(MixSettings):
+    text: str  # Texto para TTS
+    name: Optional[str] = None
+
+
+# Fila de mixagens: FFmpeg roda como subprocesso assíncrono, com no máximo
+# MIX_MAX_CONCURRENT encodes simultâneos (padrão: número de CPUs)
+async def broadcast_mix_progress(job: dict):
+    await manager.broadcast({"type": "mix_progress", **job})
+
+
+mix_jobs = MixJobManager(
+    max_concurrent=int(os.getenv("MIX_MAX_CONCURRENT", "0")) or None,
+    on_progress=broadcast_mix_progress
+)
+
+
+# Mixagem em processo com NumPy (MIX_ENGINE=ffmpeg força o caminho só com FFmpeg)
+USE_NUMPY_MIXER = NUMPY_AVAILABLE and os.getenv("MIX_ENGINE", "numpy") != "ffmpeg"
+
+# Músicas de fundo pré-decodificadas em PCM
+bed_cache = BedCache(
+    DATA_DIR / "beds",
+    max_bytes=int(os.getenv("BED_CACHE_MAX_MB", "2048")) * 1024 * 1024
+)
+
+
+async def get_decoded_bed(job: MixJob, music_id: str, source_path: Path) -> Optional["np.ndarray"]:
+    """
+    PCM da música de fundo (decodifica e guarda no cache na primeira vez).
+    None se a decodificação não gerou amostras: quem chama segue pelo FFmpeg.
+    """
+    async def decode(source: Path, target: Path):
+        await mix_jobs.report(job, stage="decoding_bed")
+        returncode, stderr = await mix_jobs.run_ffmpeg(
+            job, ["-i", str(source), "-vn", *PCM_ARGS, str(target)], 0
+        )
+        if returncode != 0:
+            raise MixJobError(f"Erro ao decodificar música de fundo: {stderr[:500]}")
+
+    try:
+        path = await bed_cache.get(music_id, source_path, decode)
+        return bed_cache.load(path)
+    except EmptyBedError as e:
+        print(f"[MIX] {e}; usando a mixagem só com FFmpeg")
+        return None
+
+
+async def decode_voice_pcm(job: MixJob, path: str) -> "np.ndarray":
+    """Decodifica um áudio de voz (curto) para PCM no formato da mixagem"""
+    returncode, stdout, stderr = await mix_jobs.run_process(job, [
+        "ffmpeg", "-v", "error", "-i", path, "-vn", *PCM_ARGS, "pipe:1"
+    ])
+    if returncode != 0:
+        raise MixJobError(f"Erro ao decodificar TTS: {stderr.decode(errors='ignore')[:500]}")
+    return pcm_from_bytes(stdout)
+
+
+async def encode_pcm_mix(job: MixJob, bed: "np.ndarray", voice: "np.ndarray", settings: MixSettings,
+                         safe_name: str) -> tuple[dict, float]:
+    """Mixa com NumPy (em thread) e codifica o MP3. Retorna (resultado, duração total)."""
+    await mix_jobs.report(job, stage="mixing")
+    pcm = await asyncio.to_thread(
+        mix_pcm, bed, voice,
+        settings.intro_duration, settings.outro_duration, settings.fade_out_duration,
+        settings.fade_duration, settings.music_volume, settings.music_ducking_volume,
+        settings.voice_volume
+    )
+    total_duration = len(pcm) / SAMPLE_RATE
+    saved = await encode_mix(
+        job, [*PCM_ARGS, "-i", "pipe:0"], total_duration, safe_name, settings.is_ad,
+        stdin_data=pcm.tobytes()
+    )
+    return saved, total_duration
+
+
+async def get_background_music_path(music_id: str) -> Path:
+    """Caminho do arquivo da música de fundo (404 se não existir)"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("SELECT * FROM music WHERE id = ?", (music_id,)) as cursor:
+            bg_music = await cursor.fetchone()
+            if not bg_music:
+                raise HTTPException(status_code=404, detail="Música de fundo não encontrada")
+
+    bg_music_path = STORAGE_DIR / bg_music["filename"]
+    print(f"[MIX] Caminho da música: {bg_music_path}")
+    if not bg_music_path.exists():
+        raise HTTPException(status_code=404, detail="Arquivo de música não encontrado")
+    return bg_music_path
+
+
+def safe_file_name(name: Optional[str], prefix: str) -> str:
+    if name:
+        return "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).strip()[:50]
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+
+async def synthesize_for_mix(text: str, settings: MixSettings) -> bytes:
+    """TTS para mixagem, convertendo erros do ElevenLabs em MixJobError"""
+    try:
+        return await synthesize_speech(
+            text, settings.voice_id, settings.model_id, settings.stability, settings.similarity_boost
+        )
+    except httpx.HTTPStatusError as e:
+        error_detail = "Erro na API ElevenLabs"
+        try:
+            error_json = e.response.json()
+            error_detail = error_json.get("detail", {}).get("message", str(e))
+        except:
+            pass
+        print(f"[MIX] Erro ElevenLabs: {error_detail}")
+        raise MixJobError(error_detail, status_code=e.response.status_code)
+    except Exception as e:
+        print(f"[MIX] Erro ao gerar TTS: {e}")
+        raise MixJobError(f"Erro ao gerar TTS: {str(e)}")
+
+
+def probe_tts_duration(path: str) -> float:
+    """Duração de um áudio TTS lida no próprio processo (fallback 10s)"""
+    duration = get_audio_duration(Path(path))
+    if duration <= 0:
+        print(f"[MIX] Não foi possível obter a duração do TTS, usando fallback 10s")
+        return 10  # Fallback
+    print(f"[MIX] Duração do TTS: {duration:.2f}s")
+    return duration
+
+
+def build_mix_filter(settings: MixSettings, tts_duration: float, voice_inputs: int = 1,
+                     fragment_gap: float = 0.0) -> tuple[str, float]:
+    """
+    Monta o filter_complex do FFmpeg. Input 0 é a música de fundo e os inputs
+    1..voice_inputs são trechos de voz tocados em sequência (separados por
+    fragment_gap segundos). Retorna (filter_complex, duração total).
+    """
+    # Calcular tempos
+    intro = settings.intro_duration
+    outro = settings.outro_duration
+    fade_out = settings.fade_out_duration
+    fade_time = settings.fade_duration
+
+    # Tempo total necessário de música
+    total_duration = intro + tts_duration + outro + fade_out
+
+    # Volumes
+    vol_normal = settings.music_volume
+    vol_duck = settings.music_ducking_volume
+    vol_voice = settings.voice_volume
+
+    # FFmpeg complex filter para mixagem
+    # Estrutura:
+    # - Música: volume normal -> fade down -> volume baixo -> fade up -> volume normal -> fade out
+    # - Voz: delay de intro_duration segundos, com volume configurado
+
+    # Tempos chave
+    t_duck_start = intro  # Quando começa a abaixar
+    t_duck_end = intro + tts_duration  # Quando começa a subir
+    t_fade_out_start = intro + tts_duration + outro  # Quando começa fade out final
+
+    print(f"[MIX] Timeline: intro={intro}s, tts={tts_duration}s, outro={outro}s, fade_out={fade_out}s")
+    print(f"[MIX] Total duration: {total_duration}s")
+    print(f"[MIX] Volumes: normal={vol_normal}, duck={vol_duck}, voice={vol_voice}")
+
+    # Filter complex simplificado para FFmpeg
+    # Usar volume com expressão if/then para evitar NaN
+    volume_expr = (
+        f"if(lt(t,{t_duck_start}),{vol_normal},"  # Intro: volume normal
+        f"if(lt(t,{t_duck_start + fade_time}),{vol_normal}-({vol_normal}-{vol_duck})*(t-{t_duck_start})/{fade_time},"  # Fade down
+        f"if(lt(t,{t_duck_end}),{vol_duck},"  # Durante TTS: volume baixo
+        f"if(lt(t,{t_duck_end + fade_time}),{vol_duck}+({vol_normal}-{vol_duck})*(t-{t_duck_end})/{fade_time},"  # Fade up
+        f"if(lt(t,{t_fade_out_start}),{vol_normal},"  # Outro: volume normal
+        f"{vol_normal}*(1-(t-{t_fade_out_start})/{fade_out})"  # Fade out final
+        f")))))"
+    )
+
+    audio_format = "aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo"
+
+    # Trechos de voz: concatenar em sequência com pausa entre eles
+    if voice_inputs == 1:
+        voice_chain = "[1:a]"
+    else:
+        fragments = []
+        for i in range(1, voice_inputs + 1):
+            pad = f",apad=pad_dur={fragment_gap}" if i < voice_inputs and fragment_gap > 0 else ""
+            fragments.append(f"[{i}:a]{audio_format}{pad}[frag{i}];")
+        labels = "".join(f"[frag{i}]" for i in range(1, voice_inputs + 1))
+        voice_chain = "".join(fragments) + f"{labels}concat=n={voice_inputs}:v=0:a=1[speech];[speech]"
+
+    filter_complex = (
+        # Input 0: música de fundo, loop se necessário e cortar no tempo total
+        f"[0:a]aloop=loop=-1:size=2e+09,atrim=0:{total_duration},"
+        # Volume dinâmico com expressão
+        f"volume='{volume_expr}':eval=frame,"
+        f"{audio_format}[bg];"
+        # Voz com delay e volume
+        f"{voice_chain}adelay={int(intro * 1000)}|{int(intro * 1000)},volume={vol_voice},"
+        f"{audio_format}[voice];"
+        # Mixar os dois
+        f"[bg][voice]amix=inputs=2:duration=first:dropout_transition=0[out]"
+    )
+
+    return filter_complex, total_duration
+
+
+def filter_input_args(inputs: list, filter_complex: str) -> list[str]:
+    """Argumentos do FFmpeg para mixar os arquivos com o filter_complex"""
+    args = []
+    for path in inputs:
+        args += ["-i", str(path)]
+    return args + ["-filter_complex", filter_complex, "-map", "[out]"]
+
+
+async def encode_mix(job: MixJob, input_args: list[str], total_duration: float,
+                     safe_name: str, is_ad: bool, stdin_data: Optional[bytes] = None) -> dict:
+    """Codifica a mixagem em MP3, registra no banco e notifica os clientes"""
+    music_id = str(uuid.uuid4())
+    output_filename = f"{music_id}.mp3"
+    output_path = STORAGE_DIR / output_filename
+
+    try:
+        # Executar FFmpeg (assíncrono, progresso via -progress)
+        args = input_args + ["-c:a", "libmp3lame", "-b:a", "192k", str(output_path)]
+
+        print(f"[MIX] Executando FFmpeg (job {job.id})...")
+        returncode, stderr = await mix_jobs.run_ffmpeg(job, args, total_duration, stdin_data)
+
+        if returncode != 0:
+            print(f"[MIX] FFmpeg erro (código {returncode}):")
+            print(f"[MIX] stderr: {stderr}")
+            raise MixJobError(f"Erro ao mixar áudio: {stderr[:500]}")
+
+        print(f"[MIX] FFmpeg concluído com sucesso!")
+        await mix_jobs.report(job, stage="saving", progress=100)
+
+        # Obter duração final
+        final_duration = get_audio_duration(output_path) or None
+
+        # Salvar no banco de dados
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                """INSERT INTO music (id, filename, original_name, duration, is_ad, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (music_id, output_filename, f"{safe_name}.mp3", final_duration, is_ad, datetime.now().isoformat())
+            )
+            await db.commit()
+
+        # Notificar clientes
+        await manager.broadcast({
+            "type": "music_added",
+            "music_id": music_id,
+            "music_name": f"{safe_name}.mp3"
+        })
+        output_path = None  # Arquivo registrado: não remover no finally
+
+        return {
+            "music_id": music_id,
+            "filename": f"{safe_name}.mp3",
+            "duration": final_duration
+        }
+
+    finally:
+        # Remover a saída parcial se falhou ou foi cancelado
+        if output_path and output_path.exists():
+            try:
+                output_path.unlink()
+            except:
+                pass
+
+
 @app.post("/api/tts/mix")
-async def generate_mixed_audio(data: MixAudioRequest):
+async def generate_mixed_audio(data: MixAudioRequest, wait: bool = True):
     """
     Gera áudio mixado: música de fundo + locução TTS
 
@@ -1754,10 +2668,10 @@ async def generate_mixed_audio(data: MixAudioRequest):
     4. Fade up da música para volume normal
     5. [outro_duration] segundos de música em volume normal
     6. Fade out final de [fade_out_duration] segundos
-    """
-    import subprocess
-    import tempfile
 
+    A mixagem roda como job em background. Com wait=false retorna o job_id
+    imediatamente (progresso via /api/tts/mix/jobs/{job_id} e WebSocket 'mix_progress').
+    """
     print(f"[MIX] Iniciando geração de vinheta...")
     print(f"[MIX] Música de fundo: {data.background_music_id}")
     print(f"[MIX] Texto: {data.text[:50]}...")
@@ -1765,214 +2679,350 @@ async def generate_mixed_audio(data: MixAudioRequest):
     if not ELEVENLABS_API_KEY:
         raise HTTPException(status_code=500, detail="API Key do ElevenLabs não configurada")
 
-    if not data.text.strip():
-        raise HTTPException(status_code=400, detail="Texto não pode estar vazio")
-
-    # Buscar música de fundo
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM music WHERE id = ?", (data.background_music_id,)) as cursor:
-            bg_music = await cursor.fetchone()
-            if not bg_music:
-                raise HTTPException(status_code=404, detail="Música de fundo não encontrada")
+    if not data.text.strip():
+        raise HTTPException(status_code=400, detail="Texto não pode estar vazio")
+
+    bg_music_path = await get_background_music_path(data.background_music_id)
+
+    job = mix_jobs.submit("mix", data.name or data.text[:50],
+                          lambda job: run_mix_job(job, data, bg_music_path))
+
+    if not wait:
+        return {"success": True, "job_id": job.id, "status": job.status}
+
+    await mix_jobs.wait(job)
+    if job.status != "completed":
+        raise HTTPException(status_code=job.error_status, detail=job.error)
+    return job.result
+
+
+async def run_mix_job(job: MixJob, data: MixAudioRequest, bg_music_path: Path) -> dict:
+    """Executa a mixagem (TTS + FFmpeg) dentro de um job"""
+    await mix_jobs.report(job, stage="tts")
+    print(f"[MIX] Gerando TTS com ElevenLabs...")
+    # Gerar TTS (ou reaproveitar do cache)
+    tts_content = await synthesize_for_mix(data.text, data)
+    print(f"[MIX] TTS gerado com sucesso, {len(tts_content)} bytes")
+
+    # Criar arquivos temporários
+    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tts_file:
+        tts_file.write(tts_content)
+        tts_path = tts_file.name
+
+    print(f"[MIX] TTS salvo em: {tts_path}")
+
+    try:
+        safe_name = safe_file_name(data.name, "mix")
+
+        bed = await get_decoded_bed(job, data.background_music_id, bg_music_path) if USE_NUMPY_MIXER else None
+
+        if bed is not None:
+            voice = await decode_voice_pcm(job, tts_path)
+            tts_duration = len(voice) / SAMPLE_RATE
+            print(f"[MIX] Duração do TTS: {tts_duration:.2f}s (mixagem NumPy)")
+            saved, total_duration = await encode_pcm_mix(job, bed, voice, data, safe_name)
+        else:
+            # Obter duração do TTS
+            tts_duration = probe_tts_duration(tts_path)
+
+            filter_complex, total_duration = build_mix_filter(data, tts_duration)
+            print(f"[MIX] Filter complex criado")
+
+            saved = await encode_mix(
+                job, filter_input_args([bg_music_path, tts_path], filter_complex),
+                total_duration, safe_name, data.is_ad
+            )
+
+        return {
+            "success": True,
+            **saved,
+            "tts_duration": tts_duration,
+            "total_duration": total_duration,
+            "is_ad": data.is_ad,
+            "config": {
+                "intro": data.intro_duration,
+                "outro": data.outro_duration,
+                "fade_out": data.fade_out_duration,
+                "music_volume": data.music_volume,
+                "ducking_volume": data.music_ducking_volume
+            }
+        }
+
+    finally:
+        # Limpar arquivo temporário
+        try:
+            os.unlink(tts_path)
+        except:
+            pass
+
+
+@app.get("/api/tts/mix/bed-cache")
+async def get_bed_cache_stats():
+    """Estatísticas do cache de músicas de fundo pré-decodificadas"""
+    return {"engine": "numpy" if USE_NUMPY_MIXER else "ffmpeg", **bed_cache.stats()}
+
+
+@app.get("/api/tts/mix/jobs")
+async def list_mix_jobs():
+    """Lista os jobs de mixagem (em andamento e finalizados recentes)"""
+    jobs = [job.to_dict() for job in mix_jobs.jobs.values()]
+    return {
+        "jobs": sorted(jobs, key=lambda j: j["created_at"], reverse=True),
+        "max_concurrent": mix_jobs.max_concurrent
+    }
+
+
+@app.get("/api/tts/mix/jobs/{job_id}")
+async def get_mix_job(job_id: str):
+    """Status e resultado de um job de mixagem"""
+    job = mix_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job.to_dict()
+
+
+@app.delete("/api/tts/mix/jobs/{job_id}")
+async def cancel_mix_job(job_id: str):
+    """Cancela um job de mixagem em andamento"""
+    job = mix_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if not mix_jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job já finalizado ({job.status})")
+    await mix_jobs.wait(job)
+    return {"success": True, "job_id": job_id, "status": job.status}
+
+
+# ============ LOTE DE VINHETAS (TEMPLATE) ============
+
+BATCH_MAX_ITEMS = 200
+
+
+class BatchMixRequest(MixSettings):
+    template: str  # Texto com variáveis, ex.: "Oferta da semana. {produto} por apenas {preco}."
+    items: List[Dict[str, Union[str, int, float]]]  # Valores das variáveis de cada vinheta
+    name_template: Optional[str] = None  # Nome de cada arquivo, ex.: "Oferta {produto}"
+    fragment_gap: float = 0.25  # Pausa entre frases (segundos)
+
+
+def split_template(template: str) -> list[str]:
+    """Divide o template em frases; frases sem variáveis são sintetizadas uma única vez"""
+    return [s for s in re.split(r"(?<=[.!?;])\s+", template.strip()) if s]
+
+
+def render_template(template: str, values: Dict[str, Union[str, int, float]]) -> str:
+    try:
+        return template.format_map(values)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Variável {e} não informada")
+    except (ValueError, IndexError) as e:
+        raise HTTPException(status_code=400, detail=f"Template inválido: {e}")
+
+
+@app.post("/api/tts/batch")
+async def generate_batch_mix(data: BatchMixRequest, wait: bool = False):
+    """
+    Gera várias vinhetas a partir de um template e uma lista de variáveis.
+
+    Só as frases distintas são sintetizadas (com cache), a música de fundo é
+    decodificada uma vez para o lote todo e cada vinheta é um job próprio,
+    codificado em paralelo (progresso por item via WebSocket 'mix_progress'
+    ou /api/tts/batch/{job_id}/stream).
+    """
+    if not ELEVENLABS_API_KEY:
+        raise HTTPException(status_code=500, detail="API Key do ElevenLabs não configurada")
+
+    if not data.template.strip():
+        raise HTTPException(status_code=400, detail="Template não pode estar vazio")
 
-    bg_music_path = STORAGE_DIR / bg_music["filename"]
-    print(f"[MIX] Caminho da música: {bg_music_path}")
-    if not bg_music_path.exists():
-        raise HTTPException(status_code=404, detail="Arquivo de música não encontrado")
+    if not data.items:
+        raise HTTPException(status_code=400, detail="Nenhum item informado")
 
-    print(f"[MIX] Gerando TTS com ElevenLabs...")
-    # Gerar TTS
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            response = await client.post(
-                f"https://api.elevenlabs.io/v1/text-to-speech/{data.voice_id}",
-                headers={
-                    "xi-api-key": ELEVENLABS_API_KEY,
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "text": data.text,
-                    "model_id": data.model_id,
-                    "voice_settings": {
-                        "stability": data.stability,
-                        "similarity_boost": data.similarity_boost
-                    }
-                }
-            )
-            response.raise_for_status()
-            tts_content = response.content
-            print(f"[MIX] TTS gerado com sucesso, {len(tts_content)} bytes")
-        except httpx.HTTPStatusError as e:
-            error_detail = "Erro na API ElevenLabs"
-            try:
-                error_json = e.response.json()
-                error_detail = error_json.get("detail", {}).get("message", str(e))
-            except:
-                pass
-            print(f"[MIX] Erro ElevenLabs: {error_detail}")
-            raise HTTPException(status_code=e.response.status_code, detail=error_detail)
-        except Exception as e:
-            print(f"[MIX] Erro ao gerar TTS: {e}")
-            raise HTTPException(status_code=500, detail=f"Erro ao gerar TTS: {str(e)}")
+    if len(data.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {BATCH_MAX_ITEMS} itens por lote")
 
-    # Criar arquivos temporários
-    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tts_file:
-        tts_file.write(tts_content)
-        tts_path = tts_file.name
+    # Renderizar tudo antes de começar para validar as variáveis
+    sentences = split_template(data.template)
+    renders = []
+    for index, values in enumerate(data.items):
+        fragments = [f.strip() for f in (render_template(s, values) for s in sentences) if f.strip()]
+        if not fragments:
+            raise HTTPException(status_code=400, detail=f"Item {index + 1} gerou texto vazio")
+        name = render_template(data.name_template, values) if data.name_template else None
+        renders.append((fragments, name))
 
-    print(f"[MIX] TTS salvo em: {tts_path}")
+    bg_music_path = await get_background_music_path(data.background_music_id)
 
-    try:
-        # Obter duração do TTS
-        tts_duration = 0
-        try:
-            result = subprocess.run(
-                ["ffprobe", "-v", "error", "-show_entries", "format=duration",
-                 "-of", "default=noprint_wrappers=1:nokey=1", tts_path],
-                capture_output=True, text=True
-            )
-            tts_duration = float(result.stdout.strip())
-            print(f"[MIX] Duração do TTS: {tts_duration}s")
-        except Exception as e:
-            print(f"[MIX] Erro ao obter duração do TTS: {e}, usando fallback 10s")
-            tts_duration = 10  # Fallback
+    print(f"[MIX] Lote de {len(renders)} vinhetas, {len(sentences)} frases no template")
+    job = mix_jobs.submit("batch", f"Lote de {len(renders)} vinhetas",
+                          lambda job: run_batch_job(job, data, renders, bg_music_path))
 
-        # Calcular tempos
-        intro = data.intro_duration
-        outro = data.outro_duration
-        fade_out = data.fade_out_duration
-        fade_time = data.fade_duration
+    if not wait:
+        return {"success": True, "job_id": job.id, "status": job.status, "total": len(renders)}
 
-        # Tempo total necessário de música
-        total_duration = intro + tts_duration + outro + fade_out
+    await mix_jobs.wait(job)
+    if job.status != "completed":
+        raise HTTPException(status_code=job.error_status, detail=job.error)
+    return job.result
 
-        # Volumes
-        vol_normal = data.music_volume
-        vol_duck = data.music_ducking_volume
-        vol_voice = data.voice_volume
 
-        # Gerar nome do arquivo
-        if data.name:
-            safe_name = "".join(c for c in data.name if c.isalnum() or c in (' ', '-', '_')).strip()[:50]
-        else:
-            safe_name = f"mix_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+async def run_batch_job(job: MixJob, data: BatchMixRequest, renders: list[tuple[list[str], Optional[str]]],
+                        bg_music_path: Path) -> dict:
+    """Sintetiza as frases distintas, decodifica a música uma vez e dispara um job por vinheta"""
+    work_dir = Path(tempfile.mkdtemp(prefix="falavip_batch_"))
+    children: list[MixJob] = []
 
-        music_id = str(uuid.uuid4())
-        output_filename = f"{music_id}.mp3"
-        output_path = STORAGE_DIR / output_filename
-
-        # FFmpeg complex filter para mixagem
-        # Estrutura:
-        # - Música: volume normal -> fade down -> volume baixo -> fade up -> volume normal -> fade out
-        # - Voz: delay de intro_duration segundos, com volume configurado
-
-        # Tempos chave
-        t_duck_start = intro  # Quando começa a abaixar
-        t_duck_end = intro + tts_duration  # Quando começa a subir
-        t_fade_out_start = intro + tts_duration + outro  # Quando começa fade out final
-
-        print(f"[MIX] Timeline: intro={intro}s, tts={tts_duration}s, outro={outro}s, fade_out={fade_out}s")
-        print(f"[MIX] Total duration: {total_duration}s")
-        print(f"[MIX] Volumes: normal={vol_normal}, duck={vol_duck}, voice={vol_voice}")
-
-        # Filter complex simplificado para FFmpeg
-        # Usar volume com expressão if/then para evitar NaN
-        volume_expr = (
-            f"if(lt(t,{t_duck_start}),{vol_normal},"  # Intro: volume normal
-            f"if(lt(t,{t_duck_start + fade_time}),{vol_normal}-({vol_normal}-{vol_duck})*(t-{t_duck_start})/{fade_time},"  # Fade down
-            f"if(lt(t,{t_duck_end}),{vol_duck},"  # Durante TTS: volume baixo
-            f"if(lt(t,{t_duck_end + fade_time}),{vol_duck}+({vol_normal}-{vol_duck})*(t-{t_duck_end})/{fade_time},"  # Fade up
-            f"if(lt(t,{t_fade_out_start}),{vol_normal},"  # Outro: volume normal
-            f"{vol_normal}*(1-(t-{t_fade_out_start})/{fade_out})"  # Fade out final
-            f")))))"
-        )
+    try:
+        # 1. Frases distintas (na ordem em que aparecem)
+        unique_fragments = list(dict.fromkeys(f for fragments, _ in renders for f in fragments))
+        fragment_files: Dict[str, Path] = {}
+        fragment_durations: Dict[str, float] = {}
+        fragment_pcm: Dict[str, "np.ndarray"] = {}
+        cache_hits_before = tts_cache.hits
+
+        await mix_jobs.report(job, stage="tts")
+        tts_slots = asyncio.Semaphore(4)  # Não disparar dezenas de chamadas de uma vez
+
+        async def prepare_fragment(index: int, text: str):
+            async with tts_slots:
+                audio = await synthesize_for_mix(text, data)
+            path = work_dir / f"fragment_{index}.mp3"
+            path.write_bytes(audio)
+            fragment_files[text] = path
+            if USE_NUMPY_MIXER:
+                fragment_pcm[text] = await decode_voice_pcm(job, str(path))
+                fragment_durations[text] = len(fragment_pcm[text]) / SAMPLE_RATE
+            else:
+                fragment_durations[text] = probe_tts_duration(str(path))
+
+        await asyncio.gather(*[prepare_fragment(i, text) for i, text in enumerate(unique_fragments)])
+        print(f"[MIX] Lote: {len(unique_fragments)} frases distintas, "
+              f"{tts_cache.hits - cache_hits_before} do cache")
+
+        # 2. Música de fundo decodificada uma única vez (PCM 44.1kHz estéreo)
+        bed = await get_decoded_bed(job, data.background_music_id, bg_music_path) if USE_NUMPY_MIXER else None
+        if bed is None:
+            await mix_jobs.report(job, stage="decoding_bed")
+            bed_path = work_dir / "bed.wav"
+            returncode, stderr = await mix_jobs.run_ffmpeg(job, [
+                "-i", str(bg_music_path), "-vn",
+                "-ac", "2", "-ar", "44100", "-c:a", "pcm_f32le",
+                str(bed_path)
+            ], 0)
+            if returncode != 0:
+                raise MixJobError(f"Erro ao decodificar música de fundo: {stderr[:500]}")
+
+        # 3. Um job por vinheta (o semáforo do mix_jobs limita os encodes ao número de CPUs)
+        await mix_jobs.report(job, stage="rendering", progress=0)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+        async def render_item(child: MixJob, fragments: list[str], safe_name: str) -> dict:
+            speech_duration = sum(fragment_durations[f] for f in fragments) + data.fragment_gap * (len(fragments) - 1)
+            if bed is not None:
+                voice = join_fragments([fragment_pcm[f] for f in fragments], data.fragment_gap)
+                saved, total_duration = await encode_pcm_mix(child, bed, voice, data, safe_name)
+            else:
+                filter_complex, total_duration = build_mix_filter(data, speech_duration, len(fragments), data.fragment_gap)
+                inputs = [bed_path] + [fragment_files[f] for f in fragments]
+                saved = await encode_mix(
+                    child, filter_input_args(inputs, filter_complex), total_duration, safe_name, data.is_ad
+                )
+            return {
+                **saved,
+                "text": " ".join(fragments),
+                "tts_duration": speech_duration,
+                "total_duration": total_duration
+            }
 
-        filter_complex = (
-            # Input 0: música de fundo, loop se necessário e cortar no tempo total
-            f"[0:a]aloop=loop=-1:size=2e+09,atrim=0:{total_duration},"
-            # Volume dinâmico com expressão
-            f"volume='{volume_expr}':eval=frame,"
-            f"aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo[bg];"
-            # Input 1: TTS com delay e volume
-            f"[1:a]adelay={int(intro * 1000)}|{int(intro * 1000)},volume={vol_voice},"
-            f"aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo[voice];"
-            # Mixar os dois
-            f"[bg][voice]amix=inputs=2:duration=first:dropout_transition=0[out]"
-        )
+        for index, (fragments, name) in enumerate(renders):
+            safe_name = safe_file_name(name, "lote") if name else f"lote_{timestamp}_{index + 1}"
+            child = mix_jobs.submit(
+                "batch_item", " ".join(fragments)[:50],
+                lambda child, fragments=fragments, safe_name=safe_name: render_item(child, fragments, safe_name),
+                parent_id=job.id
+            )
+            children.append(child)
+            job.children.append(child.id)
+
+        done = 0
+        for finished in asyncio.as_completed([mix_jobs.wait(child) for child in children]):
+            await finished
+            done += 1
+            await mix_jobs.report(job, progress=done / len(children) * 100)
+
+        items = []
+        for index, child in enumerate(children):
+            items.append({
+                "index": index,
+                "job_id": child.id,
+                "status": child.status,
+                "error": child.error,
+                **(child.result or {})
+            })
 
-        print(f"[MIX] Filter complex criado")
-
-        # Executar FFmpeg
-        cmd = [
-            "ffmpeg", "-y",
-            "-i", str(bg_music_path),
-            "-i", tts_path,
-            "-filter_complex", filter_complex,
-            "-map", "[out]",
-            "-c:a", "libmp3lame", "-b:a", "192k",
-            str(output_path)
-        ]
+        completed = sum(1 for child in children if child.status == "completed")
+        return {
+            "success": completed == len(children),
+            "total": len(children),
+            "completed": completed,
+            "failed": len(children) - completed,
+            "unique_fragments": len(unique_fragments),
+            "items": items
+        }
 
-        print(f"[MIX] Executando FFmpeg...")
-        print(f"[MIX] Comando: {' '.join(cmd[:6])}...")
-        result = subprocess.run(cmd, capture_output=True, text=True)
+    except asyncio.CancelledError:
+        # Cancelar os itens pendentes antes de apagar os arquivos temporários
+        for child in children:
+            mix_jobs.cancel(child.id)
+        await asyncio.gather(*[mix_jobs.wait(child) for child in children])
+        raise
 
-        if result.returncode != 0:
-            print(f"[MIX] FFmpeg erro (código {result.returncode}):")
-            print(f"[MIX] stderr: {result.stderr}")
-            raise HTTPException(status_code=500, detail=f"Erro ao mixar áudio: {result.stderr[:500]}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-        print(f"[MIX] FFmpeg concluído com sucesso!")
 
-        # Obter duração final
-        final_duration = None
-        if MUTAGEN_AVAILABLE:
-            try:
-                audio = MP3(str(output_path))
-                final_duration = audio.info.length
-            except:
-                pass
+@app.get("/api/tts/batch/{job_id}/stream")
+async def stream_batch_progress(request: Request, job_id: str):
+    """Progresso de um lote e de cada item em tempo real (SSE)"""
+    job = mix_jobs.get(job_id)
+    if not job or job.kind != "batch":
+        raise HTTPException(status_code=404, detail="Lote não encontrado")
 
-        # Salvar no banco de dados
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute(
-                """INSERT INTO music (id, filename, original_name, duration, is_ad, created_at)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (music_id, output_filename, f"{safe_name}.mp3", final_duration, data.is_ad, datetime.now().isoformat())
-            )
-            await db.commit()
+    async def event_generator():
+        last_snapshot = None
+        while True:
+            if await request.is_disconnected():
+                break
 
-        # Notificar clientes
-        await manager.broadcast({
-            "type": "music_added",
-            "music_id": music_id,
-            "music_name": f"{safe_name}.mp3"
-        })
+            items = []
+            for child_id in job.children:
+                child = mix_jobs.get(child_id)
+                if child:
+                    items.append({
+                        "job_id": child.id,
+                        "status": child.status,
+                        "stage": child.stage,
+                        "progress": round(child.progress, 1)
+                    })
 
-        return {
-            "success": True,
-            "music_id": music_id,
-            "filename": f"{safe_name}.mp3",
-            "duration": final_duration,
-            "tts_duration": tts_duration,
-            "total_duration": total_duration,
-            "is_ad": data.is_ad,
-            "config": {
-                "intro": intro,
-                "outro": outro,
-                "fade_out": fade_out,
-                "music_volume": vol_normal,
-                "ducking_volume": vol_duck
+            snapshot = {
+                "job_id": job.id,
+                "status": job.status,
+                "stage": job.stage,
+                "progress": round(job.progress, 1),
+                "items": items
             }
-        }
+            if snapshot != last_snapshot:
+                last_snapshot = snapshot
+                yield {"event": "progress", "data": json.dumps(snapshot)}
 
-    finally:
-        # Limpar arquivo temporário
-        try:
-            os.unlink(tts_path)
-        except:
-            pass
+            if job.finished:
+                yield {"event": "complete", "data": json.dumps(job.to_dict())}
+                break
+
+            await asyncio.sleep(0.5)
+
+    return EventSourceResponse(event_generator())
 
 
 @app.get("/api/tts/mix/preview-timing")
@@ -1981,23 +3031,42 @@ async def preview_mix_timing(
     text_length: int = 100,
     intro_duration: float = 5.0,
     outro_duration: float = 5.0,
-    fade_out_duration: float = 3.0
+    fade_out_duration: float = 3.0,
+    text: Optional[str] = None,
+    voice_id: Optional[str] = None,
+    model_id: str = "eleven_multilingual_v2",
+    stability: float = 0.5,
+    similarity_boost: float = 0.75
 ):
     """
     Calcula e retorna uma previsão dos timings do áudio mixado
-    (útil para o app mostrar uma prévia antes de gerar)
+    (útil para o app mostrar uma prévia antes de gerar).
+    Com text + voice_id usa a duração exata se o áudio já estiver no cache
+    de TTS; senão estima pela velocidade de fala aprendida da voz.
     """
-    # Estimar duração do TTS (aproximadamente 150 palavras por minuto, ~5 caracteres por palavra)
-    estimated_words = text_length / 5
-    estimated_tts_duration = (estimated_words / 150) * 60  # em segundos
-
-    # Mínimo de 2 segundos
-    estimated_tts_duration = max(2.0, estimated_tts_duration)
+    estimated_tts_duration = None
+    estimate_source = None
+
+    if text and voice_id:
+        key = cache_key(text, voice_id, model_id, {"stability": stability, "similarity_boost": similarity_boost})
+        cached_path = await asyncio.to_thread(tts_cache.peek, key)
+        if cached_path:
+            duration = get_audio_duration(cached_path)
+            if duration > 0:
+                estimated_tts_duration = duration
+                estimate_source = "tts_cache"
+
+    if estimated_tts_duration is None:
+        chars = len(normalize_text(text)) if text else text_length
+        chars_per_second, estimate_source = await get_speech_rate(voice_id, model_id)
+        # Mínimo de 2 segundos
+        estimated_tts_duration = max(2.0, chars / chars_per_second)
 
     total_duration = intro_duration + estimated_tts_duration + outro_duration + fade_out_duration
 
     return {
         "estimated_tts_duration": round(estimated_tts_duration, 1),
+        "estimate_source": estimate_source,
         "total_duration": round(total_duration, 1),
         "timeline": {
             "intro_start": 0,
@@ -2051,18 +3120,96 @@ async def get_music_metadata(music_id: str):
 
 
 @app.get("/api/music/metadata/all")
-async def get_all_music_metadata():
+async def get_all_music_metadata(request: Request):
     """Obtém metadados de todas as músicas classificadas"""
     async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            """SELECT m.*, mm.artist, mm.title, mm.album, mm.genre, mm.year, mm.obs, mm.classified_at
-               FROM music m
-               LEFT JOIN music_metadata mm ON m.id = mm.music_id
-               ORDER BY m.created_at DESC"""
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        revision = await get_catalog_revision(db, include_metadata=True)
+        etag = catalog_etag(revision, "metadata_all")
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        body = await json_snapshots.get(
+            "metadata_all", revision,
+            lambda: sql_json_array(
+                db, library_view.LIBRARY_COLUMNS,
+                "SELECT * FROM library ORDER BY created_at DESC",
+                float_columns=library_view.REAL_COLUMNS
+            )
+        )
+    return raw_json_response(body, headers={"ETag": etag})
+
+
+async def request_ai_completion(prompt: str) -> str:
+    """Envia o prompt ao OpenRouter e retorna o texto da resposta"""
+    try:
+        response = await openrouter_http.post(
+            "/v1/chat/completions",
+            headers={
+                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                "Content-Type": "application/json",
+                "HTTP-Referer": "https://falavipmusic.com",
+                "X-Title": "FalaVIP Music Player"
+            },
+            json={
+                "model": OPENROUTER_MODEL,
+                "messages": [
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": 0.3
+            }
+        )
+        response.raise_for_status()
+        data = response.json()
+    except httpx.HTTPStatusError as e:
+        error_detail = "Erro na API OpenRouter"
+        try:
+            error_json = e.response.json()
+            error_detail = error_json.get("error", {}).get("message", str(e))
+        except:
+            pass
+        raise HTTPException(status_code=e.response.status_code, detail=error_detail)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Erro de conexão: {str(e)}")
+
+    # Extrair resposta
+    return data.get("choices", [{}])[0].get("message", {}).get("content", "") or ""
+
+
+def parse_ai_json(ai_response: str):
+    """Parseia o JSON da resposta da IA (removendo marcadores de código)"""
+    clean_response = ai_response.strip()
+    if clean_response.startswith("```json"):
+        clean_response = clean_response[7:]
+    if clean_response.startswith("```"):
+        clean_response = clean_response[3:]
+    if clean_response.endswith("```"):
+        clean_response = clean_response[:-3]
+    return json.loads(clean_response.strip())
+
+
+METADATA_FIELDS = ("artist", "title", "album", "genre", "year", "obs")
+
+
+async def save_music_metadata(db, music_id: str, metadata: dict, raw_response: Optional[str],
+                              source: str = "ai"):
+    """Grava (ou substitui) os metadados classificados de uma música"""
+    await db.execute(
+        """INSERT OR REPLACE INTO music_metadata
+           (music_id, artist, title, album, genre, year, obs, raw_response, classified_at, source)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            music_id,
+            metadata.get("artist"),
+            metadata.get("title"),
+            metadata.get("album"),
+            metadata.get("genre"),
+            metadata.get("year"),
+            metadata.get("obs"),
+            raw_response,
+            datetime.now().isoformat(),
+            source
+        )
+    )
 
 
 @app.post("/api/ai/classify/{music_id}")
@@ -2103,203 +3250,335 @@ Regras:
 - Em "obs" você pode adicionar informações interessantes sobre a música se a conhecer
 - Responda APENAS com o JSON, nada mais"""
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": "https://falavipmusic.com",
-                    "X-Title": "FalaVIP Music Player"
-                },
-                json={
-                    "model": OPENROUTER_MODEL,
-                    "messages": [
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.3
-                }
-            )
-            response.raise_for_status()
-            data = response.json()
+    ai_response = await request_ai_completion(prompt)
 
-            # Extrair resposta
-            ai_response = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+    # Tentar parsear o JSON da resposta
+    try:
+        metadata = parse_ai_json(ai_response)
+        if not isinstance(metadata, dict):
+            raise ValueError("JSON não é um objeto")
+    except ValueError:
+        # Se não conseguir parsear, tentar extrair campos manualmente
+        metadata = {
+            "artist": None,
+            "title": filename,
+            "album": None,
+            "genre": None,
+            "year": None,
+            "obs": f"Não foi possível classificar automaticamente. Resposta da IA: {ai_response[:200]}"
+        }
 
-            # Tentar parsear o JSON da resposta
-            try:
-                # Limpar possíveis marcadores de código
-                clean_response = ai_response.strip()
-                if clean_response.startswith("```json"):
-                    clean_response = clean_response[7:]
-                if clean_response.startswith("```"):
-                    clean_response = clean_response[3:]
-                if clean_response.endswith("```"):
-                    clean_response = clean_response[:-3]
-                clean_response = clean_response.strip()
-
-                metadata = json.loads(clean_response)
-            except json.JSONDecodeError:
-                # Se não conseguir parsear, tentar extrair campos manualmente
-                metadata = {
-                    "artist": None,
-                    "title": filename,
-                    "album": None,
-                    "genre": None,
-                    "year": None,
-                    "obs": f"Não foi possível classificar automaticamente. Resposta da IA: {ai_response[:200]}"
-                }
+    # Salvar no banco de dados
+    async with aiosqlite.connect(DB_PATH) as db:
+        await save_music_metadata(db, music_id, metadata, ai_response)
+        await db.commit()
 
-            # Salvar no banco de dados
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute(
-                    """INSERT OR REPLACE INTO music_metadata
-                       (music_id, artist, title, album, genre, year, obs, raw_response, classified_at)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (
-                        music_id,
-                        metadata.get("artist"),
-                        metadata.get("title"),
-                        metadata.get("album"),
-                        metadata.get("genre"),
-                        metadata.get("year"),
-                        metadata.get("obs"),
-                        ai_response,
-                        datetime.now().isoformat()
-                    )
-                )
-                await db.commit()
+    return {
+        "success": True,
+        "music_id": music_id,
+        "filename": filename,
+        "metadata": metadata
+    }
 
-            return {
-                "success": True,
-                "music_id": music_id,
-                "filename": filename,
-                "metadata": metadata
-            }
 
-        except httpx.HTTPStatusError as e:
-            error_detail = "Erro na API OpenRouter"
-            try:
-                error_json = e.response.json()
-                error_detail = error_json.get("error", {}).get("message", str(e))
-            except:
-                pass
-            raise HTTPException(status_code=e.response.status_code, detail=error_detail)
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=500, detail=f"Erro de conexão: {str(e)}")
+# ============ CLASSIFICAÇÃO EM LOTE ============
 
+# Vários nomes de arquivo por chamada: o custo fixo do prompt (instruções e
+# latência) é pago uma vez por lote em vez de uma vez por música
+CLASSIFY_BATCH_SIZE = int(os.getenv("CLASSIFY_BATCH_SIZE", "20"))
 
-from sse_starlette.sse import EventSourceResponse
 
-@app.get("/api/ai/classify-all-stream")
-async def classify_all_music_stream(request: Request, batch_size: int = 5):
-    """Classifica todas as músicas não classificadas com progresso em tempo real (SSE)"""
+def build_batch_prompt(filenames: List[str]) -> str:
+    """Prompt com os arquivos numerados; a IA responde um array JSON com o mesmo id"""
+    listing = "\n".join(f"{i}. {name}" for i, name in enumerate(filenames, 1))
+    return f"""Analise os nomes destes arquivos de áudio e extraia as informações de cada música.
+
+Arquivos:
+{listing}
+
+Retorne APENAS um array JSON válido (sem markdown, sem código, apenas o JSON puro), com um objeto por arquivo:
+[
+    {{
+        "id": número do arquivo na lista acima,
+        "artist": "Nome do artista ou banda",
+        "title": "Título da música",
+        "album": "Nome do álbum (se identificável, senão null)",
+        "genre": "Gênero musical (se identificável, senão null)",
+        "year": "Ano (se identificável, senão null)",
+        "obs": "Observações curtas sobre a música ou artista (se conhecer, senão null)"
+    }}
+]
+
+Regras:
+- Inclua todos os {len(filenames)} arquivos, cada um com o seu "id"
+- Se o nome do arquivo contiver "artista - música", separe corretamente
+- Se não conseguir identificar algum campo, use null
+- Tente identificar o gênero musical se conhecer a música/artista
+- Responda APENAS com o array JSON, nada mais"""
+
+
+def validate_batch_entry(entry) -> Optional[dict]:
+    """Normaliza um objeto da resposta; None se não for utilizável"""
+    if not isinstance(entry, dict):
+        return None
+
+    metadata = {}
+    for field in METADATA_FIELDS:
+        value = entry.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        metadata[field] = (value.strip() or None) if isinstance(value, str) else None
+
+    if not metadata["title"] and not metadata["artist"]:
+        return None
+    return metadata
+
+
+async def classify_music_batch(items: List[dict]) -> Dict[str, dict]:
+    """
+    Classifica várias músicas ({music_id, music_name}) em uma única chamada.
+    Retorna {music_id: metadata} apenas para os itens com resposta válida;
+    os ausentes devem ser tentados de novo (em lotes menores) por quem chamou.
+    """
     if not OPENROUTER_API_KEY:
         raise HTTPException(status_code=500, detail="API Key do OpenRouter não configurada")
 
-    async def event_generator():
+    # Ignorar músicas excluídas depois da criação do job
+    ids = [item["music_id"] for item in items]
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            f"SELECT id FROM music WHERE id IN ({','.join('?' * len(ids))})", ids
+        ) as cursor:
+            existing = {row[0] for row in await cursor.fetchall()}
+
+    items = [item for item in items if item["music_id"] in existing]
+    if not items:
+        raise HTTPException(status_code=404, detail="Música não encontrada")
+
+    ai_response = await request_ai_completion(build_batch_prompt([item["music_name"] for item in items]))
+
+    try:
+        entries = parse_ai_json(ai_response)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=502, detail="Resposta da IA não é um JSON válido")
+
+    # Aceitar também {"results": [...]} ou um objeto único
+    if isinstance(entries, dict):
+        entries = next((v for v in entries.values() if isinstance(v, list)), [entries])
+    if not isinstance(entries, list):
+        raise HTTPException(status_code=502, detail="Resposta da IA não é um array JSON")
+
+    results = {}
+    for entry in entries:
+        try:
+            index = int(entry.get("id")) - 1
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if not 0 <= index < len(items) or items[index]["music_id"] in results:
+            continue
+
+        metadata = validate_batch_entry(entry)
+        if metadata:
+            results[items[index]["music_id"]] = metadata
+
+    if results:
         async with aiosqlite.connect(DB_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                """SELECT m.id, m.original_name FROM music m
-                   LEFT JOIN music_metadata mm ON m.id = mm.music_id
-                   WHERE mm.music_id IS NULL"""
-            ) as cursor:
-                unclassified = await cursor.fetchall()
+            for music_id, metadata in results.items():
+                await save_music_metadata(db, music_id, metadata, json.dumps(metadata, ensure_ascii=False))
+            await db.commit()
 
-        total = len(unclassified)
+    return results
 
-        if total == 0:
-            yield {
-                "event": "complete",
-                "data": json.dumps({"total": 0, "classified": 0, "failed": 0, "message": "Nenhuma música para classificar"})
-            }
-            return
 
-        classified = 0
-        failed = 0
+# ============ EXTRAÇÃO LOCAL DE METADADOS ============
 
-        # Enviar início
-        yield {
-            "event": "start",
-            "data": json.dumps({"total": total, "message": f"Iniciando classificação de {total} músicas..."})
-        }
+async def extract_local_metadata(items: List[dict]) -> Dict[str, dict]:
+    """
+    Resolve pelas tags do arquivo ou pelo padrão "Artista - Título" do nome,
+    sem chamar a IA. Grava e retorna {music_id: metadata} dos itens resolvidos.
+    """
+    ids = [item["music_id"] for item in items]
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            f"SELECT id, filename, original_name FROM music WHERE id IN ({','.join('?' * len(ids))})", ids
+        ) as cursor:
+            rows = await cursor.fetchall()
 
-        # Processar em batches paralelos
-        for i in range(0, total, batch_size):
-            # Verificar se cliente desconectou
-            if await request.is_disconnected():
-                return
+    # Leitura de tags é I/O de disco: fora do event loop
+    def extract_all():
+        found = {}
+        for music_id, filename, original_name in rows:
+            extracted = extract_metadata(STORAGE_DIR / filename, original_name)
+            if extracted:
+                found[music_id] = extracted
+        return found
+
+    found = await asyncio.to_thread(extract_all)
+    if not found:
+        return {}
 
-            batch = unclassified[i:i + batch_size]
+    async with aiosqlite.connect(DB_PATH) as db:
+        for music_id, (metadata, source) in found.items():
+            await save_music_metadata(db, music_id, metadata, None, source)
+        await db.commit()
 
-            # Criar tasks para processamento paralelo
-            tasks = []
-            for music in batch:
-                tasks.append(classify_single_music_with_result(music["id"], music["original_name"]))
+    return {music_id: {**metadata, "source": source} for music_id, (metadata, source) in found.items()}
 
-            # Executar batch em paralelo
-            results = await asyncio.gather(*tasks)
 
-            # Processar resultados e enviar progresso
-            for result in results:
-                if result["success"]:
-                    classified += 1
-                else:
-                    failed += 1
+# ============ JOBS DE CLASSIFICAÇÃO ============
+
+# O job roda no servidor, independente de quem o iniciou: o progresso é
+# salvo no banco e enviado por SSE e WebSocket (classification_progress)
+async def broadcast_classification_progress(data: dict):
+    await manager.broadcast({"type": "classification_progress", **data})
+
+
+classification_jobs = ClassificationJobs(
+    DB_PATH,
+    classify_batch=classify_music_batch,
+    extract_local=extract_local_metadata if os.getenv("CLASSIFY_LOCAL_FIRST", "true") != "false" else None,
+    batch_size=CLASSIFY_BATCH_SIZE,
+    on_progress=broadcast_classification_progress,
+    initial_concurrency=int(os.getenv("CLASSIFY_INITIAL_CONCURRENCY", "4")),
+    max_concurrency=int(os.getenv("CLASSIFY_MAX_CONCURRENCY", "8")),
+    max_attempts=int(os.getenv("CLASSIFY_MAX_ATTEMPTS", "3"))
+)
+
+
+@app.post("/api/ai/classify-jobs")
+async def create_classification_job():
+    """Inicia a classificação de todas as músicas não classificadas (ou retorna o job em andamento)"""
+    if not OPENROUTER_API_KEY:
+        raise HTTPException(status_code=500, detail="API Key do OpenRouter não configurada")
+    return await classification_jobs.create_job()
+
 
-                # Enviar progresso para cada música
+@app.get("/api/ai/classify-jobs")
+async def list_classification_jobs(limit: int = 20):
+    """Lista os jobs de classificação mais recentes"""
+    return await classification_jobs.list_jobs(limit)
+
+
+@app.get("/api/ai/classify-stats")
+async def get_classification_stats():
+    """Metadados por origem e chamadas à IA evitadas pela extração local"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            "SELECT COALESCE(source, 'ai'), COUNT(*) FROM music_metadata GROUP BY 1"
+        ) as cursor:
+            by_source = {row[0]: row[1] for row in await cursor.fetchall()}
+        async with db.execute(
+            "SELECT COALESCE(SUM(local_classified), 0), COALESCE(SUM(ai_requests), 0) FROM classification_jobs"
+        ) as cursor:
+            local_classified, ai_requests = await cursor.fetchone()
+
+    return {
+        "by_source": by_source,
+        "local_classified": local_classified,
+        "ai_requests": ai_requests,
+        "ai_requests_avoided": -(-local_classified // CLASSIFY_BATCH_SIZE),
+        "batch_size": CLASSIFY_BATCH_SIZE
+    }
+
+
+@app.get("/api/ai/classify-jobs/current")
+async def get_current_classification_job():
+    """Job de classificação em andamento (ou null)"""
+    job_id = await classification_jobs.running_job_id()
+    return await classification_jobs.get_job(job_id) if job_id else None
+
+
+@app.get("/api/ai/classify-jobs/{job_id}")
+async def get_classification_job(job_id: str, items: Optional[str] = None):
+    """Estado de um job; items=pending|done|failed|all inclui os itens"""
+    job = await classification_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if items:
+        job["items"] = await classification_jobs.get_items(job_id, None if items == "all" else items)
+    return job
+
+
+@app.delete("/api/ai/classify-jobs/{job_id}")
+async def cancel_classification_job(job_id: str):
+    """Cancela um job em andamento (as músicas já classificadas permanecem)"""
+    if not await classification_jobs.get_job(job_id):
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if not await classification_jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job não está em andamento")
+    return await classification_jobs.get_job(job_id)
+
+
+from sse_starlette.sse import EventSourceResponse
+
+
+def classification_job_events(request: Request, job_id: str):
+    """Eventos SSE start/progress/complete de um job; desconectar não interrompe o job"""
+    async def event_generator():
+        queue = classification_jobs.subscribe(job_id)
+        try:
+            job = await classification_jobs.get_job(job_id)
+            if job["status"] != "running":
                 yield {
-                    "event": "progress",
+                    "event": "complete",
                     "data": json.dumps({
-                        "current": classified + failed,
-                        "total": total,
-                        "classified": classified,
-                        "failed": failed,
-                        "percent": round(((classified + failed) / total) * 100),
-                        "music_name": result["name"],
-                        "artist": result.get("artist"),
-                        "title": result.get("title"),
-                        "success": result["success"],
-                        "error": result.get("error")
+                        "job_id": job_id,
+                        "status": job["status"],
+                        "total": job["total"],
+                        "classified": job["classified"],
+                        "failed": job["failed"],
+                        "message": "Nenhuma música para classificar" if job["total"] == 0
+                        else f"Concluído! {job['classified']} classificadas, {job['failed']} falhas"
                     })
                 }
+                return
 
-        # Enviar conclusão
-        yield {
-            "event": "complete",
-            "data": json.dumps({
-                "total": total,
-                "classified": classified,
-                "failed": failed,
-                "message": f"Concluído! {classified} classificadas, {failed} falhas"
-            })
-        }
+            done = job["classified"] + job["failed"]
+            message = f"Iniciando classificação de {job['total']} músicas..."
+            if done:
+                message = f"Retomando classificação: {done} de {job['total']} músicas processadas"
+            yield {
+                "event": "start",
+                "data": json.dumps({**job, "job_id": job_id, "current": done, "message": message})
+            }
+
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    continue
+
+                yield {"event": event, "data": json.dumps(data)}
+                if event == "complete":
+                    return
+        finally:
+            classification_jobs.unsubscribe(job_id, queue)
 
     return EventSourceResponse(event_generator())
 
 
-async def classify_single_music_with_result(music_id: str, music_name: str) -> dict:
-    """Classifica uma música e retorna resultado detalhado"""
-    try:
-        result = await classify_music(music_id)
-        metadata = result.get("metadata", {})
-        print(f"✓ Classificado: {music_name} -> {metadata.get('artist')} - {metadata.get('title')}")
-        return {
-            "success": True,
-            "name": music_name,
-            "artist": metadata.get("artist"),
-            "title": metadata.get("title"),
-            "genre": metadata.get("genre")
-        }
-    except Exception as e:
-        print(f"✗ Erro ao classificar {music_name}: {e}")
-        return {
-            "success": False,
-            "name": music_name,
-            "error": str(e)
-        }
+@app.get("/api/ai/classify-jobs/{job_id}/stream")
+async def stream_classification_job(request: Request, job_id: str):
+    """Progresso de um job em tempo real (SSE); pode ser reconectado a qualquer momento"""
+    if not await classification_jobs.get_job(job_id):
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return classification_job_events(request, job_id)
+
+
+@app.get("/api/ai/classify-all-stream")
+async def classify_all_music_stream(request: Request, batch_size: int = 5):
+    """
+    Classifica todas as músicas não classificadas com progresso em tempo real (SSE).
+    Cria (ou reaproveita) um job de classificação; batch_size é mantido por
+    compatibilidade, a concorrência agora é ajustada automaticamente.
+    """
+    if not OPENROUTER_API_KEY:
+        raise HTTPException(status_code=500, detail="API Key do OpenRouter não configurada")
+
+    job = await classification_jobs.create_job()
+    return classification_job_events(request, job["id"])
 
 
 @app.put("/api/music/{music_id}/metadata")
@@ -2326,7 +3605,8 @@ async def update_music_metadata(music_id: str, data: MusicMetadataUpdate):
                    genre = COALESCE(?, genre),
                    year = COALESCE(?, year),
                    obs = COALESCE(?, obs),
-                   classified_at = ?
+                   classified_at = ?,
+                   source = 'manual'
                    WHERE music_id = ?""",
                 (data.artist, data.title, data.album, data.genre, data.year, data.obs,
                  datetime.now().isoformat(), music_id)
@@ -2334,8 +3614,8 @@ async def update_music_metadata(music_id: str, data: MusicMetadataUpdate):
         else:
             # Inserir
             await db.execute(
-                """INSERT INTO music_metadata (music_id, artist, title, album, genre, year, obs, classified_at)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                """INSERT INTO music_metadata (music_id, artist, title, album, genre, year, obs, classified_at, source)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'manual')""",
                 (music_id, data.artist, data.title, data.album, data.genre, data.year, data.obs,
                  datetime.now().isoformat())
             )
@@ -2365,36 +3645,43 @@ async def clear_all_metadata():
     return {"success": True, "deleted": count}
 
 
+@app.get("/api/music/search")
+async def search_music(q: str, limit: int = 50, offset: int = 0, is_ad: Optional[bool] = None):
+    """Busca por nome, artista, título, álbum ou gênero (prefixo, sem acentos, por relevância)"""
+    limit = max(1, min(limit, 200))
+    offset = max(0, offset)
+
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        total, results = await music_search.search_music(db, q, limit, offset, is_ad)
+
+    return {
+        "query": q,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "results": results
+    }
+
+
 @app.get("/api/music/artists")
 async def get_artists():
     """Lista todos os artistas únicos"""
     async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            """SELECT DISTINCT artist, COUNT(*) as count
-               FROM music_metadata
-               WHERE artist IS NOT NULL AND artist != ''
-               GROUP BY artist
-               ORDER BY artist"""
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [{"artist": row["artist"], "count": row["count"]} for row in rows]
+        facets = await library_view.get_facets(db, "artist")
+    return [{"artist": value, "count": count} for value, count in facets]
 
 
 @app.get("/api/music/genres")
 async def get_genres():
     """Lista todos os gêneros únicos"""
     async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            """SELECT DISTINCT genre, COUNT(*) as count
-               FROM music_metadata
-               WHERE genre IS NOT NULL AND genre != ''
-               GROUP BY genre
-               ORDER BY genre"""
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [{"genre": row["genre"], "count": row["count"]} for row in rows]
+        facets = await library_view.get_facets(db, "genre")
+    return [{"genre": value, "count": count} for value, count in facets]
+
+
+LIBRARY_FACET_COLUMNS = """id, filename, original_name, is_ad, created_at, duration,
+                           artist, title, album, genre, year, obs"""
 
 
 @app.get("/api/music/by-artist/{artist}")
@@ -2403,11 +3690,10 @@ async def get_music_by_artist(artist: str):
     async with aiosqlite.connect(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
         async with db.execute(
-            """SELECT m.*, mm.artist, mm.title, mm.album, mm.genre, mm.year, mm.obs
-               FROM music m
-               JOIN music_metadata mm ON m.id = mm.music_id
-               WHERE mm.artist = ?
-               ORDER BY mm.title""",
+            f"""SELECT {LIBRARY_FACET_COLUMNS}
+                FROM library
+                WHERE artist = ?
+                ORDER BY title""",
             (artist,)
         ) as cursor:
             rows = await cursor.fetchall()
@@ -2420,11 +3706,10 @@ async def get_music_by_genre(genre: str):
     async with aiosqlite.connect(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
         async with db.execute(
-            """SELECT m.*, mm.artist, mm.title, mm.album, mm.genre, mm.year, mm.obs
-               FROM music m
-               JOIN music_metadata mm ON m.id = mm.music_id
-               WHERE mm.genre = ?
-               ORDER BY mm.artist, mm.title""",
+            f"""SELECT {LIBRARY_FACET_COLUMNS}
+                FROM library
+                WHERE genre = ?
+                ORDER BY artist, title""",
             (genre,)
         ) as cursor:
             rows = await cursor.fetchall()
@@ -2439,40 +3724,35 @@ async def websocket_endpoint(websocket: WebSocket):
     try:
         # Enviar configurações iniciais
         settings = await get_settings()
-        await websocket.send_json({
-            "type": "init",
+        await manager.send(websocket, {
+            "type": ws_protocol.INIT,
             "settings": settings
         })
 
         while True:
-            data = await websocket.receive_json()
+            data = await manager.receive(websocket)
 
             # Atualizar status do player
-            if data.get("type") == "player_status":
+            if data.get("type") == ws_protocol.PLAYER_STATUS:
                 manager.player_status = {
-                    "current_song": data.get("current_song"),
-                    "is_playing": data.get("is_playing", False),
-                    "volume": data.get("volume", 0.5),
-                    "connected": True,
-                    "position": data.get("position", 0),
-                    "duration": data.get("duration", 0),
-                    "remaining": data.get("remaining", 0)
+                    **ws_protocol.player_status(data),
+                    "connected": True
                 }
                 # Broadcast para outras conexões (interface web)
                 await manager.broadcast({
-                    "type": "player_status",
+                    "type": ws_protocol.PLAYER_STATUS,
                     **manager.player_status
                 })
 
             # Resposta a comandos
-            elif data.get("type") == "command_response":
+            elif data.get("type") == ws_protocol.COMMAND_RESPONSE:
                 await manager.broadcast(data)
 
     except WebSocketDisconnect:
         manager.disconnect(websocket)
         manager.player_status["connected"] = False
         await manager.broadcast({
-            "type": "player_status",
+            "type": ws_protocol.PLAYER_STATUS,
             **manager.player_status
         })
 
@@ -2499,4 +3779,4 @@ if __name__ == "__main__":
     print("Acesse no navegador: http://localhost:8000")
     print("Auto-reload ativado - alterações reiniciam o servidor")
     print("="*50 + "\n")
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, ws_per_message_deflate=True)
@@ -0,0 +1,147 @@
+"""
+Extração local de metadados (tags e nome do arquivo), antes da IA
+
+A maioria dos arquivos já traz tags ID3/MP4 ou segue o padrão
+"Artista - Título". Esses casos são resolvidos aqui, sem rede; só os nomes
+ambíguos seguem para a classificação por IA. Cada resultado informa a
+origem ('tags' ou 'filename'), gravada na coluna source de music_metadata.
+"""
+
+import re
+from pathlib import Path
+from typing import Optional
+
+try:
+    from mutagen import File as MutagenFile
+    MUTAGEN_AVAILABLE = True
+except ImportError:
+    MUTAGEN_AVAILABLE = False
+
+# Separadores "Artista - Título" (hífen, en dash, em dash) com espaços em volta
+_SEPARATOR = re.compile(r"\s+[-–—]\s+")
+
+# Número de faixa no início, seguido de separador: "01 - ", "01. ", "1) "
+_TRACK_NUMBER = re.compile(r"^\s*\d{1,3}\s*(?:[-–—)]|\.(?!\d))\s*")
+
+# Número solto no início ("01 Artista - Título" ou "50 Cent - Título"): ambíguo
+_BARE_NUMBER = re.compile(r"^\s*\d{1,3}\s+\S")
+
+# Sufixos comuns de arquivos baixados de vídeo: "(Official Video)", "[HD]", etc.
+_NOISE = re.compile(
+    r"\s*[(\[][^)\]]*\b(?:official|oficial|video|vídeo|clipe|clip|lyrics?|letra|"
+    r"audio|áudio|visualizer|hd|hq|4k|remaster(?:ed)?\s*\d*)\b[^)\]]*[)\]]",
+    re.IGNORECASE
+)
+
+# Valores de tag que não identificam nada
+_JUNK_VALUES = {
+    "unknown", "unknown artist", "unknown title", "artista desconhecido",
+    "desconhecido", "untitled", "sem título", "sem titulo", "track", "faixa", "audio"
+}
+_JUNK_TITLE = re.compile(r"^(?:track|faixa|audio|áudio)\s*\d*$", re.IGNORECASE)
+
+_YEAR = re.compile(r"\b(1[89]\d{2}|20\d{2})\b")
+
+
+def _fix_mojibake(value: str) -> str:
+    """Corrige UTF-8 lido como Latin-1 (ex.: 'VocÃª' -> 'Você'), comum em tags ID3 antigas"""
+    if "Ã" in value or "Â" in value:
+        try:
+            return value.encode("latin-1").decode("utf-8")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return value
+
+
+def _clean(value) -> Optional[str]:
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if value is None:
+        return None
+    value = re.sub(r"\s+", " ", _fix_mojibake(str(value))).strip()
+    if not value or value.lower() in _JUNK_VALUES:
+        return None
+    return value
+
+
+def read_tags(path: Path) -> dict:
+    """Tags artist/title/album/genre/year do arquivo (vazio se não houver)"""
+    if not MUTAGEN_AVAILABLE:
+        return {}
+
+    try:
+        audio = MutagenFile(str(path), easy=True)
+    except Exception as e:
+        print(f"[META] Erro ao ler tags de {path.name}: {e}")
+        return {}
+    if not audio or not audio.tags:
+        return {}
+
+    tags = audio.tags
+    date = _clean(tags.get("date") or tags.get("originaldate"))
+    year_match = _YEAR.search(date) if date else None
+    return {
+        "artist": _clean(tags.get("artist") or tags.get("albumartist")),
+        "title": _clean(tags.get("title")),
+        "album": _clean(tags.get("album")),
+        "genre": _clean(tags.get("genre")),
+        "year": year_match.group(1) if year_match else None
+    }
+
+
+def parse_filename(name: str) -> Optional[dict]:
+    """
+    Artista e título a partir do nome do arquivo. Só retorna quando o padrão
+    é inequívoco: exatamente um separador " - " (após remover o número da faixa).
+    Número sem separador no início pode ser faixa ou parte do artista
+    ("3 Doors Down"), então fica para a IA.
+    """
+    stem = Path(name).stem.replace("_", " ")
+    stem = _NOISE.sub("", stem)
+    if _TRACK_NUMBER.match(stem):
+        stem = _TRACK_NUMBER.sub("", stem, count=1)
+    elif _BARE_NUMBER.match(stem):
+        return None
+    stem = re.sub(r"\s+", " ", stem).strip()
+
+    parts = _SEPARATOR.split(stem)
+    if len(parts) != 2:
+        return None
+
+    artist, title = (part.strip(" -–—.") for part in parts)
+    if not artist or not title or artist.isdigit() or title.isdigit():
+        return None
+
+    return {"artist": artist, "title": title}
+
+
+def _tags_confident(tags: dict, name: str) -> bool:
+    title = tags.get("title")
+    if not tags.get("artist") or not title or _JUNK_TITLE.match(title):
+        return False
+    # Título igual ao nome do arquivo: tag preenchida automaticamente pelo encoder
+    return title.lower() != Path(name).stem.lower()
+
+
+def extract_metadata(path: Path, original_name: str) -> Optional[tuple[dict, str]]:
+    """
+    (metadata, source) quando os dados locais bastam, senão None (segue para a IA).
+    Tags completas têm prioridade; o nome do arquivo completa artista e título.
+    """
+    tags = read_tags(path) if path.exists() else {}
+    parsed = parse_filename(original_name)
+
+    if _tags_confident(tags, original_name):
+        source = "tags"
+        metadata = dict(tags)
+    elif parsed:
+        source = "filename"
+        # Álbum, gênero e ano das tags continuam valendo
+        metadata = {**tags, **parsed}
+    else:
+        return None
+
+    for field in ("artist", "title", "album", "genre", "year"):
+        metadata.setdefault(field, None)
+    metadata["obs"] = None
+    return metadata, source
@@ -0,0 +1,235 @@
+"""
+Fila de jobs de mixagem de áudio (FFmpeg) sem bloquear o event loop
+
+Cada mixagem vira um job executado em background. O FFmpeg roda como
+subprocesso assíncrono, limitado por um semáforo do tamanho do número de
+CPUs, e o progresso é lido da saída de '-progress' e repassado por callback
+(o servidor transmite via WebSocket). Jobs podem ser cancelados.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+
+class MixJobCancelled(Exception):
+    """O job foi cancelado pelo usuário"""
+
+
+class MixJobError(Exception):
+    """Falha em um job, com status HTTP sugerido para quem aguarda o resultado"""
+
+    def __init__(self, detail: str, status_code: int = 500):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+class MixJob:
+    def __init__(self, kind: str, description: str = "", parent_id: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.description = description
+        self.parent_id = parent_id  # Job de lote ao qual este item pertence
+        self.children: list[str] = []  # Jobs dos itens (quando for um lote)
+        self.status = "queued"  # queued, running, completed, failed, cancelled
+        self.stage = "queued"  # Etapa atual (tts, waiting_encoder, encoding, saving...)
+        self.progress = 0.0  # 0 a 100
+        self.created_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.error_status = 500
+
+        self._task: Optional[asyncio.Task] = None
+        self._processes: set[asyncio.subprocess.Process] = set()
+        self._done = asyncio.Event()
+        self._last_report = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "description": self.description,
+            "parent_id": self.parent_id,
+            "children": self.children,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 1),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class MixJobManager:
+    """Executa jobs de mixagem com limite de encodes simultâneos"""
+
+    def __init__(self, max_concurrent: Optional[int] = None, max_finished: int = 100,
+                 on_progress: Optional[Callable[[dict], Awaitable[None]]] = None):
+        self.max_concurrent = max_concurrent or os.cpu_count() or 1
+        self.max_finished = max_finished  # Jobs finalizados mantidos para consulta
+        self.on_progress = on_progress
+        self.jobs: dict[str, MixJob] = {}
+        self._encoder_slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def encoder_slots(self) -> asyncio.Semaphore:
+        # Criado sob demanda para ficar no event loop da aplicação
+        if self._encoder_slots is None:
+            self._encoder_slots = asyncio.Semaphore(self.max_concurrent)
+        return self._encoder_slots
+
+    def submit(self, kind: str, description: str,
+               work: Callable[[MixJob], Awaitable[dict]], parent_id: Optional[str] = None) -> MixJob:
+        """Cria o job e inicia work(job) em background"""
+        job = MixJob(kind, description, parent_id)
+        self.jobs[job.id] = job
+        job._task = asyncio.create_task(self._run(job, work))
+        self._prune()
+        return job
+
+    async def _run(self, job: MixJob, work: Callable[[MixJob], Awaitable[dict]]):
+        job.status = job.stage = "running"
+        await self.report(job, force=True)
+        try:
+            job.result = await work(job)
+            job.status = "completed"
+            job.progress = 100.0
+        except (asyncio.CancelledError, MixJobCancelled):
+            job.status = "cancelled"
+            job.error = "Cancelado"
+            job.error_status = 409
+        except MixJobError as e:
+            job.status = "failed"
+            job.error = e.detail
+            job.error_status = e.status_code
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"[MIX] Job {job.id} falhou: {e}")
+        finally:
+            job.stage = job.status
+            job.finished_at = datetime.now().isoformat()
+            job._done.set()
+            await self.report(job, force=True)
+
+    async def report(self, job: MixJob, stage: Optional[str] = None,
+                     progress: Optional[float] = None, force: bool = False):
+        """Atualiza etapa/progresso e notifica (no máximo a cada 0.5s)"""
+        if stage is not None:
+            job.stage = stage
+            force = True
+        if progress is not None:
+            job.progress = max(0.0, min(100.0, progress))
+
+        now = time.monotonic()
+        if not force and now - job._last_report < 0.5:
+            return
+        job._last_report = now
+
+        if self.on_progress:
+            try:
+                await self.on_progress(job.to_dict())
+            except Exception as e:
+                print(f"[MIX] Erro ao notificar progresso: {e}")
+
+    async def wait(self, job: MixJob) -> MixJob:
+        """Aguarda o fim do job (sem bloquear o event loop)"""
+        await job._done.wait()
+        return job
+
+    def get(self, job_id: str) -> Optional[MixJob]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancela um job em andamento (mata o FFmpeg se estiver rodando)"""
+        job = self.jobs.get(job_id)
+        if not job or job.finished:
+            return False
+
+        for process in list(job._processes):
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        if job._task:
+            job._task.cancel()
+        return True
+
+    def _prune(self):
+        """Descarta os jobs finalizados mais antigos"""
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            self.jobs.pop(job.id, None)
+
+    async def run_process(self, job: MixJob, cmd: list[str]) -> tuple[int, bytes, bytes]:
+        """Executa um processo auxiliar (ex.: ffprobe) vinculado ao job"""
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        job._processes.add(process)
+        try:
+            stdout, stderr = await process.communicate()
+        finally:
+            job._processes.discard(process)
+        return process.returncode, stdout, stderr
+
+    async def run_ffmpeg(self, job: MixJob, args: list[str], expected_duration: float,
+                         stdin_data: Optional[bytes] = None) -> tuple[int, str]:
+        """
+        Executa FFmpeg ocupando um slot de encoder. O progresso é calculado a
+        partir de out_time da saída '-progress' sobre expected_duration (segundos).
+        Retorna (returncode, stderr).
+        """
+        await self.report(job, stage="waiting_encoder")
+
+        async with self.encoder_slots:
+            await self.report(job, stage="encoding", progress=0)
+
+            cmd = ["ffmpeg", "-y", "-hide_banner", "-nostats", "-progress", "pipe:1", *args]
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            job._processes.add(process)
+
+            async def feed_stdin():
+                if stdin_data is None:
+                    return
+                try:
+                    process.stdin.write(stdin_data)
+                    await process.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    process.stdin.close()
+
+            async def read_progress():
+                async for raw_line in process.stdout:
+                    key, _, value = raw_line.decode(errors="ignore").strip().partition("=")
+                    if key in ("out_time_us", "out_time_ms") and value.isdigit() and expected_duration > 0:
+                        # out_time_ms também é em microssegundos (nome histórico do FFmpeg)
+                        seconds = int(value) / 1_000_000
+                        await self.report(job, progress=seconds / expected_duration * 100)
+
+            try:
+                _, _, stderr = await asyncio.gather(feed_stdin(), read_progress(), process.stderr.read())
+                await process.wait()
+            finally:
+                job._processes.discard(process)
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+            return process.returncode, stderr.decode(errors="ignore")
@@ -0,0 +1,179 @@
+"""
+Busca full-text na biblioteca (SQLite FTS5)
+
+Índice music_fts com nome do arquivo, artista, título, álbum e gênero,
+mantido por triggers nas tabelas music e music_metadata. O tokenizer
+unicode61 com remove_diacritics ignora acentos ("musica" encontra "Música")
+e cada termo da busca é tratado como prefixo ("legi urb" encontra "Legião
+Urbana"). O rowid do índice é o rowid da música; como um VACUUM pode
+renumerar rowids, a consistência é conferida no startup e o índice é
+reconstruído se preciso. Sem FTS5 no SQLite, a busca usa LIKE.
+"""
+
+import re
+from typing import Optional
+
+import aiosqlite
+
+FTS5_AVAILABLE = True
+
+# Pesos do bm25 por coluna (music_id, original_name, artist, title, album, genre)
+_BM25_WEIGHTS = (0.0, 1.0, 4.0, 5.0, 2.0, 1.5)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_METADATA_UPDATE = """
+    UPDATE music_fts SET artist = {ref}.artist, title = {ref}.title, album = {ref}.album, genre = {ref}.genre
+    WHERE rowid = (SELECT rowid FROM music WHERE id = {ref}.music_id)
+"""
+
+_TRIGGERS = {
+    "music_fts_ai": """
+        CREATE TRIGGER IF NOT EXISTS music_fts_ai AFTER INSERT ON music BEGIN
+            INSERT INTO music_fts (rowid, music_id, original_name, artist, title, album, genre)
+            SELECT new.rowid, new.id, new.original_name, mm.artist, mm.title, mm.album, mm.genre
+            FROM (SELECT 1) LEFT JOIN music_metadata mm ON mm.music_id = new.id;
+        END
+    """,
+    "music_fts_ad": """
+        CREATE TRIGGER IF NOT EXISTS music_fts_ad AFTER DELETE ON music BEGIN
+            DELETE FROM music_fts WHERE rowid = old.rowid;
+        END
+    """,
+    "music_fts_au": """
+        CREATE TRIGGER IF NOT EXISTS music_fts_au AFTER UPDATE OF original_name ON music BEGIN
+            UPDATE music_fts SET original_name = new.original_name WHERE rowid = new.rowid;
+        END
+    """,
+    "music_metadata_fts_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS music_metadata_fts_ai AFTER INSERT ON music_metadata BEGIN
+            {_METADATA_UPDATE.format(ref="new")};
+        END
+    """,
+    "music_metadata_fts_au": f"""
+        CREATE TRIGGER IF NOT EXISTS music_metadata_fts_au AFTER UPDATE ON music_metadata BEGIN
+            {_METADATA_UPDATE.format(ref="new")};
+        END
+    """,
+    "music_metadata_fts_ad": """
+        CREATE TRIGGER IF NOT EXISTS music_metadata_fts_ad AFTER DELETE ON music_metadata BEGIN
+            UPDATE music_fts SET artist = NULL, title = NULL, album = NULL, genre = NULL
+            WHERE rowid = (SELECT rowid FROM music WHERE id = old.music_id);
+        END
+    """,
+}
+
+
+async def init_search_index(db: aiosqlite.Connection):
+    """Cria o índice e os triggers; reconstrói o índice se estiver inconsistente"""
+    global FTS5_AVAILABLE
+
+    try:
+        await db.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS music_fts USING fts5(
+                music_id UNINDEXED, original_name, artist, title, album, genre,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+    except Exception as e:
+        FTS5_AVAILABLE = False
+        print(f"AVISO: FTS5 indisponível no SQLite ({e}) - busca usará LIKE")
+        return
+
+    for sql in _TRIGGERS.values():
+        await db.execute(sql)
+
+    # Índice novo, banco antigo ou rowids renumerados por VACUUM
+    async with db.execute("SELECT COUNT(*) FROM music") as cursor:
+        music_count = (await cursor.fetchone())[0]
+    async with db.execute("""
+        SELECT COUNT(*) FROM music_fts f JOIN music m ON m.rowid = f.rowid AND m.id = f.music_id
+    """) as cursor:
+        matched = (await cursor.fetchone())[0]
+    async with db.execute("SELECT COUNT(*) FROM music_fts") as cursor:
+        indexed = (await cursor.fetchone())[0]
+
+    if matched != music_count or indexed != music_count:
+        await rebuild_search_index(db)
+
+
+async def rebuild_search_index(db: aiosqlite.Connection):
+    """Recria todo o índice a partir de music e music_metadata"""
+    await db.execute("DELETE FROM music_fts")
+    await db.execute("""
+        INSERT INTO music_fts (rowid, music_id, original_name, artist, title, album, genre)
+        SELECT m.rowid, m.id, m.original_name, mm.artist, mm.title, mm.album, mm.genre
+        FROM music m LEFT JOIN music_metadata mm ON mm.music_id = m.id
+    """)
+    await db.execute("INSERT INTO music_fts (music_fts) VALUES ('optimize')")
+    print("[SEARCH] Índice de busca reconstruído")
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """Converte o texto digitado em uma expressão MATCH: todos os termos, como prefixo"""
+    tokens = _TOKEN.findall(query)
+    if not tokens:
+        return None
+    # Aspas evitam que palavras como AND/OR/NOT ou '-' virem operadores
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+async def search_music(db: aiosqlite.Connection, query: str, limit: int, offset: int,
+                       is_ad: Optional[bool] = None) -> tuple[int, list[dict]]:
+    """Retorna (total de resultados, página de músicas com metadados) ordenada por relevância"""
+    ad_filter = ""
+    params: list = []
+    if is_ad is not None:
+        ad_filter = "AND m.is_ad = ?"
+        params.append(1 if is_ad else 0)
+
+    columns = """m.*, mm.artist, mm.title, mm.album, mm.genre, mm.year, mm.obs, mm.classified_at, mm.source"""
+
+    if FTS5_AVAILABLE:
+        match = build_match_query(query)
+        if not match:
+            return 0, []
+
+        async with db.execute(
+            f"""SELECT COUNT(*) FROM music_fts f JOIN music m ON m.rowid = f.rowid
+                WHERE music_fts MATCH ? {ad_filter}""",
+            [match, *params]
+        ) as cursor:
+            total = (await cursor.fetchone())[0]
+
+        weights = ", ".join(str(w) for w in _BM25_WEIGHTS)
+        async with db.execute(
+            f"""SELECT {columns}, bm25(music_fts, {weights}) AS score
+                FROM music_fts f
+                JOIN music m ON m.rowid = f.rowid
+                LEFT JOIN music_metadata mm ON mm.music_id = m.id
+                WHERE music_fts MATCH ? {ad_filter}
+                ORDER BY score, m.original_name
+                LIMIT ? OFFSET ?""",
+            [match, *params, limit, offset]
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return total, [dict(row) for row in rows]
+
+    # Fallback sem FTS5: todos os termos em algum dos campos (sem ranking)
+    tokens = _TOKEN.findall(query)
+    if not tokens:
+        return 0, []
+
+    conditions = []
+    for token in tokens:
+        conditions.append(
+            "(m.original_name LIKE ? OR mm.artist LIKE ? OR mm.title LIKE ? OR mm.album LIKE ? OR mm.genre LIKE ?)"
+        )
+    like_params = [f"%{token}%" for token in tokens for _ in range(5)]
+    where = " AND ".join(conditions)
+    base = f"""FROM music m LEFT JOIN music_metadata mm ON mm.music_id = m.id WHERE {where} {ad_filter}"""
+
+    async with db.execute(f"SELECT COUNT(*) {base}", [*like_params, *params]) as cursor:
+        total = (await cursor.fetchone())[0]
+    async with db.execute(
+        f"SELECT {columns} {base} ORDER BY mm.artist, mm.title, m.original_name LIMIT ? OFFSET ?",
+        [*like_params, *params, limit, offset]
+    ) as cursor:
+        rows = await cursor.fetchall()
+    return total, [dict(row) for row in rows]
@@ -0,0 +1,212 @@
+"""
+Histórico estruturado de execuções (proof-of-play)
+
+Cada execução enviada pelo player vira uma linha em play_history e
+incrementa, na mesma transação, os resumos por hora e por dia em
+play_summary. Os relatórios (ex.: quantas vezes a propaganda X tocou no
+mês, por hora) leem apenas os resumos.
+"""
+
+from datetime import datetime, timedelta
+from typing import Optional
+
+import aiosqlite
+
+# Colunas de cada execução, na ordem usada pelo insert
+PLAY_COLUMNS = (
+    "music_id", "music_name", "event_type", "playlist_position",
+    "started_at", "ended_at", "duration_played", "completed", "skipped"
+)
+
+
+async def init_play_tables(db: aiosqlite.Connection):
+    """Cria as tabelas de histórico e resumos"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS play_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            music_id TEXT,
+            music_name TEXT,
+            event_type TEXT NOT NULL DEFAULT 'music',
+            playlist_position INTEGER,
+            started_at TIMESTAMP NOT NULL,
+            ended_at TIMESTAMP,
+            duration_played REAL DEFAULT 0,
+            completed INTEGER DEFAULT 0,
+            skipped INTEGER DEFAULT 0
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_play_history_music_started
+        ON play_history (music_id, started_at)
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_play_history_started
+        ON play_history (started_at)
+    """)
+
+    # granularity = 'hour' (bucket 'AAAA-MM-DD HH:00') ou 'day' (bucket 'AAAA-MM-DD')
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS play_summary (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            music_id TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            plays INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            seconds_played REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket, music_id, event_type)
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_play_summary_type_bucket
+        ON play_summary (granularity, event_type, bucket)
+    """)
+
+
+async def record_plays(db: aiosqlite.Connection, plays: list[dict]):
+    """Grava execuções e atualiza os resumos. Timestamps já em UTC. Não faz commit."""
+    if not plays:
+        return
+
+    await db.executemany(
+        f"""INSERT INTO play_history ({', '.join(PLAY_COLUMNS)})
+            VALUES ({', '.join('?' for _ in PLAY_COLUMNS)})""",
+        [tuple(play[column] for column in PLAY_COLUMNS) for play in plays]
+    )
+
+    summary_rows = []
+    for play in plays:
+        started_at = play["started_at"]
+        values = (
+            play["music_id"] or "",
+            play["event_type"],
+            1 if play["completed"] else 0,
+            1 if play["skipped"] else 0,
+            play["duration_played"] or 0
+        )
+        summary_rows.append(("hour", f"{started_at[:13]}:00", *values))
+        summary_rows.append(("day", started_at[:10], *values))
+
+    await db.executemany(
+        """INSERT INTO play_summary
+           (granularity, bucket, music_id, event_type, plays, completed, skipped, seconds_played)
+           VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+           ON CONFLICT(granularity, bucket, music_id, event_type) DO UPDATE SET
+               plays = plays + 1,
+               completed = completed + excluded.completed,
+               skipped = skipped + excluded.skipped,
+               seconds_played = seconds_played + excluded.seconds_played""",
+        summary_rows
+    )
+
+
+def _at_midnight(timestamp: Optional[str]) -> bool:
+    return not timestamp or timestamp[11:] in ("", "00:00:00")
+
+
+def _hour_bucket_end(timestamp: str) -> str:
+    """Limite exclusivo em buckets horários: a hora de end, incluída se end não for hora cheia"""
+    if timestamp[14:] in ("", "00:00"):
+        return f"{timestamp[:13]}:00"
+    following = datetime.strptime(timestamp[:13], "%Y-%m-%d %H") + timedelta(hours=1)
+    return following.strftime("%Y-%m-%d %H:00")
+
+
+def _shift_bucket(bucket: str, utc_offset: int, granularity: str) -> str:
+    """Converte um bucket horário UTC para o fuso local (offset em horas)"""
+    local = datetime.strptime(bucket, "%Y-%m-%d %H:%M") + timedelta(hours=utc_offset)
+    return local.strftime("%Y-%m-%d %H:00" if granularity == "hour" else "%Y-%m-%d")
+
+
+async def query_play_report(db: aiosqlite.Connection, granularity: str = "day",
+                            music_id: Optional[str] = None, event_type: Optional[str] = None,
+                            start: Optional[str] = None, end: Optional[str] = None,
+                            utc_offset: int = 0) -> list[dict]:
+    """
+    Contagens por bucket (hora/dia) e música a partir dos resumos.
+    start/end em UTC ('AAAA-MM-DD HH:MM:SS'); entram os buckets horários que
+    se sobrepõem ao intervalo [start, end). Com utc_offset != 0, ou limites
+    fora da meia-noite, os dias são montados a partir dos resumos horários.
+    """
+    # Dias em fuso local ou cortados no meio precisam dos buckets horários
+    day_aligned = _at_midnight(start) and _at_midnight(end)
+    source = "hour" if (granularity == "hour" or utc_offset or not day_aligned) else "day"
+
+    conditions = ["granularity = ?"]
+    params: list = [source]
+    if music_id:
+        conditions.append("music_id = ?")
+        params.append(music_id)
+    if event_type:
+        conditions.append("event_type = ?")
+        params.append(event_type)
+    if start:
+        conditions.append("bucket >= ?")
+        params.append(f"{start[:13]}:00" if source == "hour" else start[:10])
+    if end:
+        conditions.append("bucket < ?")
+        params.append(_hour_bucket_end(end) if source == "hour" else end[:10])
+
+    async with db.execute(
+        f"""SELECT bucket, music_id, event_type, plays, completed, skipped, seconds_played
+            FROM play_summary WHERE {' AND '.join(conditions)}
+            ORDER BY bucket""",
+        params
+    ) as cursor:
+        rows = await cursor.fetchall()
+
+    report: dict[tuple, dict] = {}
+    for bucket, row_music_id, row_event_type, plays, completed, skipped, seconds in rows:
+        if source == "hour" and (utc_offset or granularity == "day"):
+            bucket = _shift_bucket(bucket, utc_offset, granularity)
+
+        key = (bucket, row_music_id, row_event_type)
+        entry = report.get(key)
+        if entry is None:
+            entry = report[key] = {
+                "bucket": bucket,
+                "music_id": row_music_id,
+                "event_type": row_event_type,
+                "plays": 0,
+                "completed": 0,
+                "skipped": 0,
+                "seconds_played": 0.0
+            }
+        entry["plays"] += plays
+        entry["completed"] += completed
+        entry["skipped"] += skipped
+        entry["seconds_played"] += seconds
+
+    return sorted(report.values(), key=lambda e: (e["bucket"], e["music_id"]))
+
+
+async def query_play_totals(db: aiosqlite.Connection, event_type: Optional[str] = None,
+                            start: Optional[str] = None, end: Optional[str] = None) -> list[dict]:
+    """Totais por música no período (resumos diários, ou horários se os limites não forem meia-noite)"""
+    source = "day" if _at_midnight(start) and _at_midnight(end) else "hour"
+    conditions = ["ps.granularity = ?"]
+    params: list = [source]
+    if event_type:
+        conditions.append("ps.event_type = ?")
+        params.append(event_type)
+    if start:
+        conditions.append("ps.bucket >= ?")
+        params.append(f"{start[:13]}:00" if source == "hour" else start[:10])
+    if end:
+        conditions.append("ps.bucket < ?")
+        params.append(_hour_bucket_end(end) if source == "hour" else end[:10])
+
+    db.row_factory = aiosqlite.Row
+    async with db.execute(
+        f"""SELECT ps.music_id, ps.event_type, m.original_name,
+                   SUM(ps.plays) AS plays, SUM(ps.completed) AS completed,
+                   SUM(ps.skipped) AS skipped, SUM(ps.seconds_played) AS seconds_played
+            FROM play_summary ps
+            LEFT JOIN music m ON m.id = ps.music_id
+            WHERE {' AND '.join(conditions)}
+            GROUP BY ps.music_id, ps.event_type
+            ORDER BY plays DESC""",
+        params
+    ) as cursor:
+        return [dict(row) for row in await cursor.fetchall()]
@@ -0,0 +1,233 @@
+"""
+Gerador de playlist compartilhado entre servidor e cliente
+
+Este arquivo existe em server/playlist_engine.py e client/playlist_engine.py
+e as duas cópias devem ser idênticas (só biblioteca padrão).
+
+O servidor gera a playlist a partir de um "segmento": semente do sorteio,
+horário de início, duração, primeira posição e os agendamentos usados
+(propagandas, músicas agendadas e a linha do tempo de volume, ver
+volume_timeline.py). O segmento é salvo e
+enviado aos players; com ele e o catálogo (id, nome, duração, is_ad) o
+cliente gera offline exatamente a mesma sequência que o servidor planejou.
+
+O plano é {"segments": [...], "inserts": [...]}: as músicas colocadas como
+próximas (insert-next) deslocam as posições seguintes e ficam registradas
+em "inserts", com quantos segmentos existiam no momento, para que
+generate_plan as aplique na mesma ordem em que o servidor aplicou.
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import Optional
+
+from volume_timeline import VolumeTimeline, describe
+
+DEFAULT_SONG_DURATION = 180
+DEFAULT_AD_DURATION = 30
+
+PLAYABLE_EVENTS = ("music", "ad", "scheduled_song")
+
+_AD_FIELDS = ("id", "music_id", "interval_type", "interval_value", "interval_minutes", "rotation_order", "enabled")
+_SCHEDULED_FIELDS = ("id", "music_id", "scheduled_time")
+
+
+def new_seed() -> int:
+    return random.SystemRandom().getrandbits(32)
+
+
+def build_segment(seed: int, start: datetime, hours: int, from_position: int,
+                  ad_schedules: list, scheduled_songs: list, volume_timeline: list) -> dict:
+    """Segmento serializável (JSON) com tudo que a geração usa além do catálogo"""
+    return {
+        "seed": seed,
+        "start": start.isoformat(),
+        "hours": hours,
+        "from_position": from_position,
+        "ad_schedules": [{k: ad.get(k) for k in _AD_FIELDS} for ad in ad_schedules],
+        "scheduled_songs": [{k: s.get(k) for k in _SCHEDULED_FIELDS} for s in scheduled_songs],
+        "volume_timeline": volume_timeline
+    }
+
+
+def generate_playlist(segment: dict, catalogue: list) -> list[dict]:
+    """
+    Gera a playlist do segmento. Inclui músicas aleatórias, propagandas por
+    tempo/músicas, músicas agendadas e eventos de mudança de volume.
+    catalogue: músicas com id, original_name, duration e is_ad.
+    """
+    now = datetime.fromisoformat(segment["start"])
+    end_time = now + timedelta(hours=segment["hours"])
+    from_position = segment["from_position"]
+    position = from_position
+    playlist = []
+
+    by_id = {m["id"]: m for m in catalogue}
+
+    # Músicas (não propagandas) com duração, em ordem estável antes do sorteio
+    music_list = sorted(
+        (m for m in catalogue if not m.get("is_ad") and (m.get("duration") or 0) > 0),
+        key=lambda m: m["id"]
+    )
+    if not music_list:
+        return []
+
+    rng = random.Random(segment["seed"])
+    rng.shuffle(music_list)
+    music_index = 0
+
+    # Propagandas ativas cujo arquivo ainda existe, na ordem de rotação
+    ad_schedules = sorted(
+        (a for a in segment["ad_schedules"] if a.get("enabled", 1) and a["music_id"] in by_id),
+        key=lambda a: (a.get("rotation_order") or 0, a["id"])
+    )
+    time_based_ads = [a for a in ad_schedules if (a.get("interval_type") or "minutes") == "minutes"]
+    song_based_ads = [a for a in ad_schedules if a.get("interval_type") == "songs"]
+
+    scheduled_songs = [s for s in segment["scheduled_songs"] if s["music_id"] in by_id]
+
+    if "volume_timeline" in segment:
+        volume_changes = VolumeTimeline(segment["volume_timeline"]).changes(now, end_time)
+        hourly_volumes = {}
+    else:
+        # Plano gravado antes da linha do tempo: eventos a cada hora
+        volume_changes = []
+        hourly_volumes = {int(hour): volume for hour, volume in segment["hourly_volumes"].items()}
+    volume_index = 0
+
+    # Tracking de propagandas
+    last_ad_time = {ad["id"]: now for ad in time_based_ads}
+    songs_since_last_ad = 0
+    ad_rotation_index = 0
+
+    current_time = now
+    last_hour_added = -1
+
+    while current_time < end_time:
+        # Mudanças de volume até agora (entre uma música e outra)
+        while volume_index < len(volume_changes) and volume_changes[volume_index][0] <= current_time:
+            _, volume, volume_end = volume_changes[volume_index]
+            playlist.append(_item(position, None, describe(volume, volume_end), 0, current_time, "volume"))
+            position += 1
+            volume_index += 1
+
+        # Verificar mudança de volume por hora
+        current_hour = current_time.hour
+        if current_hour != last_hour_added and current_hour in hourly_volumes:
+            # Adicionar evento de volume apenas na primeira passagem de cada hora
+            if position == from_position or current_hour != now.hour:
+                playlist.append(_item(
+                    position, None,
+                    f"Volume ajustado para {int(hourly_volumes[current_hour] * 100)}%",
+                    0, current_time, "volume"
+                ))
+                position += 1
+            last_hour_added = current_hour
+
+        # Músicas agendadas para este horário
+        current_time_str = current_time.strftime("%H:%M")
+        for scheduled in scheduled_songs:
+            if scheduled["scheduled_time"] != current_time_str:
+                continue
+            music = by_id[scheduled["music_id"]]
+            duration = music.get("duration") or DEFAULT_SONG_DURATION
+            playlist.append(_item(
+                position, music["id"], music["original_name"], duration, current_time, "scheduled_song"
+            ))
+            position += 1
+            current_time += timedelta(seconds=duration)
+
+        # Verificar propaganda por tempo
+        ad_to_play = None
+        for ad in time_based_ads:
+            interval_minutes = ad.get("interval_value") or ad.get("interval_minutes") or 30
+            if (current_time - last_ad_time[ad["id"]]).total_seconds() >= interval_minutes * 60:
+                ad_to_play = ad
+                last_ad_time[ad["id"]] = current_time
+                break
+
+        # Verificar propaganda por número de músicas
+        if not ad_to_play and song_based_ads:
+            min_interval = min(a.get("interval_value") or 5 for a in song_based_ads)
+            if songs_since_last_ad >= min_interval:
+                ad_to_play = song_based_ads[ad_rotation_index % len(song_based_ads)]
+                ad_rotation_index += 1
+                songs_since_last_ad = 0
+
+        if ad_to_play:
+            ad_music = by_id[ad_to_play["music_id"]]
+            ad_duration = ad_music.get("duration") or DEFAULT_AD_DURATION
+            playlist.append(_item(
+                position, ad_music["id"], ad_music["original_name"], ad_duration, current_time, "ad"
+            ))
+            position += 1
+            current_time += timedelta(seconds=ad_duration)
+            continue
+
+        # Adicionar música aleatória
+        music = music_list[music_index % len(music_list)]
+        music_index += 1
+        playlist.append(_item(
+            position, music["id"], music["original_name"], music["duration"], current_time, "music"
+        ))
+        position += 1
+        current_time += timedelta(seconds=music["duration"])
+        songs_since_last_ad += 1
+
+    return playlist
+
+
+def generate_plan(plan: dict, catalogue: list) -> list[dict]:
+    """Playlist completa do plano: segmentos em ordem, com as inserções aplicadas"""
+    segments = plan.get("segments", [])
+    inserts = plan.get("inserts", [])
+    playlist = []
+    for count in range(len(segments) + 1):
+        if count:
+            playlist.extend(generate_playlist(segments[count - 1], catalogue))
+        for insert in inserts:
+            if insert["segments"] == count:
+                apply_insert(playlist, insert["item"])
+    return playlist
+
+
+def apply_insert(playlist: list[dict], item: dict):
+    """Insere o item na sua posição, deslocando em +1 as posições a partir dela"""
+    index = len(playlist)
+    for i, entry in enumerate(playlist):
+        if entry["position"] >= item["position"]:
+            entry["position"] += 1
+            index = min(index, i)
+    playlist.insert(index, dict(item))
+
+
+def continue_segment(segment: dict, playlist: list[dict], seed: Optional[int] = None) -> dict:
+    """Segmento seguinte: começa onde a playlist termina, com os mesmos agendamentos"""
+    if playlist:
+        last = playlist[-1]
+        start = datetime.fromisoformat(last["scheduled_time"]) + timedelta(seconds=last["duration"] or 0)
+        from_position = last["position"] + 1
+    else:
+        start = datetime.fromisoformat(segment["start"]) + timedelta(hours=segment["hours"])
+        from_position = segment["from_position"]
+
+    following = {
+        **segment,
+        "seed": seed if seed is not None else (segment["seed"] + 1) % (1 << 32),
+        "start": start.isoformat(),
+        "from_position": from_position
+    }
+    following.pop("end_position", None)  # Última posição do segmento anterior, mantida pelo servidor
+    return following
+
+
+def _item(position: int, music_id: Optional[str], music_name: str, duration: float,
+          scheduled_time: datetime, event_type: str) -> dict:
+    return {
+        "position": position,
+        "music_id": music_id,
+        "music_name": music_name,
+        "duration": duration,
+        "scheduled_time": scheduled_time.isoformat(),
+        "event_type": event_type
+    }
@@ -0,0 +1,79 @@
+"""
+Deltas versionados da playlist gerada, enviados por WebSocket
+
+Cada mudança na playlist (gerar, pular, inserir, marcar como tocada) vira
+uma mensagem playlist_delta com a versão nova e a anterior (base_version).
+Quem acompanha mantém sua cópia das próximas entradas aplicando as
+operações em ordem; se a base não bate com a versão que tem (mensagem
+perdida, reconexão) ou o epoch mudou (servidor reiniciado), busca o estado
+em /api/playlist/window e volta a seguir os deltas.
+
+Operações:
+- reset: playlist nova; items = primeiras entradas (posições recomeçam)
+- append: entradas acrescentadas ao fim
+- insert: item inserido; posições >= item.position (não tocadas) andam +1
+- played: tudo até position foi tocado
+"""
+
+import asyncio
+import uuid
+
+# Entradas enviadas em reset/append; quem precisar de mais busca /api/playlist/window
+DELTA_WINDOW = 50
+
+ITEM_FIELDS = ("position", "music_id", "music_name", "duration", "scheduled_time", "event_type")
+
+
+def compact_item(item: dict) -> dict:
+    """Só os campos que os players usam (music_id vazio das entradas de volume vira None)"""
+    compact = {field: item.get(field) for field in ITEM_FIELDS}
+    compact["music_id"] = compact["music_id"] or None
+    return compact
+
+
+def reset_op(items: list) -> dict:
+    return {"op": "reset", "items": [compact_item(item) for item in items[:DELTA_WINDOW]]}
+
+
+def append_op(items: list) -> dict:
+    return {"op": "append", "items": [compact_item(item) for item in items[:DELTA_WINDOW]]}
+
+
+def insert_op(item: dict) -> dict:
+    return {"op": "insert", "item": compact_item(item)}
+
+
+def played_op(position: int) -> dict:
+    return {"op": "played", "position": position}
+
+
+class PlaylistFeed:
+    def __init__(self):
+        # Versões recomeçam a cada start do servidor; o epoch diferencia as sequências
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+
+        # Serializa as mudanças na playlist com a publicação do delta correspondente,
+        # para a ordem das versões ser a ordem das mudanças no banco
+        self.lock = asyncio.Lock()
+
+    def next_delta(self, ops: list, pending: int) -> dict:
+        """Mensagem da próxima versão (chamar com o lock)"""
+        self.version += 1
+        return {
+            "type": "playlist_delta",
+            "epoch": self.epoch,
+            "version": self.version,
+            "base_version": self.version - 1,
+            "pending": pending,
+            "ops": ops
+        }
+
+    def state(self, items: list, pending: int) -> dict:
+        """Estado completo para (re)sincronizar (chamar com o lock)"""
+        return {
+            "epoch": self.epoch,
+            "version": self.version,
+            "pending": pending,
+            "items": [compact_item(item) for item in items]
+        }
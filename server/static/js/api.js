@@ -202,6 +202,11 @@ const API = {
         return await res.json();
     },
 
+    async getCurrentClassifyJob() {
+        const res = await fetch(`${this.baseUrl}/ai/classify-jobs/current`);
+        return await res.json();
+    },
+
     async classifyMusic(musicId) {
         return await this.post(`/ai/classify/${musicId}`);
     },
@@ -220,6 +225,13 @@ const API = {
         return await res.json();
     },
 
+    async searchMusic(query, limit = 200, offset = 0) {
+        const params = new URLSearchParams({ q: query, limit, offset });
+        const res = await fetch(`${this.baseUrl}/music/search?${params}`);
+        if (!res.ok) throw new Error('Erro na busca');
+        return await res.json();
+    },
+
     async updateMusicMetadata(musicId, data) {
         return await this.put(`/music/${musicId}/metadata`, data);
     },
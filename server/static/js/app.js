@@ -8,6 +8,7 @@ const state = {
     filteredMusic: [],
     currentFilter: 'all',
     searchQuery: '',
+    searchRanking: null, // id -> posição no resultado da busca do servidor
     hourlyVolumes: {},
     adSchedules: [],
     scheduledSongs: [],
@@ -130,10 +131,12 @@ function setupMusicLibraryListeners() {
         });
     }
 
-    // Search
+    // Search (índice full-text no servidor: prefixo, sem acentos, por relevância)
+    let searchTimer = null;
     document.getElementById('music-search')?.addEventListener('input', (e) => {
         state.searchQuery = e.target.value.toLowerCase();
-        filterMusicList();
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(runMusicSearch, 200);
     });
 
     // Filter Buttons
@@ -325,6 +328,25 @@ async function loadMusicLibrary() {
     }
 }
 
+async function runMusicSearch() {
+    const query = state.searchQuery.trim();
+    if (!query) {
+        state.searchRanking = null;
+        filterMusicList();
+        return;
+    }
+
+    try {
+        const response = await API.searchMusic(query, 200);
+        if (query !== state.searchQuery.trim()) return; // Chegou uma busca mais nova
+        state.searchRanking = new Map(response.results.map((m, i) => [m.id, i]));
+    } catch (err) {
+        console.error('Error searching music:', err);
+        state.searchRanking = null; // Busca local como fallback
+    }
+    filterMusicList();
+}
+
 function filterMusicList() {
     let filtered = state.musicList;
 
@@ -342,8 +364,12 @@ function filterMusicList() {
         filtered = filtered.filter(m => m.genre === state.selectedGroup);
     }
 
-    // Apply search (search in name, artist, title, genre)
-    if (state.searchQuery) {
+    // Apply search: resultado do servidor na ordem de relevância
+    if (state.searchQuery && state.searchRanking) {
+        filtered = filtered
+            .filter(m => state.searchRanking.has(m.id))
+            .sort((a, b) => state.searchRanking.get(a.id) - state.searchRanking.get(b.id));
+    } else if (state.searchQuery) {
         filtered = filtered.filter(m =>
             m.original_name.toLowerCase().includes(state.searchQuery) ||
             (m.artist && m.artist.toLowerCase().includes(state.searchQuery)) ||
@@ -541,6 +567,14 @@ async function checkAIStatus() {
                 classifyAllBtn.title = 'Configure OPENROUTER_API_KEY no .env';
             }
         }
+
+        // Reabrir o progresso de uma classificação em andamento no servidor
+        if (status.configured && !state.classifyEventSource) {
+            const job = await API.getCurrentClassifyJob();
+            if (job) {
+                followClassifyJob(`/api/ai/classify-jobs/${job.id}/stream`, job.total);
+            }
+        }
     } catch (err) {
         console.error('Error checking AI status:', err);
     }
@@ -590,48 +624,57 @@ async function classifyAllMusic() {
         async (confirmed) => {
             if (!confirmed) return;
 
-            // Mostrar modal de progresso
-            showClassifyProgress(unclassified.length);
-
-            // Usar EventSource para streaming
-            const eventSource = new EventSource('/api/ai/classify-all-stream?batch_size=5');
-
-            eventSource.addEventListener('start', (e) => {
-                const data = JSON.parse(e.data);
-                updateClassifyProgress(0, data.total, 0, 0, data.message);
-            });
-
-            eventSource.addEventListener('progress', (e) => {
-                const data = JSON.parse(e.data);
-                updateClassifyProgress(
-                    data.current,
-                    data.total,
-                    data.classified,
-                    data.failed,
-                    data.success
-                        ? `✓ ${data.artist || 'Desconhecido'} - ${data.title || data.music_name}`
-                        : `✗ Falha: ${data.music_name}`
-                );
-            });
-
-            eventSource.addEventListener('complete', (e) => {
-                const data = JSON.parse(e.data);
-                eventSource.close();
-                hideClassifyProgress();
-                showToast(data.message, data.failed > 0 ? 'warning' : 'success');
-                loadMusicLibrary();
-            });
-
-            eventSource.onerror = (e) => {
-                console.error('SSE Error:', e);
-                eventSource.close();
-                hideClassifyProgress();
-                showToast('Erro na conexão com o servidor', 'error');
-            };
+            followClassifyJob('/api/ai/classify-all-stream', unclassified.length);
         }
     );
 }
 
+// A classificação roda como job no servidor: fechar a página ou perder a
+// conexão não interrompe o job, e o progresso pode ser reaberto depois
+function followClassifyJob(url, total) {
+    showClassifyProgress(total);
+
+    const eventSource = new EventSource(url);
+    state.classifyEventSource = eventSource;
+
+    const close = () => {
+        eventSource.close();
+        state.classifyEventSource = null;
+        hideClassifyProgress();
+    };
+
+    eventSource.addEventListener('start', (e) => {
+        const data = JSON.parse(e.data);
+        updateClassifyProgress(data.current || 0, data.total, data.classified || 0, data.failed || 0, data.message);
+    });
+
+    eventSource.addEventListener('progress', (e) => {
+        const data = JSON.parse(e.data);
+        updateClassifyProgress(
+            data.current,
+            data.total,
+            data.classified,
+            data.failed,
+            data.success
+                ? `✓ ${data.artist || 'Desconhecido'} - ${data.title || data.music_name}`
+                : `✗ Falha: ${data.music_name}`
+        );
+    });
+
+    eventSource.addEventListener('complete', (e) => {
+        const data = JSON.parse(e.data);
+        close();
+        showToast(data.message, data.failed > 0 ? 'warning' : 'success');
+        loadMusicLibrary();
+    });
+
+    eventSource.onerror = (e) => {
+        console.error('SSE Error:', e);
+        close();
+        showToast('Conexão perdida - a classificação continua no servidor', 'warning');
+    };
+}
+
 function showClassifyProgress(total) {
     // Criar modal de progresso se não existir
     let modal = document.getElementById('classify-progress-modal');
@@ -1869,6 +1912,17 @@ function handleWsMessage(data) {
             loadSchedules();
         }
     }
+
+    if (data.type === 'playlist_delta') {
+        // O delta já traz quantas entradas faltam: sem refetch de /api/playlist
+        renderPlaylistStatus(data.pending);
+
+        const changed = data.ops.some(op => op.op !== 'played');
+        const previewView = document.getElementById('view-preview');
+        if (changed && previewView?.classList.contains('active')) {
+            loadPreview();
+        }
+    }
 }
 
 function updateConnectionStatus(connected) {
@@ -2084,29 +2138,30 @@ async function generatePlaylist() {
 
 async function updatePlaylistStatus() {
     try {
-        const response = await fetch('/api/playlist?limit=1000');
-        const playlist = await response.json();
-
-        const statusEl = document.getElementById('playlist-status');
-        const countEl = document.getElementById('playlist-count');
-
-        if (statusEl && countEl) {
-            if (playlist && playlist.length > 0) {
-                const notPlayed = playlist.filter(p => !p.played).length;
-                statusEl.textContent = '✓ Gerada';
-                statusEl.style.color = '#22c55e';
-                countEl.textContent = `${playlist.length} itens (${notPlayed} pendentes)`;
-            } else {
-                statusEl.textContent = '⚠️ Não gerada';
-                statusEl.style.color = '#f59e0b';
-                countEl.textContent = '-';
-            }
-        }
+        const response = await fetch('/api/playlist/window?limit=1');
+        const playlistWindow = await response.json();
+        renderPlaylistStatus(playlistWindow.pending);
     } catch (err) {
         console.error('Erro ao verificar playlist:', err);
     }
 }
 
+function renderPlaylistStatus(pending) {
+    const statusEl = document.getElementById('playlist-status');
+    const countEl = document.getElementById('playlist-count');
+    if (!statusEl || !countEl) return;
+
+    if (pending > 0) {
+        statusEl.textContent = '✓ Gerada';
+        statusEl.style.color = '#22c55e';
+        countEl.textContent = `${pending} itens pendentes`;
+    } else {
+        statusEl.textContent = '⚠️ Não gerada';
+        statusEl.style.color = '#f59e0b';
+        countEl.textContent = '-';
+    }
+}
+
 // Chamar ao carregar settings
 const originalLoadSettings = typeof loadSettings === 'function' ? loadSettings : null;
 async function loadSettingsWithPlaylist() {
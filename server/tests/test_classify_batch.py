@@ -0,0 +1,272 @@
+"""
+Classificação em lote contra um servidor chat-completions local
+
+O servidor falso (OPENROUTER_BASE_URL apontando para ele) lê os nomes
+numerados do prompt e responde o que cada teste definir: lote completo,
+JSON inválido, array parcial ou 429.
+"""
+
+import asyncio
+import importlib
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+LISTING_LINE = re.compile(r"^(\d+)\. (.+)$", re.MULTILINE)
+
+
+class FakeCompletions(ThreadingHTTPServer):
+    """Servidor /v1/chat/completions; respond(filenames) -> (status, conteúdo da mensagem)"""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.respond = complete
+        self.calls: list[list[str]] = []
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][0]["content"]
+        filenames = [name for _, name in LISTING_LINE.findall(prompt.split("Arquivos:")[1].split("Retorne")[0])]
+        self.server.calls.append(filenames)
+
+        status, content = self.server.respond(filenames)
+        if status == 200:
+            payload = {"choices": [{"message": {"role": "assistant", "content": content}}]}
+        else:
+            payload = {"error": {"message": content}}
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def entries_for(filenames, skip=()):
+    """Resposta correta para os arquivos "Artista - Título", exceto os de skip"""
+    entries = []
+    for i, name in enumerate(filenames, 1):
+        if name in skip:
+            continue
+        artist, title = name.rsplit(".", 1)[0].split(" - ", 1)
+        entries.append({"id": i, "artist": artist, "title": title, "album": None,
+                        "genre": "Rock", "year": 1990, "obs": None})
+    return entries
+
+
+def complete(filenames):
+    return 200, json.dumps(entries_for(filenames))
+
+
+@pytest.fixture(scope="module")
+def fake():
+    server = FakeCompletions()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="module")
+def main(fake, tmp_path_factory):
+    root = tmp_path_factory.mktemp("server")
+    os.environ.update({
+        "STORAGE_DIR": str(root / "storage"),
+        "DATA_DIR": str(root / "data"),
+        "OPENROUTER_API_KEY": "test",
+        "OPENROUTER_BASE_URL": fake.base_url,
+    })
+    module = importlib.import_module("main")
+    # Sem retry no cliente HTTP: o 429 precisa chegar ao job
+    module.openrouter_http.max_retries = 0
+    asyncio.run(module.init_db())
+    return module
+
+
+@pytest.fixture
+def songs(main, fake):
+    """Cadastra músicas novas e devolve os itens {music_id, music_name} do job"""
+    created = []
+
+    def add(*names):
+        items = []
+
+        async def insert():
+            async with main.aiosqlite.connect(main.DB_PATH) as db:
+                for name in names:
+                    music_id = f"m{len(created)}-{abs(hash(name))}"
+                    await db.execute(
+                        "INSERT INTO music (id, filename, original_name) VALUES (?, ?, ?)",
+                        (music_id, f"{music_id}.mp3", name)
+                    )
+                    created.append(music_id)
+                    items.append({"music_id": music_id, "music_name": name})
+                await db.commit()
+
+        asyncio.run(insert())
+        return items
+
+    fake.calls.clear()
+    yield add
+    fake.respond = complete
+
+    async def cleanup():
+        async with main.aiosqlite.connect(main.DB_PATH) as db:
+            marks = ",".join("?" * len(created))
+            await db.execute(f"DELETE FROM music_metadata WHERE music_id IN ({marks})", created)
+            await db.execute(f"DELETE FROM music WHERE id IN ({marks})", created)
+            await db.commit()
+
+    asyncio.run(cleanup())
+
+
+def run(main, coro):
+    """Executa com o cliente HTTP aberto no event loop do teste"""
+    async def wrapper():
+        main.openrouter_http.start()
+        try:
+            return await coro
+        finally:
+            await main.openrouter_http.close()
+    return asyncio.run(wrapper())
+
+
+def run_job(main, items, **options):
+    """Roda um job só com os itens dados (sem etapa local); retorna o job final"""
+    jobs = main.ClassificationJobs(
+        main.DB_PATH, classify_batch=main.classify_music_batch,
+        batch_size=len(items), retry_delay=0.01, rate_limit_pause=0.05, **options
+    )
+
+    async def go():
+        job_id = "t" + items[0]["music_id"][:11]
+        now = main.datetime.now().isoformat()
+        async with main.aiosqlite.connect(main.DB_PATH) as db:
+            await db.execute(
+                "INSERT INTO classification_jobs (id, total, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (job_id, len(items), now, now)
+            )
+            await db.executemany(
+                "INSERT INTO classification_job_items (job_id, music_id, music_name, updated_at) VALUES (?, ?, ?, ?)",
+                [(job_id, item["music_id"], item["music_name"], now) for item in items]
+            )
+            await db.commit()
+        await jobs._run(job_id)
+        return await jobs.get_job(job_id)
+
+    return run(main, go())
+
+
+def test_build_batch_prompt_numbers_files(main):
+    prompt = main.build_batch_prompt(["A - Um.mp3", "B - Dois.mp3"])
+    assert "1. A - Um.mp3\n2. B - Dois.mp3" in prompt
+    assert "Inclua todos os 2 arquivos" in prompt
+
+
+def test_validate_batch_entry(main):
+    assert main.validate_batch_entry({"artist": " X ", "title": "Y", "year": 1999}) == {
+        "artist": "X", "title": "Y", "album": None, "genre": None, "year": "1999", "obs": None
+    }
+    assert main.validate_batch_entry({"artist": "", "title": None, "genre": "Pop"}) is None
+    assert main.validate_batch_entry(["not", "a", "dict"]) is None
+
+
+def test_good_batch(main, fake, songs):
+    items = songs("Queen - Bohemian Rhapsody.mp3", "Legião Urbana - Tempo Perdido.mp3", "Nirvana - Lithium.mp3")
+
+    results = run(main, main.classify_music_batch(items))
+
+    assert len(fake.calls) == 1
+    assert fake.calls[0] == [item["music_name"] for item in items]
+    assert {music_id: meta["title"] for music_id, meta in results.items()} == {
+        items[0]["music_id"]: "Bohemian Rhapsody",
+        items[1]["music_id"]: "Tempo Perdido",
+        items[2]["music_id"]: "Lithium",
+    }
+    assert results[items[0]["music_id"]]["year"] == "1990"
+
+
+def test_markdown_wrapped_batch(main, fake, songs):
+    items = songs("Queen - Innuendo.mp3")
+    fake.respond = lambda filenames: (200, "```json\n" + json.dumps(entries_for(filenames)) + "\n```")
+    results = run(main, main.classify_music_batch(items))
+
+    assert results[items[0]["music_id"]]["artist"] == "Queen"
+
+
+def test_malformed_json(main, fake, songs):
+    items = songs("Queen - Radio Ga Ga.mp3", "Nirvana - Polly.mp3")
+    fake.respond = lambda filenames: (200, '[{"id": 1, "artist": "Queen", "title": ')
+    with pytest.raises(HTTPException) as raised:
+        run(main, main.classify_music_batch(items))
+
+    assert raised.value.status_code == 502
+
+
+def test_partial_array_retries_only_missing_ids(main, fake, songs):
+    items = songs(*(f"Artista {i} - Música {i}.mp3" for i in range(6)))
+    missing = {items[1]["music_name"], items[4]["music_name"]}
+    first = True
+
+    def respond(filenames):
+        nonlocal first
+        skip = missing if first else ()
+        first = False
+        return 200, json.dumps(entries_for(filenames, skip))
+
+    fake.respond = respond
+    job = run_job(main, items)
+
+    assert job["status"] == "completed"
+    assert job["classified"] == 6 and job["failed"] == 0
+    assert fake.calls[0] == [item["music_name"] for item in items]
+    # Só os dois ausentes voltam, divididos ao meio
+    assert sorted(fake.calls[1:]) == sorted([name] for name in missing)
+    assert job["ai_requests"] == 3
+
+
+def test_rate_limited_call_raises_429(main, fake, songs):
+    items = songs("Queen - Under Pressure.mp3")
+    fake.respond = lambda filenames: (429, "Rate limit exceeded")
+    with pytest.raises(HTTPException) as raised:
+        run(main, main.classify_music_batch(items))
+
+    assert raised.value.status_code == 429
+    assert raised.value.detail == "Rate limit exceeded"
+
+
+def test_job_backs_off_and_retries_after_429(main, fake, songs):
+    items = songs("Queen - Somebody to Love.mp3", "Nirvana - Breed.mp3")
+    statuses = [429]
+
+    def respond(filenames):
+        if statuses:
+            return statuses.pop(), "Rate limit exceeded"
+        return complete(filenames)
+
+    fake.respond = respond
+    job = run_job(main, items)
+
+    assert job["status"] == "completed"
+    assert job["classified"] == 2 and job["failed"] == 0
+    # O lote inteiro é repetido, sem dividir nem contar tentativa
+    assert fake.calls == [[item["music_name"] for item in items]] * 2
@@ -0,0 +1,45 @@
+"""
+Artista e título a partir do nome do arquivo
+
+Número de faixa só sai quando vem com separador; número solto no início
+pode ser parte do artista e o nome segue para a IA.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from metadata_extractor import parse_filename
+
+
+@pytest.mark.parametrize("name, artist, title", [
+    ("Legião Urbana - Tempo Perdido.mp3", "Legião Urbana", "Tempo Perdido"),
+    ("01 - Legião Urbana - Tempo Perdido.mp3", "Legião Urbana", "Tempo Perdido"),
+    ("07. Skank - Garota Nacional.mp3", "Skank", "Garota Nacional"),
+    ("3) Titãs - Epitáfio (Official Video).mp3", "Titãs", "Epitáfio"),
+    ("2Pac - Changes.mp3", "2Pac", "Changes"),
+])
+def test_parses_artist_and_title(name, artist, title):
+    assert parse_filename(name) == {"artist": artist, "title": title}
+
+
+@pytest.mark.parametrize("name", [
+    "50 Cent - In da Club.mp3",
+    "3 Doors Down - Kryptonite.mp3",
+    "14 Bis - Linda Juventude.mp3",
+    "01 Skank - Garota Nacional.mp3",
+])
+def test_leading_number_without_separator_is_ambiguous(name):
+    assert parse_filename(name) is None
+
+
+@pytest.mark.parametrize("name", [
+    "Tempo Perdido.mp3",
+    "Legião Urbana - Ao Vivo - Tempo Perdido.mp3",
+    "01 - Tempo Perdido.mp3",
+])
+def test_ambiguous_names(name):
+    assert parse_filename(name) is None
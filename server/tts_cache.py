@@ -0,0 +1,159 @@
+"""
+Cache de síntese TTS endereçado por conteúdo
+
+O mesmo anúncio costuma ser gerado várias vezes (para várias lojas) com o
+mesmo texto, voz e configurações. O áudio retornado pelo ElevenLabs é salvo
+em disco com o nome igual ao hash desses parâmetros; um novo pedido igual é
+atendido do disco sem chamar a API. O tamanho total é limitado e os itens
+menos usados recentemente são removidos primeiro (LRU).
+
+Os métodos fazem IO de disco e são chamados pelo servidor via
+asyncio.to_thread; o índice em memória é protegido por um lock.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza o texto para o hash (Unicode NFC e espaços colapsados)"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(text: str, voice_id: str, model_id: str, voice_settings: dict) -> str:
+    """Hash SHA-256 dos parâmetros que determinam o áudio gerado"""
+    payload = json.dumps(
+        [normalize_text(text), voice_id, model_id, voice_settings],
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Arquivos de áudio em cache_dir/<hash>.mp3 com limite de tamanho total"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        self.max_bytes = max_bytes
+
+        # hash -> tamanho, do menos para o mais recentemente usado
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._load()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.mp3"
+
+    def _load(self):
+        """Reconstrói o índice a partir dos arquivos (ordem LRU pelo mtime)"""
+        files = []
+        for path in self.cache_dir.glob("*.mp3"):
+            try:
+                stat = path.stat()
+                files.append((stat.st_mtime, path.stem, stat.st_size))
+            except OSError:
+                pass
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+
+        self._evict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Retorna o áudio em cache ou None"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                os.utime(path)  # Mantém a ordem LRU entre reinícios
+            except OSError:
+                # Arquivo removido por fora
+                self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def peek(self, key: str) -> Optional[Path]:
+        """Caminho do áudio em cache, sem contar como acesso (None se não houver)"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+        path = self._path(key)
+        return path if path.exists() else None
+
+    def put(self, key: str, data: bytes):
+        """Salva o áudio no cache e remove os mais antigos se passar do limite"""
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        with self._lock:
+            tmp_path = path.with_suffix(".tmp")
+            try:
+                tmp_path.write_bytes(data)
+                tmp_path.replace(path)
+            except OSError as e:
+                print(f"[TTS] Erro ao salvar no cache: {e}")
+                return
+
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    def clear(self) -> int:
+        """Remove todo o cache. Retorna quantos itens foram removidos."""
+        with self._lock:
+            removed = len(self._entries)
+            for key in list(self._entries):
+                try:
+                    self._path(key).unlink()
+                except OSError:
+                    pass
+            self._entries.clear()
+            self._total_bytes = 0
+            return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "total_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
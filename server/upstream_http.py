@@ -0,0 +1,144 @@
+"""
+Clientes HTTP compartilhados para as APIs externas (ElevenLabs, OpenRouter)
+
+Um httpx.AsyncClient por upstream, criado no startup e fechado no shutdown,
+reaproveita conexões (keep-alive, HTTP/2 quando o pacote h2 está instalado)
+em vez de abrir uma conexão TLS nova a cada chamada. Respostas 429/5xx e
+falhas de conexão são repetidas com backoff exponencial e jitter, e cada
+upstream mantém histograma de latência e contagem de erros.
+"""
+
+import asyncio
+import random
+import time
+from typing import Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401 - necessário para http2=True no httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Limites dos buckets do histograma de latência (ms)
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamClient:
+    """Cliente com pool de conexões, retry e métricas para um upstream"""
+
+    def __init__(self, name: str, base_url: str, timeout: float = 60.0,
+                 max_connections: int = 20, max_keepalive: int = 10,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 10.0):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=60.0
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Métricas
+        self.requests = 0
+        self.retries = 0
+        self.errors: dict[str, int] = {}
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_sum_ms = 0.0
+        self.latency_max_ms = 0.0
+
+    def start(self):
+        """Cria o cliente (chamar no startup da aplicação)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=HTTP2_AVAILABLE
+            )
+
+    async def close(self):
+        """Fecha as conexões (chamar no shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _record(self, elapsed_ms: float, error: Optional[str] = None):
+        self.requests += 1
+        self.latency_sum_ms += elapsed_ms
+        self.latency_max_ms = max(self.latency_max_ms, elapsed_ms)
+
+        bucket = len(LATENCY_BUCKETS_MS)
+        for i, limit in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= limit:
+                bucket = i
+                break
+        self.latency_buckets[bucket] += 1
+
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        """Backoff exponencial com jitter total, respeitando Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Executa a requisição com retry em 429/5xx e falhas de conexão.
+        Retorna a última resposta (o chamador decide com raise_for_status).
+        """
+        self.start()
+
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            response = None
+            try:
+                response = await self._client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                self._record((time.monotonic() - started) * 1000, type(e).__name__)
+                if attempt >= self.max_retries:
+                    raise
+            else:
+                error = str(response.status_code) if response.status_code >= 400 else None
+                self._record((time.monotonic() - started) * 1000, error)
+                if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    return response
+
+            delay = self._retry_delay(attempt, response)
+            attempt += 1
+            self.retries += 1
+            print(f"[HTTP] {self.name}: tentativa {attempt}/{self.max_retries} em {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        histogram = {f"le_{limit}ms": count for limit, count in zip(LATENCY_BUCKETS_MS, self.latency_buckets)}
+        histogram["gt_30000ms"] = self.latency_buckets[-1]
+        return {
+            "base_url": self.base_url,
+            "http2": HTTP2_AVAILABLE,
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": dict(self.errors),
+            "latency_avg_ms": round(self.latency_sum_ms / self.requests, 1) if self.requests else 0.0,
+            "latency_max_ms": round(self.latency_max_ms, 1),
+            "latency_histogram": histogram
+        }
@@ -0,0 +1,127 @@
+"""
+Cache do catálogo de vozes do ElevenLabs (stale-while-revalidate)
+
+A lista de vozes muda raramente, mas era buscada no upstream a cada abertura
+da tela de criação de áudio. O catálogo fica em memória e em disco: dentro
+do TTL é servido direto; depois disso continua sendo servido (stale)
+enquanto uma atualização roda em background. Os áudios de prévia das vozes
+também são guardados localmente na primeira vez que são pedidos.
+"""
+
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+
+class VoiceCatalog:
+    def __init__(self, fetch: Callable[[], Awaitable[list]], cache_path: Path,
+                 preview_dir: Path, ttl: float = 3600.0):
+        self.fetch = fetch  # Busca a lista simplificada de vozes no upstream
+        self.cache_path = Path(cache_path)
+        self.preview_dir = Path(preview_dir)
+        self.preview_dir.mkdir(exist_ok=True, parents=True)
+        self.ttl = ttl
+
+        self.voices: Optional[list] = None
+        self.fetched_at = 0.0  # time.time() da última atualização
+
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._preview_locks: dict[str, asyncio.Lock] = {}
+
+        self._load()
+
+    def _load(self):
+        """Carrega o catálogo salvo (servido como stale até a primeira atualização)"""
+        try:
+            if self.cache_path.exists():
+                saved = json.loads(self.cache_path.read_text(encoding="utf-8"))
+                self.voices = saved["voices"]
+                self.fetched_at = saved["fetched_at"]
+        except Exception as e:
+            print(f"[TTS] Erro ao carregar catálogo de vozes: {e}")
+
+    def _save(self):
+        try:
+            tmp_path = self.cache_path.with_suffix(".tmp")
+            tmp_path.write_text(
+                json.dumps({"voices": self.voices, "fetched_at": self.fetched_at}, ensure_ascii=False),
+                encoding="utf-8"
+            )
+            tmp_path.replace(self.cache_path)
+        except Exception as e:
+            print(f"[TTS] Erro ao salvar catálogo de vozes: {e}")
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    @property
+    def is_fresh(self) -> bool:
+        return self.voices is not None and self.age < self.ttl
+
+    async def _refresh(self):
+        voices = await self.fetch()
+        self.voices = voices
+        self.fetched_at = time.time()
+        self._save()
+        print(f"[TTS] Catálogo de vozes atualizado ({len(voices)} vozes)")
+
+    def refresh(self) -> asyncio.Task:
+        """Inicia (ou reaproveita) uma atualização em background"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+            self._refresh_task.add_done_callback(self._log_refresh_error)
+        return self._refresh_task
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            print(f"[TTS] Erro ao atualizar catálogo de vozes: {task.exception()}")
+
+    async def get(self, force: bool = False) -> list:
+        """
+        Retorna o catálogo. Sem cache (ou force=True) aguarda o upstream;
+        com cache vencido retorna o atual e atualiza em background.
+        """
+        if self.voices is None or force:
+            await asyncio.shield(self.refresh())
+        elif not self.is_fresh:
+            self.refresh()
+        return self.voices
+
+    def preview_path(self, voice_id: str) -> Path:
+        safe_id = "".join(c for c in voice_id if c.isalnum())
+        return self.preview_dir / f"{safe_id}.mp3"
+
+    async def get_preview(self, voice_id: str,
+                          download: Callable[[str], Awaitable[bytes]]) -> Optional[Path]:
+        """Caminho local da prévia da voz, baixando na primeira vez"""
+        path = self.preview_path(voice_id)
+        if path.exists():
+            return path
+
+        voices = await self.get()
+        voice = next((v for v in voices if v.get("voice_id") == voice_id), None)
+        if not voice or not voice.get("preview_url"):
+            return None
+
+        lock = self._preview_locks.setdefault(voice_id, asyncio.Lock())
+        async with lock:
+            if not path.exists():
+                content = await download(voice["preview_url"])
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(content)
+                tmp_path.replace(path)
+        return path
+
+    def status(self) -> dict:
+        return {
+            "voices": len(self.voices) if self.voices is not None else 0,
+            "age_seconds": round(self.age, 1) if self.voices is not None else None,
+            "ttl_seconds": self.ttl,
+            "fresh": self.is_fresh,
+            "refreshing": self._refresh_task is not None and not self._refresh_task.done(),
+            "cached_previews": len(list(self.preview_dir.glob("*.mp3")))
+        }